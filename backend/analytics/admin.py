@@ -1,7 +1,20 @@
 from django.contrib import admin
-from .models import Dataset, Record, SavedVisualization
+from .models import (
+    Dataset, Record, SavedVisualization, RenderPlanCacheEntry, DatasetProjection,
+    FieldUsage, AdvisedIndex, DatasetProfile, VisualizationSnapshot, DatasetRollup,
+    DatasetSample, AskJob,
+)
 
 # Register your models here.
 admin.site.register(Dataset)
 admin.site.register(Record)
 admin.site.register(SavedVisualization)
+admin.site.register(RenderPlanCacheEntry)
+admin.site.register(DatasetProjection)
+admin.site.register(FieldUsage)
+admin.site.register(AdvisedIndex)
+admin.site.register(DatasetProfile)
+admin.site.register(VisualizationSnapshot)
+admin.site.register(DatasetRollup)
+admin.site.register(DatasetSample)
+admin.site.register(AskJob)
@@ -0,0 +1,120 @@
+import bisect
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.utils import timezone
+
+from .models import CatalogVersion, Dataset
+from .serializers import DatasetSerializer
+
+# The dataset catalog (GET /api/datasets/) is served from a serialized
+# snapshot of every dataset, held per process and rebuilt only when the
+# catalog version moves. The version is bumped after any dataset change
+# commits (see receivers.py) and doubles as the ETag, so an unchanged
+# catalog costs one single-row query and a 304.
+
+CATALOG_FIELDS = tuple(DatasetSerializer.Meta.fields)
+CURSOR_SALT = "analytics.catalog-cursor"
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+class CatalogError(Exception):
+    pass
+
+
+class CatalogSnapshot:
+    def __init__(self, version, items):
+        self.version = version
+        self.items = items
+        self.ids = [item["id"] for item in items]
+
+
+def bump_catalog_version():
+    table = connection.ops.quote_name(CatalogVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (id, version, updated_at) VALUES (1, 1, %s) "
+            f"ON CONFLICT (id) DO UPDATE SET version = {table}.version + 1, updated_at = EXCLUDED.updated_at",
+            [timezone.now()],
+        )
+
+
+def catalog_state():
+    state, _ = CatalogVersion.objects.get_or_create(pk=1, defaults={"updated_at": timezone.now()})
+    return state
+
+
+def get_snapshot(state):
+    # The datasets are read after the version, so a snapshot is never older
+    # than the version it is stored under.
+    global _snapshot
+    with _snapshot_lock:
+        snapshot = _snapshot
+    if snapshot is not None and snapshot.version == state.version:
+        return snapshot
+    items = [dict(item) for item in DatasetSerializer(Dataset.objects.order_by("id"), many=True).data]
+    snapshot = CatalogSnapshot(state.version, items)
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version <= snapshot.version:
+            _snapshot = snapshot
+    return snapshot
+
+
+def parse_fields(value):
+    # The requested fields in catalog order; "id" is always included.
+    if not value:
+        return CATALOG_FIELDS
+    requested = {field.strip() for field in value.split(",") if field.strip()}
+    unknown = requested - set(CATALOG_FIELDS)
+    if unknown:
+        raise CatalogError(
+            f"Unknown field(s) {', '.join(sorted(unknown))}; choose from {', '.join(CATALOG_FIELDS)}."
+        )
+    return tuple(field for field in CATALOG_FIELDS if field in requested or field == "id")
+
+
+def parse_limit(value):
+    if value in (None, ""):
+        return settings.CATALOG_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise CatalogError("'limit' must be an integer.")
+    if not 1 <= limit <= settings.CATALOG_MAX_PAGE_SIZE:
+        raise CatalogError(f"'limit' must be between 1 and {settings.CATALOG_MAX_PAGE_SIZE}.")
+    return limit
+
+
+def make_cursor(after_id):
+    return signing.dumps({"after": after_id}, salt=CURSOR_SALT)
+
+
+def read_cursor(token):
+    # The id the page starts after; 0 for the first page.
+    if not token:
+        return 0
+    try:
+        return int(signing.loads(token, salt=CURSOR_SALT)["after"])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise CatalogError("Invalid cursor.")
+
+
+def catalog_etag(version, after_id, limit, fields):
+    params = hashlib.sha1(f"{after_id}:{limit}:{','.join(fields)}".encode()).hexdigest()[:12]
+    return f'"catalog-{version}-{params}"'
+
+
+def catalog_page(snapshot, after_id, limit, fields):
+    # Keyset page of the snapshot: up to ``limit`` datasets with ids above
+    # ``after_id``, and the cursor of the next page (None on the last one).
+    start = bisect.bisect_right(snapshot.ids, after_id)
+    items = snapshot.items[start:start + limit]
+    if fields != CATALOG_FIELDS:
+        items = [{field: item[field] for field in fields} for item in items]
+    next_cursor = make_cursor(items[-1]["id"]) if start + limit < len(snapshot.ids) else None
+    return items, next_cursor
@@ -0,0 +1,184 @@
+import datetime
+import re
+
+import numpy as np
+from django.conf import settings
+
+# Post-processing for chart blocks: long date series are bucketed by time,
+# long line series are reduced with LTTB, and pie/bar charts with many
+# categories keep the top N plus an "Other" slice. Everything runs on whole
+# NumPy columns.
+
+OTHER_LABEL = "Other"
+MEAN_LIKE = re.compile(r"(^|_)(avg|average|mean|median|rate|ratio|pct|percent|percentage|share)(_|$)", re.I)
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+ISO_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}(:?\d{2})?)?$")
+DATETIME_TZ = re.compile(r"(Z|[+-]\d{2}(:?\d{2})?)$")
+
+# Finest to coarsest; a date axis gets the finest grain that fits.
+TIME_GRAINS = ("hour", "day", "week", "month", "quarter", "year")
+
+
+def _numeric_column(rows, column):
+    try:
+        values = np.array([row.get(column) for row in rows], dtype=float)
+    except (TypeError, ValueError):
+        return None
+    return values
+
+
+def _datetime_column(rows, column):
+    # datetime64 array for an axis of dates/datetimes (ISO strings or date
+    # objects), or None if any value isn't one.
+    values = [row.get(column) for row in rows]
+    if all(isinstance(v, datetime.date) and not isinstance(v, datetime.datetime) for v in values):
+        return np.array(values, dtype="datetime64[D]")
+    if all(isinstance(v, datetime.datetime) for v in values):
+        return np.array([v.replace(tzinfo=None) for v in values], dtype="datetime64[s]")
+    if not all(isinstance(v, str) for v in values):
+        return None
+    if all(ISO_DATE.match(v) for v in values):
+        return np.array(values, dtype="datetime64[D]")
+    if all(ISO_DATETIME.match(v) for v in values):
+        return np.array([DATETIME_TZ.sub("", v).replace(" ", "T") for v in values], dtype="datetime64[s]")
+    return None
+
+
+def _aggregation(column):
+    return "mean" if MEAN_LIKE.search(column or "") else "sum"
+
+
+def truncate_time(values, grain):
+    if grain == "hour":
+        return values.astype("datetime64[h]")
+    days = values.astype("datetime64[D]")
+    if grain == "day":
+        return days
+    if grain == "week":
+        # Weeks start on Monday; 1970-01-01 was a Thursday.
+        return days - (days.astype(np.int64) + 3) % 7
+    months = values.astype("datetime64[M]")
+    if grain == "month":
+        return months
+    if grain == "quarter":
+        return months - months.astype(np.int64) % 3
+    return values.astype("datetime64[Y]")
+
+
+def _time_label(bucket, grain):
+    if grain == "hour":
+        return str(np.datetime_as_string(bucket, unit="h")).replace("T", " ") + ":00"
+    if grain in ("day", "week"):
+        return str(np.datetime_as_string(bucket, unit="D"))
+    if grain == "month":
+        return str(np.datetime_as_string(bucket, unit="M"))
+    if grain == "quarter":
+        year, month = str(np.datetime_as_string(bucket, unit="M")).split("-")
+        return f"{year}-Q{(int(month) - 1) // 3 + 1}"
+    return str(np.datetime_as_string(bucket, unit="Y"))
+
+
+def time_bucket(x, times, numeric_columns, max_points):
+    # Groups rows into the finest time grain with at most max_points buckets,
+    # summing (or averaging, for mean-like columns) every numeric column.
+    has_time = times.dtype != np.dtype("datetime64[D]")
+    for grain in TIME_GRAINS[0 if has_time else 1:]:
+        buckets = truncate_time(times, grain)
+        keys, inverse = np.unique(buckets, return_inverse=True)
+        if len(keys) <= max_points:
+            break
+    counts = np.bincount(inverse, minlength=len(keys))
+
+    columns = {}
+    for column, values in numeric_columns.items():
+        valid = ~np.isnan(values)
+        totals = np.bincount(inverse[valid], weights=values[valid], minlength=len(keys))
+        if _aggregation(column) == "mean":
+            present = np.bincount(inverse[valid], minlength=len(keys))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                totals = np.where(present > 0, totals / present, np.nan)
+        columns[column] = totals
+
+    data = []
+    for i, key in enumerate(keys):
+        row = {x: _time_label(key, grain)}
+        for column, totals in columns.items():
+            row[column] = None if np.isnan(totals[i]) else float(totals[i])
+        data.append(row)
+    return data, {"method": "time_bucket", "grain": grain, "rows_per_bucket_max": int(counts.max())}
+
+
+def lttb(xs, ys, threshold):
+    # Largest-Triangle-Three-Buckets: indexes of the points to keep. The first
+    # and last points are always kept; each bucket keeps the point forming the
+    # largest triangle with the previously kept point and the next bucket's mean.
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xs[next_start:next_end].mean() if next_end > next_start else xs[-1]
+        avg_y = ys[next_start:next_end].mean() if next_end > next_start else ys[-1]
+        areas = np.abs(
+            (xs[previous] - avg_x) * (ys[start:end] - ys[previous])
+            - (xs[previous] - xs[start:end]) * (avg_y - ys[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        keep[i + 1] = previous
+    return keep
+
+
+def top_n(rows, x, y, values, limit):
+    # Keeps the ``limit - 1`` largest categories (by |y|) and folds the rest
+    # into one "Other" row.
+    order = np.argsort(-np.abs(np.nan_to_num(values)), kind="stable")
+    kept, rest = order[:limit - 1], order[limit - 1:]
+    rest_values = values[rest][~np.isnan(values[rest])]
+    if _aggregation(y) == "mean":
+        other = float(rest_values.mean()) if len(rest_values) else None
+    else:
+        other = float(rest_values.sum())
+    data = [rows[i] for i in np.sort(kept)]
+    data.append({x: OTHER_LABEL, y: other})
+    return data, {"method": "top_n", "other_categories": int(len(rest))}
+
+
+def downsample_chart(chart_type, x, y, rows):
+    # Returns (rows, info); info is None when the rows are left as they are.
+    if not rows or not x or not y or x not in rows[0] or y not in rows[0]:
+        return rows, None
+    ys = _numeric_column(rows, y)
+    if ys is None:
+        return rows, None
+
+    original = len(rows)
+    max_points = settings.CHART_MAX_POINTS
+    times = _datetime_column(rows, x)
+    # Bars over a date axis are a time series; slices and other bars are categories.
+    categorical = chart_type == "pie" or (chart_type == "bar" and times is None)
+
+    if times is not None and chart_type in ("line", "bar") and original > max_points:
+        numeric_columns = {
+            column: values for column in rows[0]
+            if column != x and (values := _numeric_column(rows, column)) is not None
+        }
+        data, info = time_bucket(x, times, numeric_columns, max_points)
+    elif chart_type == "line" and original > max_points:
+        xs = _numeric_column(rows, x)
+        if xs is None or np.isnan(xs).any():
+            xs = np.arange(original, dtype=float)
+        order = np.argsort(xs, kind="stable")
+        points = order[lttb(xs[order], np.nan_to_num(ys[order]), max_points)]
+        data, info = [rows[i] for i in points], {"method": "lttb"}
+    elif categorical and original > settings.CHART_MAX_CATEGORIES:
+        data, info = top_n(rows, x, y, ys, settings.CHART_MAX_CATEGORIES)
+    else:
+        return rows, None
+
+    info.update({"original_rows": original, "rows": len(data)})
+    return data, info
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .charts import downsample_chart
+from .executor import REJECTED, block_deadline_seconds, run_blocks, submit_blocks, timeout_result
+from .instrumentation import span
+from .intents import lookup_intent
+from .llm_service import aanalyze_prompt_with_llm, analyze_prompt_with_llm
+from .pagination import finish_page, page_mode, page_sql
+from .plan_cache import get_plan_cache
+from .result_cache import get_result_cache
+from .rollup import get_active_rollup, rewrite_for_rollup
+from .sampling import get_active_sample, rewrite_for_sample, sample_info
+
+BLOCK_RENDER_TYPES = ("kpi", "chart", "table")
+# Tables list rows, so only aggregates are ever estimated from the sample.
+APPROXIMATE_RENDER_TYPES = ("kpi", "chart")
+
+
+class RenderPlanError(Exception):
+    pass
+
+
+def parse_render_plan(raw_llm_output):
+    # Raises json.JSONDecodeError for unparseable output and RenderPlanError
+    # for JSON that isn't a list of blocks.
+    try:
+        parsed_blocks = json.loads(raw_llm_output)
+    except json.JSONDecodeError:
+        cleaned = re.sub(r"```json|```", "", raw_llm_output).strip()
+        parsed_blocks = json.loads(cleaned)
+
+    if not isinstance(parsed_blocks, list):
+        raise RenderPlanError("AI returned an unexpected format (expected a JSON array of blocks).")
+    return parsed_blocks
+
+
+def get_render_plan(prompt, dataset):
+    # Returns (render_plan, source): "intent" when the local intent matcher
+    # understood the prompt, else the plan cache status ("hit",
+    # "semantic_hit", or "miss" for a plan the LLM just made). A missed plan
+    # isn't cached until its blocks have run; see remember_render_plan.
+    if settings.INTENT_MATCHING_ENABLED:
+        with span("intent"):
+            parsed_blocks = lookup_intent(prompt, dataset)
+        if parsed_blocks is not None:
+            return parsed_blocks, "intent"
+
+    render_plan_cache = get_plan_cache()
+    with span("plan_cache"):
+        parsed_blocks, plan_cache_status = render_plan_cache.lookup(prompt, dataset)
+
+    if parsed_blocks is None:
+        raw_llm_output = analyze_prompt_with_llm(prompt=prompt, dataset=dataset)
+        with span("parse"):
+            parsed_blocks = parse_render_plan(raw_llm_output)
+
+    return parsed_blocks, plan_cache_status
+
+
+async def aget_render_plan(prompt, dataset):
+    if settings.INTENT_MATCHING_ENABLED:
+        with span("intent"):
+            parsed_blocks = lookup_intent(prompt, dataset)
+        if parsed_blocks is not None:
+            return parsed_blocks, "intent"
+
+    render_plan_cache = get_plan_cache()
+    with span("plan_cache"):
+        parsed_blocks, plan_cache_status = await sync_to_async(render_plan_cache.lookup)(prompt, dataset)
+
+    if parsed_blocks is None:
+        raw_llm_output = await aanalyze_prompt_with_llm(prompt=prompt, dataset=dataset)
+        with span("parse"):
+            parsed_blocks = parse_render_plan(raw_llm_output)
+
+    return parsed_blocks, plan_cache_status
+
+
+def remember_render_plan(prompt, dataset, parsed_blocks, plan_cache_status, assembled_blocks):
+    # Caches a plan the LLM just made once every block has rendered, so a
+    # plan with broken SQL or unknown blocks is asked for again rather than
+    # served from the cache. Timeouts and rejections are down to load, not
+    # the plan, so they don't keep it out.
+    if plan_cache_status != "miss" or len(assembled_blocks) != len(parsed_blocks):
+        return
+    if any(_query_error(block.get("error")) for block in assembled_blocks):
+        return
+    get_plan_cache().store(prompt, dataset, parsed_blocks)
+
+
+def _table_page_mode(block):
+    if block.get("render") != "table":
+        return None
+    return page_mode((block.get("sql") or "").strip())
+
+
+def block_sql_list(parsed_blocks):
+    # Table blocks run their first page; the rest run as written.
+    sql_list = []
+    for block in parsed_blocks:
+        if block.get("render") not in BLOCK_RENDER_TYPES:
+            sql_list.append(None)
+            continue
+        sql = (block.get("sql") or "").strip()
+        mode = _table_page_mode(block)
+        sql_list.append(page_sql(sql, mode, 0) if mode else sql)
+    return sql_list
+
+
+def plan_approximation(parsed_blocks, sql_list, dataset):
+    # Returns (sql_list, approximations): KPI and chart SQL rewritten to run on
+    # the dataset's sample, and {index: sample info} for the rewritten blocks.
+    # Blocks with an exact result already cached, or that the rollup cube
+    # answers exactly, keep their SQL.
+    sample = get_active_sample(dataset.id, dataset.data_version)
+    if sample is None:
+        return sql_list, {}
+    rollup = get_active_rollup(dataset.id, dataset.data_version) if settings.ROLLUP_QUERY_REWRITE else None
+    result_cache = get_result_cache()
+
+    approximate_sql = list(sql_list)
+    approximations = {}
+    for i, sql in enumerate(sql_list):
+        if sql is None or parsed_blocks[i].get("render") not in APPROXIMATE_RENDER_TYPES:
+            continue
+        if result_cache.get(sql, dataset.id, dataset.data_version) is not None:
+            continue
+        if rollup is not None and rewrite_for_rollup(sql, rollup) is not None:
+            continue
+        sample_sql = rewrite_for_sample(sql, sample)
+        if sample_sql is not None:
+            approximate_sql[i] = sample_sql
+            approximations[i] = sample_info(sample)
+    return approximate_sql, approximations
+
+
+def _only(sql_list, indexes):
+    return [sql if i in indexes else None for i, sql in enumerate(sql_list)]
+
+
+def _query_error(warning):
+    # Whether a block's warning is an error in its query, rather than it
+    # timing out or being turned away by admission control.
+    return (
+        warning is not None
+        and "statement timeout" not in warning
+        and "timed out" not in warning
+        and not warning.startswith(REJECTED)
+    )
+
+
+def _sample_query_failed(result):
+    # Sample queries that errored are rerun exactly.
+    return _query_error(result[2])
+
+
+def assemble_block(i, block, result, dataset=None, approximation=None):
+    # Returns (assembled_block, warning); assembled_block is None for blocks
+    # that are skipped. ``approximation`` is the sample info for blocks whose
+    # result was estimated from the dataset's sample.
+    render_type = block.get("render")
+    title = block.get("title", f"Block {i + 1}")
+
+    if render_type not in BLOCK_RENDER_TYPES:
+        return None, f"Block '{title}': unknown render type '{render_type}' — skipped."
+
+    columns, data, warning = result
+    if warning:
+        return {
+            "render": render_type,
+            "title": title,
+            "error": warning,
+        }, f"Block '{title}': {warning}"
+
+    # --- KPI block ---
+    if render_type == "kpi":
+        # KPI: first column of first row is the value
+        value = data[0][columns[0]] if data else None
+        kpi = {
+            "render": "kpi",
+            "title": title,
+            "value": value,
+            "value_label": columns[0] if columns else None,
+        }
+        if approximation is not None:
+            # Estimated value ± margin at 95% confidence.
+            margin = data[0].get(f"{columns[0]}_margin") if data else None
+            kpi.update({"approximate": True, "margin": margin, "approximation": approximation})
+        return kpi, None
+
+    # --- Chart block ---
+    if render_type == "chart":
+        chart_type, x_axis, y_axis = block.get("chart_type"), block.get("x_axis"), block.get("y_axis")
+        with span("downsample", rows=len(data)):
+            chart_data, downsampling = downsample_chart(chart_type, x_axis, y_axis, data)
+        chart = {
+            "render": "chart",
+            "title": title,
+            "chart_type": chart_type,
+            "x_axis": x_axis,
+            "y_axis": y_axis,
+            "data": chart_data,
+            "columns": columns,
+            "original_row_count": len(data),
+            "downsampling": downsampling,
+        }
+        if approximation is not None:
+            # Each row carries its own margin in "<y_axis>_margin" when the
+            # y column is a single COUNT/SUM/AVG.
+            margin_column = f"{y_axis}_margin"
+            chart.update({
+                "approximate": True,
+                "margin_column": margin_column if margin_column in columns else None,
+                "approximation": approximation,
+            })
+        return chart, None
+
+    # --- Table block ---
+    next_cursor = None
+    mode = _table_page_mode(block)
+    if mode and dataset is not None:
+        columns, data, _, next_cursor = finish_page(
+            result, block["sql"].strip(), mode, 0, dataset.id, dataset.data_version,
+        )
+    return {
+        "render": "table",
+        "title": title,
+        "data": data,
+        "columns": columns,
+        "next_cursor": next_cursor,
+    }, None
+
+
+def build_dashboard(parsed_blocks, dataset, approximate=False, refine=False):
+    # With ``approximate``, KPI and chart blocks are estimated from the
+    # dataset's sample when one is active; with ``refine`` as well, their
+    # exact queries then run in the background and warm the result cache, so
+    # the next ask of the same plan is answered exactly.
+    sql_list = block_sql_list(parsed_blocks)
+    run_sql, approximations = sql_list, {}
+    if approximate:
+        run_sql, approximations = plan_approximation(parsed_blocks, sql_list, dataset)
+
+    block_results = run_blocks(run_sql, dataset.id, data_version=dataset.data_version)
+    failed = {i for i in approximations if _sample_query_failed(block_results[i])}
+    if failed:
+        exact_results = run_blocks(_only(sql_list, failed), dataset.id, data_version=dataset.data_version)
+        for i in failed:
+            block_results[i] = exact_results[i]
+            del approximations[i]
+    if approximations and refine:
+        submit_blocks(_only(sql_list, approximations), dataset.id, data_version=dataset.data_version)
+
+    assembled_blocks = []
+    warnings = []
+    for i, block in enumerate(parsed_blocks):
+        assembled, warning = assemble_block(i, block, block_results[i], dataset, approximations.get(i))
+        if assembled is not None:
+            assembled_blocks.append(assembled)
+        if warning:
+            warnings.append(warning)
+    return assembled_blocks, warnings
+
+
+async def _completed_blocks(futures):
+    # Yields (index, result) as block futures complete, in completion order;
+    # blocks still running at the deadline are cancelled and yield a timeout.
+    async def indexed(i, future):
+        return i, await asyncio.wrap_future(future)
+
+    pending = {i: asyncio.ensure_future(indexed(i, future)) for i, future in futures.items()}
+    try:
+        for next_done in asyncio.as_completed(list(pending.values()), timeout=block_deadline_seconds()):
+            i, result = await next_done
+            del pending[i]
+            yield i, result
+    except asyncio.TimeoutError:
+        for i, task in sorted(pending.items()):
+            task.cancel()
+            futures[i].cancel()
+            yield i, timeout_result()
+
+
+def dump_event(event):
+    # Block rows can hold dates and decimals.
+    return json.dumps(event, cls=DjangoJSONEncoder)
+
+
+async def stream_dashboard(prompt, dataset, approximate=False, refine=False):
+    # Yields dashboard events as they become available:
+    #   {"type": "plan", "plan_cache": ..., "block_count": n}
+    #   {"type": "block", "index": i, "block": {...}}   (in completion order)
+    #   {"type": "warning", "index": i, "warning": "..."}
+    #   {"type": "done", "warnings": [...]}
+    # or a single {"type": "error", "error": "..."} if no plan could be made.
+    # With ``approximate``, blocks estimated from the sample come first; with
+    # ``refine`` as well, each is followed (before "done") by a second "block"
+    # event for the same index carrying the exact result.
+    try:
+        parsed_blocks, plan_cache_status = await aget_render_plan(prompt, dataset)
+    except json.JSONDecodeError:
+        yield {"type": "error", "error": "AI returned unparseable JSON."}
+        return
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+        return
+
+    yield {"type": "plan", "plan_cache": plan_cache_status, "block_count": len(parsed_blocks)}
+
+    warnings = []
+    sql_list = block_sql_list(parsed_blocks)
+    run_sql, approximations = sql_list, {}
+    if approximate:
+        run_sql, approximations = await sync_to_async(plan_approximation)(parsed_blocks, sql_list, dataset)
+    futures = await sync_to_async(submit_blocks)(run_sql, dataset.id, data_version=dataset.data_version)
+
+    pending = {}
+    for i, future in enumerate(futures):
+        if future is None:
+            _, warning = assemble_block(i, parsed_blocks[i], None)
+            warnings.append(warning)
+            yield {"type": "warning", "index": i, "warning": warning}
+        else:
+            pending[i] = future
+
+    exact = set()
+    rendered = {}
+    async for i, result in _completed_blocks(pending):
+        if i in approximations and _sample_query_failed(result):
+            # Held back; the exact result is streamed instead.
+            exact.add(i)
+            continue
+        assembled, warning = assemble_block(i, parsed_blocks[i], result, dataset, approximations.get(i))
+        if warning:
+            warnings.append(warning)
+        rendered[i] = assembled
+        yield {"type": "block", "index": i, "block": assembled}
+
+    if refine:
+        exact |= set(approximations)
+    if exact:
+        futures = await sync_to_async(submit_blocks)(
+            _only(sql_list, exact), dataset.id, data_version=dataset.data_version,
+        )
+        async for i, result in _completed_blocks({i: futures[i] for i in exact}):
+            assembled, warning = assemble_block(i, parsed_blocks[i], result, dataset)
+            if warning:
+                warnings.append(warning)
+            rendered[i] = assembled
+            yield {"type": "block", "index": i, "block": assembled}
+
+    await sync_to_async(remember_render_plan)(
+        prompt, dataset, parsed_blocks, plan_cache_status, list(rendered.values()),
+    )
+    yield {"type": "done", "warnings": warnings}
@@ -0,0 +1,320 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import connection, close_old_connections, transaction
+
+from .fusion import fuse_blocks, fusion_groups, parse_block, split_fused
+from .index_advisor import record_field_usage
+from .instrumentation import log_slow_query, metrics, span
+from .projection import get_active_projection, rewrite_for_projection
+from .query_guard import QueryRejected, check_query
+from .result_cache import get_result_cache
+from .rollup import get_active_rollup, rewrite_for_rollup
+
+logger = logging.getLogger(__name__)
+
+ROW_LIMIT = 500
+NUMERIC_OID = 1700
+REJECTED = "Query rejected"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def serialize_rows(description, rows):
+    # Converts NUMERIC columns (which psycopg2 returns as Decimal) to float a
+    # whole column at a time, picked from the cursor description rather than
+    # by type-checking every cell.
+    columns = [col[0] for col in description]
+    numeric = [i for i, col in enumerate(description) if col[1] == NUMERIC_OID]
+    if numeric and rows:
+        values = [list(column) for column in zip(*rows)]
+        for i in numeric:
+            values[i] = [None if v is None else float(v) for v in values[i]]
+        rows = zip(*values)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def enforce_row_limit(sql):
+    sql_stripped = sql.rstrip().rstrip(";").rstrip()
+    upper = sql_stripped.upper()
+    if "LIMIT" not in upper:
+        return f"{sql_stripped} LIMIT {ROW_LIMIT}"
+    return sql_stripped
+
+
+def _execute(sql, dataset_id, timeout_ms, max_rows=None):
+    # Runs one statement in its own transaction; returns (description, rows).
+    with transaction.atomic(), connection.cursor() as cursor:
+        if timeout_ms:
+            # SET LOCAL scopes the timeout to this block's transaction only.
+            cursor.execute("SET LOCAL statement_timeout = %s", [int(timeout_ms)])
+        if settings.QUERY_GUARD_ENABLED:
+            with span("explain"):
+                check_query(cursor, sql, [dataset_id])
+        with span("sql", dataset_id=dataset_id, sql=sql) as query:
+            cursor.execute(sql, [dataset_id])
+            rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+            query["rows"] = len(rows)
+        log_slow_query(sql, dataset_id, query.get("duration_ms", 0), len(rows))
+        return cursor.description, rows
+
+
+def execute_block_sql(raw_sql, dataset_id, timeout_ms=None):
+    if not raw_sql.upper().startswith("SELECT"):
+        return None, None, f"{REJECTED}: only SELECT statements are permitted."
+
+    secured_sql = enforce_row_limit(raw_sql)
+
+    try:
+        description, rows = _execute(secured_sql, dataset_id, timeout_ms, ROW_LIMIT)
+        columns = [col[0] for col in description]
+        with span("serialize", rows=len(rows)):
+            data = serialize_rows(description, rows)
+        return columns, data, None
+    except QueryRejected as e:
+        logger.warning("Block SQL rejected for dataset %s (%s): %s", dataset_id, e, secured_sql)
+        return None, None, f"{REJECTED}: {e}."
+    except Exception as e:
+        return None, None, f"SQL execution error: {str(e)}"
+
+
+def execute_fused_sql(fused, sql, dataset_id, timeout_ms=None):
+    # Runs a fused query (see fusion.py) and splits its rows back into the
+    # blocks': ({block index: (columns, data, None)}, None), or (None, warning).
+    # The fused WHERE keeps at most each block's limit, so rows aren't capped.
+    try:
+        description, rows = _execute(sql, dataset_id, timeout_ms)
+    except QueryRejected as e:
+        logger.warning("Fused block SQL rejected for dataset %s (%s): %s", dataset_id, e, sql)
+        return None, f"{REJECTED}: {e}."
+    except Exception as e:
+        return None, f"SQL execution error: {str(e)}"
+    results = {}
+    with span("serialize", rows=len(rows)):
+        for i, (block_description, block_rows) in split_fused(fused, description, rows).items():
+            columns = [col[0] for col in block_description]
+            results[i] = (columns, serialize_rows(block_description, block_rows), None)
+    return results, None
+
+
+def get_block_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.BLOCK_EXECUTOR_MAX_WORKERS,
+                thread_name_prefix="block-executor",
+            )
+    return _pool
+
+
+def _record_usage(dataset_id, sql_list):
+    if sql_list and settings.INDEX_ADVISOR_TRACK_USAGE:
+        try:
+            record_field_usage(dataset_id, sql_list)
+        except Exception:
+            logger.exception("Failed to record field usage for dataset %s", dataset_id)
+
+
+def _run_block(sql, executable_sql, dataset_id, data_version, timeout_ms):
+    result = execute_block_sql(executable_sql, dataset_id, timeout_ms)
+    if (
+        result[2] is not None
+        and executable_sql != sql
+        and "statement timeout" not in result[2]
+        and not result[2].startswith(REJECTED)
+    ):
+        # A rewrite the rollup/projection can't actually serve; run as written.
+        logger.warning("Rewritten block SQL failed (%s); running the original", result[2])
+        result = execute_block_sql(sql, dataset_id, timeout_ms)
+    if result[2] is None:
+        if data_version is not None:
+            get_result_cache().set(sql, dataset_id, data_version, result[0], result[1])
+        _record_usage(dataset_id, [sql])
+    return result
+
+
+def _run_fused(fused, members, dataset_id, data_version, timeout_ms, projection):
+    # Runs the blocks in ``members`` ({index: _run_block arguments}) as one
+    # fused query, on the typed projection when it can serve it; returns
+    # {index: (columns, data, warning)}. A fused query that fails for any
+    # reason but a timeout falls back to running the blocks one by one.
+    results = warning = None
+    executable_sql = rewrite_for_projection(fused.sql, projection) if projection is not None else None
+    if executable_sql is not None:
+        results, warning = execute_fused_sql(fused, executable_sql, dataset_id, timeout_ms)
+        if results is None and "statement timeout" not in warning:
+            logger.warning("Rewritten fused SQL failed (%s); running it on analytics_record", warning)
+            executable_sql = None
+    if executable_sql is None:
+        results, warning = execute_fused_sql(fused, fused.sql, dataset_id, timeout_ms)
+    if results is None:
+        if "statement timeout" in warning:
+            return {i: (None, None, warning) for i in members}
+        logger.warning("Fused block SQL failed (%s); running its %s blocks separately", warning, len(members))
+        return {i: _run_block(*args) for i, args in members.items()}
+
+    metrics.incr("datasage_fused_queries_total")
+    if data_version is not None:
+        result_cache = get_result_cache()
+        for i, (columns, data, _) in results.items():
+            result_cache.set(members[i][0], dataset_id, data_version, columns, data)
+    _record_usage(dataset_id, [args[0] for args in members.values()])
+    return results
+
+
+def _in_worker(fn, *args):
+    # Each pool thread owns one Django connection, so the pool size bounds
+    # how many connections the executor can hold open at once.
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def _submit(pool, fn, *args):
+    # Each job runs in a copy of the caller's context, so its spans are
+    # recorded on the request's trace.
+    return pool.submit(contextvars.copy_context().run, _in_worker, fn, *args)
+
+
+def _prepare_blocks(sql_list, dataset_id, data_version):
+    # Serves what it can from the result cache and returns (results, jobs,
+    # fused): results has cache hits filled in, jobs maps the remaining block
+    # indexes to _run_block arguments (SQL pointed at the rollup cube or the
+    # typed projection when they are up to date) and fused holds _run_fused
+    # arguments for the blocks that share a scan.
+    timeout_ms = settings.BLOCK_STATEMENT_TIMEOUT_MS
+    results = [None] * len(sql_list)
+    result_cache = get_result_cache() if data_version is not None else None
+
+    pending = []
+    for i, sql in enumerate(sql_list):
+        if sql is None:
+            continue
+        cached = result_cache.get(sql, dataset_id, data_version) if result_cache else None
+        if cached is not None:
+            results[i] = (*cached, None)
+        else:
+            pending.append(i)
+
+    # Usage counts every successful block, cached or not, as a demand signal.
+    _record_usage(dataset_id, [sql_list[i] for i, result in enumerate(results) if result is not None])
+
+    rollup = projection = None
+    if pending and data_version is not None:
+        if settings.ROLLUP_QUERY_REWRITE:
+            rollup = get_active_rollup(dataset_id, data_version)
+        if settings.PROJECTION_QUERY_REWRITE:
+            projection = get_active_projection(dataset_id, data_version)
+
+    jobs, parsed = {}, {}
+    for i in pending:
+        # Aggregates the rollup cube can answer read it; anything else goes to
+        # the typed projection when there is one.
+        executable_sql = None
+        if rollup is not None:
+            executable_sql = rewrite_for_rollup(sql_list[i], rollup)
+        if executable_sql is None and settings.BLOCK_FUSION_ENABLED and sql_list[i].upper().startswith("SELECT"):
+            block = parse_block(sql_list[i], ROW_LIMIT)
+            if block is not None:
+                parsed[i] = block
+        if executable_sql is None and projection is not None:
+            executable_sql = rewrite_for_projection(sql_list[i], projection)
+        jobs[i] = (sql_list[i], executable_sql or sql_list[i], dataset_id, data_version, timeout_ms)
+
+    # Aggregates over the same rows are answered by one GROUPING SETS scan.
+    fused = []
+    for indexes in fusion_groups(parsed):
+        members = {i: jobs.pop(i) for i in indexes}
+        fused.append((fuse_blocks(parsed, indexes), members, dataset_id, data_version, timeout_ms, projection))
+    return results, jobs, fused
+
+
+def timeout_result():
+    return None, None, f"Query timed out after {settings.BLOCK_STATEMENT_TIMEOUT_MS / 1000:g}s."
+
+
+def block_deadline_seconds():
+    # statement_timeout cancels slow queries server-side; the deadline is a
+    # backstop for blocks still waiting on a busy pool.
+    return settings.BLOCK_STATEMENT_TIMEOUT_MS / 1000 + settings.BLOCK_EXECUTOR_QUEUE_GRACE_SECONDS
+
+
+def _settle_members(members, done):
+    # Hands a fused query's outcome to each of its blocks' futures; a block
+    # the caller stopped waiting for was cancelled and is skipped.
+    for i, future in members.items():
+        try:
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result()[i])
+        except InvalidStateError:
+            pass
+
+
+def submit_blocks(sql_list, dataset_id, data_version=None):
+    # Like run_blocks, but returns one concurrent.futures.Future per block (None
+    # for skipped blocks) so callers can consume results as they complete.
+    results, jobs, fused = _prepare_blocks(sql_list, dataset_id, data_version)
+    futures = [None] * len(sql_list)
+    for i, result in enumerate(results):
+        if result is not None:
+            futures[i] = Future()
+            futures[i].set_result(result)
+    pool = get_block_pool()
+    for i, args in jobs.items():
+        futures[i] = _submit(pool, _run_block, *args)
+    for args in fused:
+        members = {i: Future() for i in args[1]}
+        for i, future in members.items():
+            futures[i] = future
+        _submit(pool, _run_fused, *args).add_done_callback(functools.partial(_settle_members, members))
+    return futures
+
+
+def run_blocks(sql_list, dataset_id, data_version=None):
+    # sql_list holds one entry per block (None for blocks with nothing to run);
+    # results come back in the same order as (columns, data, warning) triples.
+    # When data_version is given, results are served from / stored in the
+    # query result cache, and queries are pointed at the dataset's rollup cube
+    # or typed projection if they are up to date.
+    results, jobs, fused = _prepare_blocks(sql_list, dataset_id, data_version)
+
+    if len(jobs) + len(fused) <= 1 or settings.BLOCK_EXECUTOR_MAX_WORKERS <= 1:
+        for i, args in jobs.items():
+            results[i] = _run_block(*args)
+        for args in fused:
+            for i, result in _run_fused(*args).items():
+                results[i] = result
+        return results
+
+    pool = get_block_pool()
+    futures = {i: _submit(pool, _run_block, *args) for i, args in jobs.items()}
+    fused_futures = [(args[1], _submit(pool, _run_fused, *args)) for args in fused]
+    deadline = time.monotonic() + block_deadline_seconds()
+    for i, future in futures.items():
+        try:
+            results[i] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            results[i] = timeout_result()
+    for members, future in fused_futures:
+        try:
+            for i, result in future.result(timeout=max(0, deadline - time.monotonic())).items():
+                results[i] = result
+        except FutureTimeoutError:
+            future.cancel()
+            for i in members:
+                results[i] = timeout_result()
+    return results
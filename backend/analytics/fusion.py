@@ -0,0 +1,207 @@
+import re
+
+from .result_cache import normalize_sql
+from .sql_fields import CAST_FIELD, TEXT_FIELD, canonical_cast, closing_paren, mask_literals, split_top_level
+
+# Aggregate blocks that read the same rows (identical FROM analytics_record
+# ... WHERE ...) are fused into one GROUPING SETS query, so a dashboard with
+# a total, a breakdown by region and one by product scans the dataset once.
+# Each block's rows are picked out of the fused result by their grouping set
+# and put in order by a per-block ROW_NUMBER() carrying the block's own ORDER
+# BY, so the rows (and their types) are what the block would return alone.
+# The row_data fields the blocks use are read once in an inner scan, so the
+# grouping sorts carry just those values rather than whole JSONB documents.
+
+_STATEMENT = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+"
+    r"(?P<source>FROM\s+analytics_record\b(?:\s+(?:AS\s+)?(?!WHERE\b)\w+)?\s+WHERE\s+.+?)"
+    r"(?:\s+GROUP\s+BY\s+(?P<group>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.I | re.S,
+)
+_UNSUPPORTED = re.compile(
+    r"\b(JOIN|HAVING|OVER|UNION|INTERSECT|EXCEPT|WINDOW|OFFSET|FETCH|WITHIN|TABLESAMPLE|GROUPING|ROLLUP|CUBE)\b"
+    r"|\bSELECT\s+DISTINCT\b",
+    re.I,
+)
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX)\s*\(", re.I)
+_ALIAS = re.compile(r"\s+AS\s+(\w+|\"[^\"]+\")\s*$", re.I)
+_IDENTIFIER = re.compile(r"^\w+$")
+_ORDER_SUFFIX = re.compile(r"(\s+(?:ASC|DESC))?(\s+NULLS\s+(?:FIRST|LAST))?\s*$", re.I)
+# Input columns win over output aliases of the same name in GROUP BY.
+RECORD_COLUMNS = {"id", "dataset_id", "row_data", "created_at"}
+_RECORD_COLUMN = re.compile(rf"\b({'|'.join(RECORD_COLUMNS)})\b", re.I)
+
+SET_COLUMN = "_fused_set"
+
+
+class FusedQuery:
+    def __init__(self, sql, blocks):
+        # ``blocks`` maps block index -> (grouping set id, row number column,
+        # row limit, [(fused column, output name), ...]).
+        self.sql = sql
+        self.blocks = blocks
+
+
+def _output_name(alias):
+    # Unquoted identifiers are folded to lower case.
+    return alias[1:-1] if alias.startswith('"') else alias.lower()
+
+
+def parse_block(sql, row_limit):
+    # The block's parts when it is a plain aggregate over analytics_record
+    # that can be fused, else None:
+    # {"source", "items": [(kind, expression, name)], "keys", "order", "limit"}
+    # where kind is "key" (a GROUP BY expression) or "aggregate".
+    sql = sql.strip().rstrip(";").strip()
+    masked = mask_literals(sql)
+    if (
+        len(re.findall(r"\bSELECT\b", masked, re.I)) != 1
+        or _UNSUPPORTED.search(masked)
+        or not _AGGREGATE.search(masked)
+        or masked.count("%s") != 1
+    ):
+        return None
+    statement = _STATEMENT.match(masked)
+    if statement is None:
+        return None
+
+    def part(name):
+        return sql[statement.start(name):statement.end(name)] if statement.group(name) is not None else None
+
+    selected = []
+    for item in split_top_level(part("select"), ","):
+        alias = _ALIAS.search(mask_literals(item))
+        if alias:
+            selected.append((item[:alias.start()].strip(), _output_name(alias.group(1))))
+            continue
+        # Only bare aggregate calls have a column name that is easy to tell.
+        function = _AGGREGATE.match(mask_literals(item))
+        if function is None or closing_paren(mask_literals(item), function.end() - 1) != len(item) - 1:
+            return None
+        selected.append((item, function.group(1).lower()))
+    names = {name: expression for expression, name in selected}
+
+    def resolve(term, prefer_alias):
+        if term.isdigit():
+            position = int(term) - 1
+            return selected[position][0] if 0 <= position < len(selected) else None
+        if _IDENTIFIER.match(term) and term.lower() in names and (prefer_alias or term.lower() not in RECORD_COLUMNS):
+            return names[term.lower()]
+        return term
+
+    keys = []
+    for term in split_top_level(part("group"), ",") if part("group") else []:
+        expression = resolve(term, prefer_alias=False)
+        if expression is None:
+            return None
+        keys.append(normalize_sql(expression))
+
+    items = []
+    for expression, name in selected:
+        if normalize_sql(expression) in keys:
+            items.append(("key", normalize_sql(expression), name))
+        elif _AGGREGATE.search(mask_literals(expression)):
+            items.append(("aggregate", normalize_sql(expression), name))
+        else:
+            return None
+
+    order = []
+    for term in split_top_level(part("order"), ",") if part("order") else []:
+        suffix = _ORDER_SUFFIX.search(mask_literals(term))
+        expression = resolve(term[:suffix.start()].strip(), prefer_alias=True)
+        if expression is None:
+            return None
+        order.append(f"{expression}{term[suffix.start():]}")
+
+    limit = int(part("limit")) if part("limit") is not None else row_limit
+    return {
+        "source": normalize_sql(part("source")),
+        "items": items,
+        "keys": keys,
+        "order": order,
+        "limit": min(limit, row_limit),
+    }
+
+
+def fusion_groups(parsed):
+    # Block indexes worth fusing, from {index: parse_block result}: those
+    # sharing a source, two or more at a time.
+    by_source = {}
+    for i, block in parsed.items():
+        by_source.setdefault(block["source"], []).append(i)
+    return [indexes for indexes in by_source.values() if len(indexes) > 1]
+
+
+def fuse_blocks(parsed, indexes):
+    keys, aggregates = [], []
+    for i in indexes:
+        for kind, expression, _ in parsed[i]["items"]:
+            target = keys if kind == "key" else aggregates
+            if expression not in target:
+                target.append(expression)
+        for expression in parsed[i]["keys"]:
+            if expression not in keys:
+                keys.append(expression)
+
+    # GROUPING() has a bit per key, set when the key isn't in the row's set.
+    grouping = f"GROUPING({', '.join(keys)})" if keys else "0"
+    partition = f"PARTITION BY {grouping}" if keys else ""
+    columns = {SET_COLUMN: grouping}
+    columns.update((f"_fused_k{n}", expression) for n, expression in enumerate(keys))
+    columns.update((f"_fused_a{n}", expression) for n, expression in enumerate(aggregates))
+    sets, blocks, wanted = [], {}, []
+    for position, i in enumerate(indexes):
+        block = parsed[i]
+        block_keys = [keys.index(expression) for expression in block["keys"]]
+        grouping_set = f"({', '.join(keys[n] for n in sorted(block_keys))})"
+        if grouping_set not in sets:
+            sets.append(grouping_set)
+        set_id = sum(1 << (len(keys) - 1 - n) for n in range(len(keys)) if n not in block_keys)
+        order = f"ORDER BY {', '.join(block['order'])}" if block["order"] else ""
+        row_number = f"_fused_r{position}"
+        columns[row_number] = f"ROW_NUMBER() OVER ({' '.join(filter(None, (partition, order)))})"
+        blocks[i] = (set_id, row_number, block["limit"], [
+            (f"_fused_k{keys.index(expression)}" if kind == "key" else f"_fused_a{aggregates.index(expression)}", name)
+            for kind, expression, name in block["items"]
+        ])
+        wanted.append(f"({SET_COLUMN} = {set_id} AND {row_number} <= {block['limit']})")
+
+    select = ", ".join(f"{expression} AS {name}" for name, expression in columns.items())
+    grouping_sets = f"GROUPING SETS ({', '.join(sets)})"
+    source = parsed[indexes[0]]["source"]
+    fields = {}
+
+    def lift(match):
+        key = (match.group(2), canonical_cast(match.group(3)) if match.re is CAST_FIELD else "text")
+        return fields.setdefault(key, (f"_fused_f{len(fields)}", match.group(0)))[0]
+
+    def lift_all(text):
+        return TEXT_FIELD.sub(lift, CAST_FIELD.sub(lift, text))
+
+    lifted_select, lifted_sets = lift_all(select), lift_all(grouping_sets)
+    if fields and not _RECORD_COLUMN.search(mask_literals(f"{lifted_select} {lifted_sets}")):
+        scan = ", ".join(f"{expression} AS {name}" for name, expression in fields.values())
+        select, grouping_sets = lifted_select, lifted_sets
+        source = f"FROM (SELECT {scan} {source}) fused_scan"
+    grouped = f"SELECT {select} {source} GROUP BY {grouping_sets}"
+
+    # The outer query names its columns: rewrite_for_projection skips SELECT *.
+    sql = f"SELECT {', '.join(columns)} FROM ({grouped}) fused WHERE {' OR '.join(wanted)}"
+    return FusedQuery(sql, blocks)
+
+
+def split_fused(fused, description, rows):
+    # {block index: (description, rows)} with each block's own columns, in
+    # the block's order and within its limit.
+    positions = {column[0]: n for n, column in enumerate(description)}
+    split = {}
+    for i, (set_id, row_number, limit, columns) in fused.blocks.items():
+        ordered = sorted(
+            (row for row in rows if row[positions[SET_COLUMN]] == set_id),
+            key=lambda row: row[positions[row_number]],
+        )[:limit]
+        picks = [positions[column] for column, _ in columns]
+        block_description = [(name, description[positions[column]][1]) for column, name in columns]
+        split[i] = (block_description, [tuple(row[n] for n in picks) for row in ordered])
+    return split
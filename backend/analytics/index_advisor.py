@@ -0,0 +1,165 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import AdvisedIndex, DatasetProfile, DatasetProjection, FieldUsage, Record
+from .partitions import partition_name
+from .projection import projection_expression
+from .sql_fields import field_usage, record_expression
+
+
+def record_field_usage(dataset_id, sql_list):
+    counts = {}
+    for sql in sql_list:
+        for clause, field, cast in field_usage(sql):
+            counts[(field, cast, clause)] = counts.get((field, cast, clause), 0) + 1
+    if not counts:
+        return
+
+    quote = connection.ops.quote_name
+    now = timezone.now()
+    values = []
+    for (field, cast, clause), hits in counts.items():
+        values.extend([dataset_id, field, cast, clause, hits, now])
+    table = quote(FieldUsage._meta.db_table)
+    columns = ", ".join(quote(c) for c in ("dataset_id", "field", "cast", "clause", "hits", "last_used_at"))
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(counts))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+            f"ON CONFLICT (dataset_id, field, {quote('cast')}, clause) DO UPDATE "
+            f"SET hits = {table}.hits + EXCLUDED.hits, last_used_at = EXCLUDED.last_used_at",
+            values,
+        )
+
+
+def _index_name(dataset_id, table_name, expression):
+    digest = hashlib.sha1(f"{table_name}:{expression}".encode()).hexdigest()[:12]
+    return f"advidx_{dataset_id}_{digest}"
+
+
+def index_target(dataset_id, field, cast, projection=None):
+    # Prefer a plain index on the dataset's typed projection; otherwise build an
+    # expression (or GIN) index on the dataset's analytics_record partition.
+    quote = connection.ops.quote_name
+    if projection is not None and field in projection.columns:
+        table_name = projection.table_name
+        expression = projection_expression(field, cast, projection.columns[field])
+        column_list = f"({expression})" if expression.startswith('"') and "::" not in expression else f"(({expression}))"
+        name = _index_name(dataset_id, table_name, expression)
+        definition = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {quote(table_name)} {column_list}"
+    elif field == "*":
+        table_name = partition_name(dataset_id)
+        name = _index_name(dataset_id, table_name, "gin(row_data)")
+        definition = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {quote(table_name)} USING gin (row_data)"
+    else:
+        table_name = partition_name(dataset_id)
+        expression = record_expression(field, cast)
+        name = _index_name(dataset_id, table_name, expression)
+        definition = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {quote(table_name)} ({expression})"
+    return {"name": name, "table_name": table_name, "definition": definition}
+
+
+def existing_index_names(names):
+    if not names:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)", [list(names)])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def recommend_indexes(dataset_ids=None, min_hits=None):
+    # Returns a list of recommendation dicts with "action" ("create"/"drop"),
+    # "dataset_id", "field", "cast", "name", "table_name", "definition", "reason".
+    min_hits = settings.INDEX_ADVISOR_MIN_HITS if min_hits is None else min_hits
+    stale_before = timezone.now() - timedelta(days=settings.INDEX_ADVISOR_UNUSED_DAYS)
+
+    usage = FieldUsage.objects.all()
+    advised = AdvisedIndex.objects.all()
+    if dataset_ids:
+        usage = usage.filter(dataset_id__in=dataset_ids)
+        advised = advised.filter(dataset_id__in=dataset_ids)
+
+    totals = (
+        usage.values("dataset_id", "field", "cast")
+        .annotate(total_hits=Sum("hits"), last_used_at=Max("last_used_at"))
+        .order_by("dataset_id", "-total_hits")
+    )
+    projections = {p.dataset_id: p for p in DatasetProjection.objects.all()}
+    row_counts = dict(DatasetProfile.objects.values_list("dataset_id", "row_count"))
+    wanted = {}
+    for row in totals:
+        dataset_id = row["dataset_id"]
+        if row["total_hits"] < min_hits or row["last_used_at"] < stale_before:
+            continue
+        if dataset_id not in row_counts:
+            row_counts[dataset_id] = Record.objects.filter(dataset_id=dataset_id).count()
+        if row_counts[dataset_id] < settings.INDEX_ADVISOR_MIN_ROWS:
+            continue
+        target = index_target(dataset_id, row["field"], row["cast"], projections.get(dataset_id))
+        wanted[target["name"]] = {
+            "dataset_id": dataset_id,
+            "field": row["field"],
+            "cast": row["cast"],
+            **target,
+            "reason": f"used {row['total_hits']} times in WHERE/GROUP BY/ORDER BY over {row_counts[dataset_id]} rows",
+        }
+
+    advised = {index.name: index for index in advised}
+    present = existing_index_names(set(wanted) | set(advised))
+    recommendations = [
+        {"action": "create", **spec}
+        for name, spec in wanted.items()
+        if name not in present
+    ]
+    for name, index in advised.items():
+        if name not in wanted:
+            recommendations.append({
+                "action": "drop",
+                "dataset_id": index.dataset_id,
+                "field": index.field,
+                "cast": index.cast,
+                "name": name,
+                "table_name": index.table_name,
+                "definition": f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+                "reason": (
+                    f"no longer recommended (fewer than {min_hits} uses, idle for "
+                    f"{settings.INDEX_ADVISOR_UNUSED_DAYS} days, or superseded by a projection index)"
+                ),
+            })
+    return recommendations
+
+
+def apply_recommendation(recommendation):
+    # CONCURRENTLY statements must run outside a transaction (autocommit).
+    name = recommendation["name"]
+    with connection.cursor() as cursor:
+        if recommendation["action"] == "drop":
+            cursor.execute(recommendation["definition"])
+            AdvisedIndex.objects.filter(name=name).delete()
+            return
+        try:
+            cursor.execute(recommendation["definition"])
+        except Exception:
+            # A failed concurrent build leaves an INVALID index behind.
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            raise
+    AdvisedIndex.objects.update_or_create(
+        name=name,
+        defaults={
+            "dataset_id": recommendation["dataset_id"],
+            "table_name": recommendation["table_name"],
+            "field": recommendation["field"],
+            "cast": recommendation["cast"],
+            "definition": recommendation["definition"],
+        },
+    )
+
+
+def drop_advised_index(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
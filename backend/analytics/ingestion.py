@@ -0,0 +1,294 @@
+import codecs
+import csv
+import datetime
+import io
+import itertools
+import json
+import math
+import os
+import re
+import time
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import Dataset, Record
+from .signals import lock_record_writes, notify_records_changed
+
+FORMATS = ("csv", "ndjson", "parquet")
+FORMAT_EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+
+_INTEGER = re.compile(r"^-?\d+$")
+_FLOAT = re.compile(r"^-?(\d+\.\d*|\.\d+|\d+)([eE][-+]?\d+)?$")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?([+-]\d{2}(:?\d{2})?|Z)?$")
+# Where Postgres says a COPY failed: "COPY analytics_record, line 3, ...".
+_COPY_LINE = re.compile(r"\bCOPY \w+, line (\d+)")
+_BOOLEANS = {"true": True, "false": False, "yes": True, "no": False, "1": True, "0": False}
+
+
+class IngestionError(Exception):
+    pass
+
+
+def detect_format(filename, explicit=None):
+    if explicit:
+        if explicit not in FORMATS:
+            raise IngestionError(f"Unsupported format '{explicit}'. Expected one of: {', '.join(FORMATS)}.")
+        return explicit
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise IngestionError("Could not detect the file format; pass 'format' explicitly.")
+    return FORMAT_EXTENSIONS[extension]
+
+
+def iter_csv_rows(fileobj):
+    reader = csv.DictReader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    for row in reader:
+        yield {key: (value if value != "" else None) for key, value in row.items() if key is not None}
+
+
+def iter_ndjson_rows(fileobj):
+    for line_number, line in enumerate(fileobj, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise IngestionError(f"Line {line_number}: invalid JSON ({e.msg}).")
+        if not isinstance(row, dict):
+            raise IngestionError(f"Line {line_number}: expected a JSON object.")
+        yield row
+
+
+def iter_parquet_rows(fileobj, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise IngestionError("Parquet ingestion requires the 'pyarrow' package.")
+    parquet_file = pq.ParquetFile(fileobj)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_rows(fileobj, fmt, batch_size):
+    if fmt == "csv":
+        return iter_csv_rows(fileobj)
+    if fmt == "ndjson":
+        return iter_ndjson_rows(fileobj)
+    return iter_parquet_rows(fileobj, batch_size)
+
+
+def infer_type(values):
+    # Narrowest metadata type that every non-null sample value fits.
+    values = [v for v in values if v is not None]
+    if not values:
+        return "string"
+    if all(isinstance(v, bool) or str(v).strip().lower() in ("true", "false") for v in values):
+        return "boolean"
+    if all(not isinstance(v, bool) and _INTEGER.match(str(v).strip()) for v in values):
+        return "integer"
+    if all(not isinstance(v, bool) and _FLOAT.match(str(v).strip()) for v in values):
+        return "float"
+    if all(
+        (isinstance(v, datetime.date) and not isinstance(v, datetime.datetime)) or _DATE.match(str(v).strip())
+        for v in values
+    ):
+        return "date"
+    if all(isinstance(v, datetime.date) or _TIMESTAMP.match(str(v).strip()) for v in values):
+        return "timestamp"
+    return "string"
+
+
+def infer_metadata(rows):
+    fields = {}
+    for row in rows:
+        for key, value in row.items():
+            fields.setdefault(key, []).append(value)
+    return {field: infer_type(values) for field, values in fields.items()}
+
+
+def _to_integer(value):
+    if isinstance(value, bool):
+        raise ValueError("boolean is not an integer")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("not a whole number")
+        return int(value)
+    return int(str(value).strip())
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise ValueError("boolean is not a number")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("not a finite number")
+    return number
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    return _BOOLEANS[str(value).strip().lower()]
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return datetime.date.fromisoformat(str(value).strip()).isoformat()
+
+
+def _to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).isoformat()
+    return datetime.datetime.fromisoformat(str(value).strip()).isoformat()
+
+
+def _to_text(value):
+    # Nested objects and arrays stay JSON rather than becoming their Python repr.
+    if isinstance(value, (dict, list)):
+        return value
+    return str(value)
+
+
+COERCERS = {
+    "integer": _to_integer,
+    "int": _to_integer,
+    "float": _to_float,
+    "number": _to_float,
+    "numeric": _to_float,
+    "boolean": _to_boolean,
+    "bool": _to_boolean,
+    "date": _to_date,
+    "datetime": _to_timestamp,
+    "timestamp": _to_timestamp,
+}
+
+
+def coerce_row(row, metadata):
+    unexpected = set(row) - set(metadata)
+    if unexpected:
+        raise ValueError(f"unexpected field(s): {', '.join(sorted(unexpected))}")
+    coerced = {}
+    for field, field_type in metadata.items():
+        value = row.get(field)
+        if value is None:
+            coerced[field] = None
+            continue
+        coercer = COERCERS.get(str(field_type).lower(), _to_text)
+        try:
+            coerced[field] = coercer(value)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"field '{field}': {value!r} is not a valid {field_type}")
+    return coerced
+
+
+def _copy_line(dataset_id, row, created_at):
+    # COPY text format: tab-separated, backslash is the escape character.
+    # json.dumps never emits raw tabs/newlines, so only backslashes need escaping.
+    payload = json.dumps(row, separators=(",", ":")).replace("\\", "\\\\")
+    return f"{dataset_id}\t{payload}\t{created_at}\n"
+
+
+def copy_text(cursor, text):
+    # Loads records already in COPY text format: dataset_id, row_data, created_at.
+    # copy_expert isn't wrapped by Django, so its errors are translated here.
+    with cursor.db.wrap_database_errors:
+        cursor.copy_expert(
+            f"COPY {Record._meta.db_table} (dataset_id, row_data, created_at) FROM STDIN WITH (FORMAT text)",
+            io.StringIO(text),
+        )
+
+
+def copy_batch(cursor, dataset_id, rows, created_at):
+    copy_text(cursor, "".join(_copy_line(dataset_id, row, created_at) for row in rows))
+
+
+def _copy_error(error, batch_number, row_numbers):
+    # An IngestionError for a batch Postgres rejected, naming the input row it
+    # stopped at when the error says which COPY line that was.
+    diag = getattr(error.__cause__, "diag", None)
+    message = diag.message_primary if diag and diag.message_primary else str(error).strip().splitlines()[0]
+    if diag and diag.message_detail:
+        message += f" ({diag.message_detail})"
+    line = _COPY_LINE.search(diag.context or "") if diag else None
+    if line and 1 <= int(line.group(1)) <= len(row_numbers):
+        return IngestionError(f"Row {row_numbers[int(line.group(1)) - 1]} (batch {batch_number}): {message}")
+    return IngestionError(f"Batch {batch_number} (rows {row_numbers[0]}-{row_numbers[-1]}): {message}")
+
+
+def ingest_rows(rows, dataset=None, name=None, description="", owner=None, metadata=None,
+                batch_size=None, max_errors=0, progress=None):
+    # Streams ``rows`` into analytics_record via COPY in batches of
+    # ``batch_size``. Loads into ``dataset`` (validating against its metadata),
+    # or creates a new dataset named ``name`` with ``metadata`` inferred from
+    # the first batch when not given. The whole load is one transaction.
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    rows = iter(rows)
+    started = time.monotonic()
+    stats = {"rows": 0, "rejected": 0, "batches": 0, "errors": []}
+
+    first_batch = []
+    for row in rows:
+        first_batch.append(row)
+        if len(first_batch) >= batch_size:
+            break
+
+    with transaction.atomic():
+        if dataset is None:
+            if not first_batch:
+                raise IngestionError("The file contains no rows.")
+            dataset = Dataset.objects.create(
+                name=name,
+                description=description,
+                created_by=owner,
+                metadata=metadata or infer_metadata(first_batch),
+            )
+        lock_record_writes({dataset.id})
+
+        created_at = timezone.now().isoformat()
+
+        def flush(cursor, batch, row_numbers):
+            try:
+                copy_batch(cursor, dataset.id, batch, created_at)
+            except (DataError, IntegrityError) as e:
+                raise _copy_error(e, stats["batches"] + 1, row_numbers) from e
+            stats["rows"] += len(batch)
+            stats["batches"] += 1
+            if progress:
+                progress(stats, time.monotonic() - started)
+
+        with connection.cursor() as cursor:
+            batch, row_numbers = [], []
+            for row_number, row in enumerate(itertools.chain(first_batch, rows), start=1):
+                try:
+                    batch.append(coerce_row(row, dataset.metadata))
+                    row_numbers.append(row_number)
+                except ValueError as e:
+                    stats["rejected"] += 1
+                    if len(stats["errors"]) < 20:
+                        stats["errors"].append(f"Row {row_number}: {e}")
+                    if stats["rejected"] > max_errors:
+                        raise IngestionError(f"Row {row_number}: {e}")
+                    continue
+                if len(batch) >= batch_size:
+                    flush(cursor, batch, row_numbers)
+                    batch, row_numbers = [], []
+            if batch:
+                flush(cursor, batch, row_numbers)
+
+        if stats["rows"]:
+            notify_records_changed({dataset.id}, "insert")
+
+    elapsed = time.monotonic() - started
+    stats["dataset_id"] = dataset.id
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["rows"] / elapsed) if elapsed > 0 else stats["rows"]
+    return stats
@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Hot-path instrumentation. Code wraps its stages (prompt build, LLM round
+# trip, parsing, block SQL, serialization, ...) in ``span(stage)``; each span
+# feeds the process-wide stage histograms served at /api/metrics/ and, while
+# a request is being handled, that request's Trace, which TimingMiddleware
+# reports as a Server-Timing header and keeps for /api/traces/ when asked to.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+slow_query_logger = logging.getLogger("analytics.slow_query")
+
+_current_trace = contextvars.ContextVar("analytics_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    # Process-wide counters and histograms, rendered in the Prometheus text
+    # exposition format.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def incr(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(STAGE_BUCKETS)
+            histogram.observe(value)
+
+    def render(self, gauges=None):
+        # ``gauges`` maps metric names to current values sampled by the caller.
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_labels(dict(labels))} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                labels = dict(labels)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': f'{bound:g}'})} {count}")
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+class Trace:
+    # The spans recorded while handling one request. Spans from block pool
+    # threads land here too, since submitted blocks run in a copy of the
+    # request's context.
+
+    def __init__(self, method, path, keep=False):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.keep = keep
+        self.view = None
+        self.status = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, started, duration, attrs):
+        span = {
+            "stage": stage,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if self.keep:
+            span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, status, view):
+        self.status = status
+        self.view = view
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 3)
+
+    def totals(self):
+        # {stage: (span count, total ms)} in order of first occurrence.
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            count, total = totals.get(span["stage"], (0, 0.0))
+            totals[span["stage"]] = (count + 1, total + span["duration_ms"])
+        return totals
+
+    def server_timing(self):
+        # Concurrent block queries overlap, so a stage's total can exceed the
+        # request's wall time; desc says how many spans it sums.
+        entries = [
+            f'{stage};dur={total:.1f}' + (f';desc="{count}x"' if count > 1 else "")
+            for stage, (count, total) in self.totals().items()
+        ]
+        entries.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def as_dict(self, spans=True):
+        trace = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "view": self.view,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "stages": {stage: {"count": count, "ms": round(total, 3)} for stage, (count, total) in self.totals().items()},
+        }
+        if spans:
+            with self._lock:
+                trace["spans"] = sorted(self.spans, key=lambda span: span["start_ms"])
+        return trace
+
+
+def start_trace(trace):
+    return _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def record(stage, started, duration, attrs=None):
+    metrics.observe("datasage_stage_seconds", duration, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, started, duration, attrs or {})
+
+
+@contextmanager
+def span(stage, **attrs):
+    # Times the enclosed code as ``stage``. The yielded dict can be extended
+    # with details for the trace (row counts, ...); it holds "duration_ms"
+    # once the block exits.
+    if not settings.INSTRUMENTATION_ENABLED:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        duration = time.perf_counter() - started
+        attrs["duration_ms"] = round(duration * 1000, 3)
+        record(stage, started, duration, attrs)
+
+
+def log_slow_query(sql, dataset_id, duration_ms, rows):
+    if duration_ms < settings.SLOW_QUERY_MS:
+        return
+    metrics.incr("datasage_slow_queries_total")
+    trace = _current_trace.get()
+    slow_query_logger.warning(
+        "Slow block query: %.0fms dataset=%s rows=%s trace=%s sql=%s",
+        duration_ms, dataset_id, rows, trace.id if trace is not None else "-", " ".join(sql.split()),
+    )
+
+
+class TraceStore:
+    # The most recent kept traces, newest first.
+
+    def __init__(self, max_entries):
+        self._traces = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.appendleft(trace)
+
+    def get(self, trace_id):
+        with self._lock:
+            return next((trace for trace in self._traces if trace.id == trace_id), None)
+
+    def recent(self):
+        with self._lock:
+            return list(self._traces)
+
+
+_trace_store = None
+_trace_store_lock = threading.Lock()
+
+
+def get_trace_store():
+    global _trace_store
+    with _trace_store_lock:
+        if _trace_store is None:
+            _trace_store = TraceStore(settings.TRACE_BUFFER_SIZE)
+    return _trace_store
@@ -0,0 +1,248 @@
+import re
+import threading
+
+from .executor import ROW_LIMIT
+from .plan_cache import STOPWORDS, normalize_prompt
+from .profiling import NUMERIC_TYPES, TEMPORAL_TYPES
+
+# Deterministic fast path for simple asks ("total revenue", "count by
+# department", "top 5 product by revenue"): the prompt is read against a
+# small grammar over the dataset's field names and types, and the render plan
+# is built locally instead of by the LLM. Every word has to be understood;
+# a prompt with anything else in it ("revenue in 2024") is left to the LLM.
+
+AGGREGATE_WORDS = {
+    "total": "SUM", "sum": "SUM",
+    "average": "AVG", "avg": "AVG", "mean": "AVG",
+    "minimum": "MIN", "min": "MIN", "lowest": "MIN", "smallest": "MIN",
+    "maximum": "MAX", "max": "MAX", "highest": "MAX", "largest": "MAX",
+    "count": "COUNT", "number": "COUNT", "many": "COUNT",
+}
+AGGREGATE_TITLES = {"SUM": "Total", "AVG": "Average", "MIN": "Minimum", "MAX": "Maximum"}
+AGGREGATE_ALIASES = {"SUM": "total", "AVG": "avg", "MIN": "min", "MAX": "max"}
+GROUP_WORDS = {"by", "per", "across", "each", "breakdown", "split"}
+ROW_WORDS = {"record", "records", "row", "rows", "entry", "entries"}
+DISTINCT_WORDS = {"distinct", "unique", "different"}
+FILLER_WORDS = (STOPWORDS | {"overall", "value", "broken", "down", "grouped", "chart"}) - {"and"}
+BOOLEAN_TYPES = {"boolean", "bool"}
+CLAUSE_SEPARATOR = re.compile(r",|\band\b")
+DEFAULT_TOP = 10
+BASE = "FROM analytics_record WHERE dataset_id = %s"
+
+_counters_lock = threading.Lock()
+_counters = {"lookups": 0, "hits": 0, "misses": 0}
+
+
+def _singular(word):
+    # Same rule as the plan cache's prompt tokens.
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def _words(text):
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def _alias(field):
+    return re.sub(r"\W+", "_", field).strip("_").lower() or "value"
+
+
+def _label(field):
+    return re.sub(r"[\W_]+", " ", field).strip().title() or field
+
+
+def _text(field):
+    return "row_data->>'" + field.replace("'", "''") + "'"
+
+
+def _number(field):
+    return f"({_text(field)})::numeric"
+
+
+def _kind(field_type):
+    field_type = str(field_type).lower()
+    if field_type in NUMERIC_TYPES:
+        return "numeric"
+    if field_type in TEMPORAL_TYPES:
+        return "temporal"
+    if field_type in BOOLEAN_TYPES:
+        return "boolean"
+    return "categorical"
+
+
+def _symbols(words, fields):
+    # The clause as symbols: ("field", name), ("aggregate", function), ("by",),
+    # ("top",), ("number", n), ("rows",), ("distinct",). None when a word is
+    # neither a field, a keyword nor filler.
+    symbols, i = [], 0
+    while i < len(words):
+        for tokens, field in fields:
+            if tuple(_singular(word) for word in words[i:i + len(tokens)]) == tokens:
+                symbols.append(("field", field))
+                i += len(tokens)
+                break
+        else:
+            word = words[i]
+            if word in AGGREGATE_WORDS:
+                symbols.append(("aggregate", AGGREGATE_WORDS[word]))
+            elif word in GROUP_WORDS:
+                if not symbols or symbols[-1] != ("by",):
+                    symbols.append(("by",))
+            elif word == "top":
+                symbols.append(("top",))
+            elif word.isdigit():
+                symbols.append(("number", int(word)))
+            elif word in ROW_WORDS:
+                symbols.append(("rows",))
+            elif word in DISTINCT_WORDS:
+                symbols.append(("distinct",))
+            elif word not in FILLER_WORDS:
+                return None
+            i += 1
+    return symbols
+
+
+def _measure(symbols, kinds, implicit_sum=False):
+    # (SQL expression, alias, title) of a measure phrase, or None.
+    aggregates = [symbol[1] for symbol in symbols if symbol[0] == "aggregate"]
+    fields = [symbol[1] for symbol in symbols if symbol[0] == "field"]
+    distinct = ("distinct",) in symbols
+    if any(symbol[0] not in ("aggregate", "field", "rows", "distinct") for symbol in symbols):
+        return None
+    if aggregates == ["COUNT"] and not fields and not distinct:
+        return "COUNT(*)", "record_count", "Record Count"
+    if distinct and aggregates == ["COUNT"] and len(fields) == 1 and ("rows",) not in symbols:
+        field = fields[0]
+        return f"COUNT(DISTINCT {_text(field)})", f"distinct_{_alias(field)}", f"Distinct {_label(field)} Count"
+    if not aggregates and implicit_sum:
+        aggregates = ["SUM"]
+    if (
+        len(aggregates) == 1 and aggregates[0] in AGGREGATE_TITLES and len(fields) == 1
+        and not distinct and ("rows",) not in symbols and kinds[fields[0]] == "numeric"
+    ):
+        function, field = aggregates[0], fields[0]
+        return (
+            f"{function}({_number(field)})",
+            f"{AGGREGATE_ALIASES[function]}_{_alias(field)}",
+            f"{AGGREGATE_TITLES[function]} {_label(field)}",
+        )
+    return None
+
+
+def _chart(measure, dimension, kinds, limit=None, title=None):
+    expression, y_axis, measure_title = measure
+    x_axis = _alias(dimension)
+    if x_axis == y_axis:
+        return None
+    kind = kinds[dimension]
+    x_expression = _number(dimension) if kind == "numeric" else _text(dimension)
+    # Time and numeric axes read in order; categories by size. (The x alias is
+    # the field's name, which may be a keyword, so it isn't referred back to.)
+    if limit is None and kind in ("temporal", "numeric"):
+        order = x_expression
+    else:
+        order = f"{y_axis} DESC"
+    sql = (
+        f"SELECT {x_expression} AS {x_axis}, {expression} AS {y_axis} {BASE} "
+        f"GROUP BY {x_expression} ORDER BY {order}"
+    )
+    if limit is not None:
+        sql += f" LIMIT {limit}"
+    return {
+        "render": "chart",
+        "title": title or f"{measure_title} by {_label(dimension)}",
+        "chart_type": "line" if kind == "temporal" and limit is None else "bar",
+        "x_axis": x_axis,
+        "y_axis": y_axis,
+        "sql": sql,
+    }
+
+
+def _top(symbols, kinds, metadata):
+    # "top [n] <field> by <measure>" charts the n largest groups;
+    # "top [n] records by <numeric field>" lists the n largest rows.
+    rest = symbols[1:]
+    limit = DEFAULT_TOP
+    if rest and rest[0][0] == "number":
+        limit = rest[0][1]
+        rest = rest[1:]
+    if not 1 <= limit <= ROW_LIMIT or ("by",) not in rest:
+        return None
+    split = rest.index(("by",))
+    subject, measure_symbols = rest[:split], rest[split + 1:]
+
+    if subject == [("rows",)] and len(measure_symbols) == 1 and measure_symbols[0][0] == "field":
+        field = measure_symbols[0][1]
+        aliases = [_alias(name) for name in metadata]
+        if kinds[field] != "numeric" or len(set(aliases)) != len(aliases):
+            return None
+        columns = ", ".join(f"{_text(name)} AS {alias}" for name, alias in zip(metadata, aliases))
+        return {
+            "render": "table",
+            "title": f"Top {limit} Records by {_label(field)}",
+            "sql": f"SELECT {columns} {BASE} ORDER BY {_number(field)} DESC NULLS LAST LIMIT {limit}",
+        }
+
+    measure = _measure(measure_symbols, kinds, implicit_sum=True)
+    if len(subject) != 1 or subject[0][0] != "field" or measure is None:
+        return None
+    dimension = subject[0][1]
+    return _chart(measure, dimension, kinds, limit, f"{measure[2]} by {_label(dimension)}, Top {limit}")
+
+
+def _block(symbols, kinds, metadata):
+    if not symbols:
+        return None
+    if symbols[0] == ("top",):
+        return _top(symbols, kinds, metadata)
+    if ("by",) not in symbols:
+        measure = _measure(symbols, kinds)
+        if measure is None:
+            return None
+        expression, alias, title = measure
+        return {"render": "kpi", "title": title, "sql": f"SELECT {expression} AS {alias} {BASE}"}
+    split = symbols.index(("by",))
+    measure, dimension = _measure(symbols[:split], kinds), symbols[split + 1:]
+    if measure is None or len(dimension) != 1 or dimension[0][0] != "field":
+        return None
+    return _chart(measure, dimension[0][1], kinds)
+
+
+def match_intent(prompt, dataset):
+    # A render plan for a prompt made only of recognised shapes (one block per
+    # clause, clauses split on "and" and commas), else None.
+    metadata = dataset.metadata or {}
+    kinds = {field: _kind(field_type) for field, field_type in metadata.items()}
+    # Longest field names first, so "page views" beats "page".
+    fields = sorted(
+        ((tuple(_singular(word) for word in _words(field.lower())), field) for field in metadata),
+        key=lambda item: -len(item[0]),
+    )
+    fields = [(tokens, field) for tokens, field in fields if tokens]
+
+    text = re.sub(r"'s\b", "", normalize_prompt(prompt))
+    blocks = []
+    for clause in CLAUSE_SEPARATOR.split(text):
+        words = _words(clause)
+        if not words:
+            continue
+        symbols = _symbols(words, fields)
+        block = _block(symbols, kinds, metadata) if symbols is not None else None
+        if block is None:
+            return None
+        blocks.append(block)
+    return blocks or None
+
+
+def lookup_intent(prompt, dataset):
+    blocks = match_intent(prompt, dataset)
+    with _counters_lock:
+        _counters["lookups"] += 1
+        _counters["hits" if blocks is not None else "misses"] += 1
+    return blocks
+
+
+def intent_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    counters["hit_rate"] = counters["hits"] / counters["lookups"] if counters["lookups"] else 0.0
+    return counters
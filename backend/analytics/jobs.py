@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import select
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .dashboard import stream_dashboard
+from .models import AskJob, Dataset
+
+logger = logging.getLogger(__name__)
+
+# Ask jobs: POST /api/ask/jobs/ stores the request as an AskJob row and
+# returns at once; worker processes (`manage.py run_ask_workers`) claim queued
+# jobs with SELECT ... FOR UPDATE SKIP LOCKED, run the plan and its blocks
+# through stream_dashboard and write each block into the row as it arrives.
+# Workers sleep on a Postgres LISTEN and are woken by a NOTIFY when a job is
+# queued, so the database is the only broker.
+
+NOTIFY_CHANNEL = "analytics_ask_jobs"
+# Claims hold this advisory lock while counting running jobs, so the
+# ASK_JOB_MAX_RUNNING cap holds across every worker host.
+CLAIM_LOCK_KEY = 7_307_182_731
+# How often a long-polling request re-reads its job.
+LONG_POLL_INTERVAL_SECONDS = 0.25
+
+
+class QueueFull(Exception):
+    pass
+
+
+def notify_workers():
+    with connection.cursor() as cursor:
+        cursor.execute(f"NOTIFY {NOTIFY_CHANNEL}")
+
+
+def enqueue_job(dataset, prompt, approximate=False, refine=False):
+    if settings.ASK_JOB_MAX_QUEUED and (
+        AskJob.objects.filter(status=AskJob.QUEUED).count() >= settings.ASK_JOB_MAX_QUEUED
+    ):
+        raise QueueFull("Too many ask jobs are waiting; try again shortly.")
+    with transaction.atomic():
+        job = AskJob.objects.create(dataset=dataset, prompt=prompt, approximate=approximate, refine=refine)
+        transaction.on_commit(notify_workers)
+    return job
+
+
+def cancel_job(job_id):
+    # Running jobs stop at their next block; returns False once finished.
+    return bool(
+        AskJob.objects.filter(pk=job_id).exclude(status__in=AskJob.FINISHED).update(
+            status=AskJob.CANCELLED, finished_at=timezone.now(), revision=F("revision") + 1,
+        )
+    )
+
+
+def job_payload(job):
+    # ``blocks`` has one slot per block of the plan, None until it arrives;
+    # ``result`` is the ask_dataset response, once the job has succeeded.
+    payload = {
+        "job_id": job.id,
+        "dataset_id": job.dataset_id,
+        "status": job.status,
+        "revision": job.revision,
+        "plan_cache": job.plan_cache or None,
+        "block_count": job.block_count,
+        "blocks": job.blocks,
+        "warnings": job.warnings,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == AskJob.SUCCEEDED:
+        blocks = [block for block in job.blocks if block is not None]
+        payload["result"] = {
+            "type": "dashboard_response",
+            "plan_cache": job.plan_cache,
+            "warnings": job.warnings,
+            "blocks": blocks,
+            "approximate": any(block.get("approximate") for block in blocks),
+            # Refinement runs inside the job, so a finished job is final.
+            "refining": False,
+        }
+    return payload
+
+
+async def wait_for_change(job_id, since, wait):
+    # The job once its revision is past ``since``, it has finished, or
+    # ``wait`` seconds have passed; None if there is no such job.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        job = await AskJob.objects.filter(pk=job_id).afirst()
+        if job is None or since is None or job.revision > since or job.status in AskJob.FINISHED:
+            return job
+        if loop.time() >= deadline:
+            return job
+        await asyncio.sleep(LONG_POLL_INTERVAL_SECONDS)
+
+
+def claim_job(worker):
+    with transaction.atomic():
+        if settings.ASK_JOB_MAX_RUNNING:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CLAIM_LOCK_KEY])
+            if AskJob.objects.filter(status=AskJob.RUNNING).count() >= settings.ASK_JOB_MAX_RUNNING:
+                return None
+        job = AskJob.objects.select_for_update(skip_locked=True).filter(status=AskJob.QUEUED).order_by("id").first()
+        if job is None:
+            return None
+        now = timezone.now()
+        job.status = AskJob.RUNNING
+        job.worker = worker
+        job.attempts += 1
+        job.revision += 1
+        job.started_at = job.heartbeat_at = now
+        job.save(update_fields=["status", "worker", "attempts", "revision", "started_at", "heartbeat_at"])
+    return job
+
+
+def recover_stale_jobs():
+    # Jobs whose worker stopped heartbeating (it crashed or was killed) are
+    # queued again, or failed once out of attempts. Old finished jobs are
+    # deleted. Returns (requeued, failed).
+    now = timezone.now()
+    stale = AskJob.objects.filter(
+        status=AskJob.RUNNING, heartbeat_at__lt=now - timedelta(seconds=settings.ASK_JOB_STALE_SECONDS),
+    )
+    failed = stale.filter(attempts__gte=settings.ASK_JOB_MAX_ATTEMPTS).update(
+        status=AskJob.FAILED, error="The worker running this job stopped responding.",
+        finished_at=now, revision=F("revision") + 1,
+    )
+    requeued = stale.update(
+        status=AskJob.QUEUED, worker="", block_count=None, blocks=[], warnings=[], revision=F("revision") + 1,
+    )
+    AskJob.objects.filter(
+        status__in=AskJob.FINISHED, finished_at__lt=now - timedelta(hours=settings.ASK_JOB_RETENTION_HOURS),
+    ).delete()
+    if requeued or failed:
+        logger.warning("Recovered stale ask jobs: %s requeued, %s failed", requeued, failed)
+    return requeued, failed
+
+
+def _update_claimed(job, **changes):
+    # Writes to the job only while this claim of it still holds; False once
+    # it was cancelled (or given up as stale and claimed again).
+    return bool(
+        AskJob.objects.filter(pk=job.pk, status=AskJob.RUNNING, attempts=job.attempts).update(
+            **changes, heartbeat_at=timezone.now(), revision=F("revision") + 1,
+        )
+    )
+
+
+async def _heartbeat(job):
+    while True:
+        await asyncio.sleep(settings.ASK_JOB_STALE_SECONDS / 4)
+        await sync_to_async(
+            AskJob.objects.filter(pk=job.pk, status=AskJob.RUNNING, attempts=job.attempts).update
+        )(heartbeat_at=timezone.now())
+
+
+async def run_job(job):
+    update = sync_to_async(_update_claimed)
+    heartbeat = asyncio.ensure_future(_heartbeat(job))
+    events = None
+    try:
+        dataset = await Dataset.objects.aget(pk=job.dataset_id)
+        events = stream_dashboard(job.prompt, dataset, approximate=job.approximate, refine=job.refine)
+        blocks, warnings = [], []
+        async for event in events:
+            if event["type"] == "plan":
+                blocks = [None] * event["block_count"]
+                changes = {"plan_cache": event["plan_cache"], "block_count": event["block_count"], "blocks": blocks}
+            elif event["type"] == "block":
+                blocks[event["index"]] = event["block"]
+                changes = {"blocks": blocks}
+            elif event["type"] == "warning":
+                warnings.append(event["warning"])
+                changes = {"warnings": warnings}
+            elif event["type"] == "done":
+                changes = {"status": AskJob.SUCCEEDED, "warnings": event["warnings"], "finished_at": timezone.now()}
+            else:
+                changes = {"status": AskJob.FAILED, "error": event["error"], "finished_at": timezone.now()}
+            if not await update(job, **changes):
+                break
+    except Exception as e:
+        logger.exception("Ask job %s failed", job.pk)
+        await update(job, status=AskJob.FAILED, error=str(e), finished_at=timezone.now())
+    finally:
+        heartbeat.cancel()
+        if events is not None:
+            await events.aclose()
+
+
+def _wait_for_notify(timeout):
+    # Blocks until a NOTIFY arrives on the (listening) connection or timeout.
+    raw = connection.connection
+    if not raw.notifies:
+        select.select([raw], [], [], timeout)
+        raw.poll()
+    raw.notifies.clear()
+
+
+def run_worker(name, should_stop):
+    # One worker process: runs queued jobs one at a time until should_stop()
+    # returns True, which is checked between jobs.
+    loop = asyncio.new_event_loop()
+    listening = None
+    last_recovery = 0.0
+    try:
+        while not should_stop():
+            close_old_connections()
+            connection.ensure_connection()
+            if listening is not connection.connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                listening = connection.connection
+
+            if loop.time() - last_recovery >= settings.ASK_JOB_STALE_SECONDS / 4:
+                recover_stale_jobs()
+                last_recovery = loop.time()
+
+            job = claim_job(name)
+            if job is None:
+                _wait_for_notify(settings.ASK_JOB_POLL_SECONDS)
+                continue
+            logger.info("Worker %s running ask job %s", name, job.pk)
+            loop.run_until_complete(run_job(job))
+            # A slot under ASK_JOB_MAX_RUNNING may have opened for others.
+            if settings.ASK_JOB_MAX_RUNNING:
+                notify_workers()
+    finally:
+        loop.close()
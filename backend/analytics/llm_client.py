@@ -0,0 +1,405 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .prompt_builder import estimate_tokens
+
+HF_API_URL = "https://router.huggingface.co/v1/chat/completions"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+NUMERIC_TYPES = {"integer", "int", "float", "number", "numeric", "decimal"}
+TEXT_TYPES = {"string", "text"}
+FIELD_LINE = re.compile(r"^- (.+?) \((\w+)\)", re.M)
+
+_singleton = None
+_singleton_lock = threading.Lock()
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMUnavailableError(LLMError):
+    pass
+
+
+class _RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Opens after ``failure_threshold`` consecutive upstream failures and
+    # rejects calls for ``reset_seconds``; then lets a single probe through
+    # (half-open) and closes again if it succeeds.
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                raise LLMUnavailableError(
+                    f"LLM backend unavailable after repeated failures; retry in {max(remaining, 1):.0f}s."
+                )
+            # Restarting the clock means a probe that never reports back only
+            # blocks further probes for one more reset period.
+            self._probing = True
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one execution of ``fn``.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+        return call["result"], False
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield() so one cancelled caller doesn't cancel the shared request.
+        return await asyncio.shield(task), shared
+
+
+class HuggingFaceBackend:
+    name = "huggingface"
+
+    def __init__(self, url=HF_API_URL, timeout=60, pool_size=10):
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_client = None
+        self._async_loop = None
+        self._async_lock = threading.Lock()
+
+    def headers(self):
+        api_key = os.getenv("HUGGINGFACE_API_KEY")
+        if not api_key:
+            raise ValueError("HUGGINGFACE_API_KEY not found in environment variables.")
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def send(self, payload):
+        try:
+            return self.session.post(self.url, headers=self.headers(), json=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _RetryableError(f"Hugging Face API request failed: {e}")
+
+    def async_client(self):
+        # httpx clients are bound to the event loop they run on, and callers'
+        # loops come and go (one per streamed request), so a single client
+        # lives on a loop of its own in a daemon thread. Its pool is shared by
+        # every caller and is never left open on a closed loop.
+        with self._async_lock:
+            if self._async_client is None:
+                self._async_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._async_loop.run_forever, name="hf-async-client", daemon=True).start()
+                self._async_client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+        return self._async_client, self._async_loop
+
+    async def asend(self, payload):
+        client, loop = self.async_client()
+        post = client.post(self.url, headers=self.headers(), json=payload)
+        try:
+            # Cancelling the caller's await cancels the request on the client's loop.
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(post, loop))
+        except httpx.TransportError as e:
+            raise _RetryableError(f"Hugging Face API request failed: {e}")
+
+
+class _StubResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self._body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self._body
+
+
+def _alias(field):
+    return re.sub(r"\W+", "_", field).strip("_").lower() or "value"
+
+
+def _field(field):
+    return "row_data->>'" + field.replace("'", "''") + "'"
+
+
+def stub_render_plan(schema):
+    # A deterministic dashboard built from the dataset schema alone.
+    numeric = [f for f, t in schema.items() if str(t).lower() in NUMERIC_TYPES]
+    text = [f for f, t in schema.items() if str(t).lower() in TEXT_TYPES]
+    base = "FROM analytics_record WHERE dataset_id = %s"
+
+    blocks = [{"render": "kpi", "title": "Record Count", "sql": f"SELECT COUNT(*) AS record_count {base}"}]
+    if numeric:
+        measure = numeric[0]
+        total = f"total_{_alias(measure)}"
+        blocks.append({
+            "render": "kpi",
+            "title": f"Total {measure}",
+            "sql": f"SELECT SUM(({_field(measure)})::numeric) AS {total} {base}",
+        })
+        if text:
+            dimension = text[0]
+            blocks.append({
+                "render": "chart",
+                "title": f"{measure} by {dimension}",
+                "chart_type": "bar",
+                "x_axis": _alias(dimension),
+                "y_axis": total,
+                "sql": (
+                    f"SELECT {_field(dimension)} AS {_alias(dimension)}, "
+                    f"SUM(({_field(measure)})::numeric) AS {total} {base} "
+                    f"GROUP BY {_field(dimension)} ORDER BY {total} DESC"
+                ),
+            })
+    if schema:
+        columns = ", ".join(f"{_field(f)} AS {_alias(f)}" for f in list(schema)[:5])
+        blocks.append({"render": "table", "title": "Sample Records", "sql": f"SELECT {columns} {base} LIMIT 50"})
+    return blocks
+
+
+class StubBackend:
+    # Answers locally from the field list in the prompt; used for tests
+    # and benchmarks (LLM_BACKEND=stub). LLM_STUB_LATENCY_MS simulates the
+    # upstream round trip.
+    name = "stub"
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+
+    def respond(self, payload):
+        prompt = "\n".join(message["content"] for message in payload["messages"])
+        fields = prompt.split("FIELDS:", 1)[1] if "FIELDS:" in prompt else ""
+        schema = dict(FIELD_LINE.findall(fields))
+        content = json.dumps(stub_render_plan(schema))
+        return _StubResponse({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)},
+        })
+
+    def send(self, payload):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self.respond(payload)
+
+    async def asend(self, payload):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self.respond(payload)
+
+
+class LLMClient:
+    def __init__(self, backend, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 failure_threshold=5, reset_seconds=30):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "coalesced": 0, "upstream_requests": 0, "retries": 0, "failures": 0,
+                          "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _key(self, payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _backoff(self, attempt, retry_after=None):
+        # Full jitter, capped; a numeric Retry-After from the server wins.
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _check(self, response):
+        if response.status_code == 200:
+            result = response.json()
+            usage = result.get("usage") or {}
+            self._count("prompt_tokens", usage.get("prompt_tokens") or 0)
+            self._count("completion_tokens", usage.get("completion_tokens") or 0)
+            return result
+        if response.status_code in RETRYABLE_STATUS:
+            retry_after = response.headers.get("Retry-After")
+            raise _RetryableError(
+                f"Hugging Face API Error: {response.text}",
+                float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        raise LLMError(f"Hugging Face API Error: {response.text}")
+
+    def _give_up(self, error):
+        self._count("failures")
+        self.breaker.record_failure()
+        raise LLMError(str(error))
+
+    def _call(self, payload):
+        self.breaker.before_call()
+        for attempt in range(self.max_retries + 1):
+            self._count("upstream_requests")
+            try:
+                result = self._check(self.backend.send(payload))
+            except _RetryableError as e:
+                if attempt == self.max_retries:
+                    self._give_up(e)
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e.retry_after))
+                continue
+            except (LLMError, ValueError):
+                # Client-side errors (missing key, bad request) aren't an outage.
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def _acall(self, payload):
+        self.breaker.before_call()
+        for attempt in range(self.max_retries + 1):
+            self._count("upstream_requests")
+            try:
+                result = self._check(await self.backend.asend(payload))
+            except _RetryableError as e:
+                if attempt == self.max_retries:
+                    self._give_up(e)
+                self._count("retries")
+                await asyncio.sleep(self._backoff(attempt, e.retry_after))
+                continue
+            except (LLMError, ValueError):
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def complete(self, payload):
+        self._count("calls")
+        result, shared = self._flight.do(self._key(payload), lambda: self._call(payload))
+        if shared:
+            self._count("coalesced")
+        return result
+
+    async def acomplete(self, payload):
+        self._count("calls")
+        result, shared = await self._async_flight.do(self._key(payload), lambda: self._acall(payload))
+        if shared:
+            self._count("coalesced")
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["backend"] = self.backend.name
+        counters["circuit"] = self.breaker.state
+        return counters
+
+
+def get_llm_client():
+    global _singleton
+    with _singleton_lock:
+        if _singleton is None:
+            if settings.LLM_BACKEND == "stub":
+                backend = StubBackend(latency_ms=settings.LLM_STUB_LATENCY_MS)
+            else:
+                backend = HuggingFaceBackend(
+                    url=settings.LLM_API_URL,
+                    timeout=settings.LLM_TIMEOUT_SECONDS,
+                    pool_size=settings.LLM_POOL_MAXSIZE,
+                )
+            _singleton = LLMClient(
+                backend,
+                max_retries=settings.LLM_MAX_RETRIES,
+                backoff_base=settings.LLM_BACKOFF_BASE_SECONDS,
+                backoff_max=settings.LLM_BACKOFF_MAX_SECONDS,
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                reset_seconds=settings.LLM_CIRCUIT_RESET_SECONDS,
+            )
+    return _singleton
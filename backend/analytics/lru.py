@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Thread-safe in-process cache with optional TTL and an optional cost
+    # budget (e.g. total rows held) on top of the entry-count limit.
+
+    def __init__(self, max_entries=1000, ttl=None, max_cost=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_cost = max_cost
+        self.total_cost = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, cost, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, cost=1):
+        if self.max_cost is not None and cost > self.max_cost:
+            return False
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, cost, expires_at)
+            self.total_cost += cost
+            while len(self._data) > self.max_entries or (
+                self.max_cost is not None and self.total_cost > self.max_cost
+            ):
+                self._pop(next(iter(self._data)))
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_cost = 0
+
+    def _pop(self, key):
+        _, cost, _ = self._data.pop(key)
+        self.total_cost -= cost
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from analytics.index_advisor import apply_recommendation, recommend_indexes
+
+
+class Command(BaseCommand):
+    help = "Review (and optionally apply) index recommendations based on the fields block SQL uses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--apply", action="store_true", help="Create/drop the recommended indexes")
+        parser.add_argument("--min-hits", type=int, default=None, help="Override INDEX_ADVISOR_MIN_HITS")
+
+    def handle(self, *args, **options):
+        recommendations = recommend_indexes(options["dataset_ids"] or None, min_hits=options["min_hits"])
+        if not recommendations:
+            self.stdout.write("No index changes recommended.")
+            return
+
+        for recommendation in recommendations:
+            self.stdout.write(
+                f"[{recommendation['action'].upper()}] dataset {recommendation['dataset_id']} "
+                f"{recommendation['field']}::{recommendation['cast']} — {recommendation['reason']}\n"
+                f"    {recommendation['definition']}"
+            )
+            if not options["apply"]:
+                continue
+            try:
+                apply_recommendation(recommendation)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"    failed: {e}"))
+            else:
+                self.stdout.write(self.style.SUCCESS("    applied"))
+
+        if not options["apply"]:
+            self.stdout.write("Run again with --apply to make these changes.")
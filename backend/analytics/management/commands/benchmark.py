@@ -0,0 +1,241 @@
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from rest_framework.test import APIClient
+
+from analytics.executor import ROW_LIMIT, enforce_row_limit, execute_block_sql, serialize_rows
+from analytics.ingestion import ingest_rows
+from analytics.llm_client import NUMERIC_TYPES, stub_render_plan
+from analytics.models import Dataset
+from analytics.result_cache import get_result_cache
+from analytics.synthetic import DATASET_KINDS, generate_rows
+
+BENCHMARKS = ("ingest", "execute_block_sql", "serialize_rows", "ask_dataset")
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ingestion, block SQL execution, row serialization and the ask endpoint on "
+        "synthetic datasets, and report the timings as JSON for comparison across commits"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", nargs="+", type=int, default=[10_000], help="Dataset sizes to benchmark (e.g. 10000 100000 1000000)")
+        parser.add_argument("--kind", choices=sorted(DATASET_KINDS), default="sales", help="Synthetic dataset to generate")
+        parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+        parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case")
+        parser.add_argument("--concurrency", type=int, default=1, help="Concurrent clients for the ask_dataset load test")
+        parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic data generator")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+        parser.add_argument("--compare", help="A previous JSON report to compare median timings against")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated datasets")
+
+    def handle(self, *args, **options):
+        if settings.LLM_BACKEND != "stub":
+            raise CommandError(
+                "Benchmarks must not call a real LLM; run with LLM_BACKEND=stub "
+                "(and LLM_STUB_LATENCY_MS to simulate the round trip)."
+            )
+        if options["repeat"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--repeat and --concurrency must be at least 1.")
+
+        benchmarks = options["only"] or BENCHMARKS
+        results = []
+        for rows in options["rows"]:
+            labels = {"kind": options["kind"], "rows": rows}
+            # Ingestion is benchmarked by loading the dataset the others run on.
+            dataset, ingest = self.load_dataset(labels, options["seed"])
+            try:
+                if "ingest" in benchmarks:
+                    results.append(ingest)
+                if "execute_block_sql" in benchmarks:
+                    results.extend(self.bench_execute(dataset, labels, options["repeat"]))
+                if "serialize_rows" in benchmarks:
+                    results.append(self.bench_serialize(dataset, labels, options["repeat"]))
+                if "ask_dataset" in benchmarks:
+                    results.extend(self.bench_ask(dataset, labels, options["repeat"], options["concurrency"]))
+            finally:
+                if not options["keep"]:
+                    dataset.delete()
+
+        report = {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "postgres": connection.pg_version,
+                "llm_stub_latency_ms": settings.LLM_STUB_LATENCY_MS,
+                "block_executor_max_workers": settings.BLOCK_EXECUTOR_MAX_WORKERS,
+            },
+            "options": {key: options[key] for key in ("kind", "rows", "repeat", "concurrency", "seed")},
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stderr.write(f"Wrote {len(results)} results to {options['output']}.")
+        else:
+            self.stdout.write(output)
+        if options["compare"]:
+            self.compare(options["compare"], results)
+
+    def load_dataset(self, labels, seed):
+        kind, rows = labels["kind"], labels["rows"]
+        config = DATASET_KINDS[kind]
+        owner, _ = User.objects.get_or_create(username="admin")
+        self.stderr.write(f"Generating and ingesting {rows:,} {kind} rows...")
+        stats = ingest_rows(
+            generate_rows(kind, rows, seed=seed),
+            name=f"benchmark {kind} {rows}",
+            description="Synthetic dataset generated by manage.py benchmark",
+            owner=owner,
+            metadata=config["metadata"],
+        )
+        ingest = {
+            "benchmark": "ingest",
+            **labels,
+            "case": "ingest_rows",
+            "seconds": stats["seconds"],
+            "rows_per_second": stats["rows_per_second"],
+        }
+        return Dataset.objects.get(pk=stats["dataset_id"]), ingest
+
+    def bench_execute(self, dataset, labels, repeat):
+        # The stub LLM's canned render plan for the dataset: a count, a sum, a
+        # group-by and a table scan.
+        results = []
+        for block in stub_render_plan(dataset.metadata):
+            execute_block_sql(block["sql"], dataset.id)
+            samples = timed(lambda: execute_block_sql(block["sql"], dataset.id), repeat)
+            results.append(self.result("execute_block_sql", labels, block["title"], samples))
+        return results
+
+    def bench_serialize(self, dataset, labels, repeat):
+        # A full page of rows with every numeric field cast to NUMERIC, the
+        # column type serialize_rows converts.
+        columns = ", ".join(
+            f"(row_data->>'{field}')::numeric AS \"{field}\"" if str(kind).lower() in NUMERIC_TYPES
+            else f"row_data->>'{field}' AS \"{field}\""
+            for field, kind in dataset.metadata.items()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(enforce_row_limit(f"SELECT {columns} FROM analytics_record WHERE dataset_id = %s"), [dataset.id])
+            description, rows = cursor.description, cursor.fetchmany(ROW_LIMIT)
+        samples = timed(lambda: serialize_rows(description, rows), repeat)
+        result = self.result("serialize_rows", labels, f"{len(rows)} rows x {len(description)} columns", samples)
+        result["us_per_row"] = round(result["median_ms"] * 1000 / max(len(rows), 1), 3)
+        return result
+
+    def bench_ask(self, dataset, labels, repeat, concurrency):
+        # "cold": a new prompt with the result cache emptied, so every request
+        # goes through the (stub) LLM and runs its block SQL; "warm": the same
+        # prompt again, served from the plan and result caches.
+        warm_prompt = f"benchmark dashboard {uuid.uuid4().hex}"
+
+        def ask(prompt, cold):
+            if cold:
+                get_result_cache().invalidate_dataset(dataset.id)
+            started = time.perf_counter()
+            response = APIClient().post(
+                "/api/ask/", {"prompt": prompt, "dataset_id": dataset.id}, format="json",
+            )
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise CommandError(f"ask_dataset returned {response.status_code}: {response.content[:200]!r}")
+            return elapsed, response.json()["plan_cache"]
+
+        ask(warm_prompt, cold=False)
+        results = []
+        for case in ("cold", "warm"):
+            def one(i, case=case):
+                close_old_connections()
+                try:
+                    prompt = f"benchmark dashboard {uuid.uuid4().hex}" if case == "cold" else warm_prompt
+                    return ask(prompt, cold=case == "cold")
+                finally:
+                    close_old_connections()
+
+            started = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    runs = list(pool.map(one, range(repeat)))
+            else:
+                runs = [one(i) for i in range(repeat)]
+            wall = time.perf_counter() - started
+
+            result = self.result("ask_dataset", labels, case, [elapsed for elapsed, _ in runs])
+            result["concurrency"] = concurrency
+            result["requests_per_second"] = round(repeat / wall, 2)
+            result["plan_cache"] = {status: sum(1 for _, s in runs if s == status) for status in {s for _, s in runs}}
+            results.append(result)
+        return results
+
+    def result(self, benchmark, labels, case, samples):
+        return {"benchmark": benchmark, **labels, "case": case, **summarize(samples)}
+
+    def compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f"Can't read baseline report {path}: {e}")
+
+        def key(result):
+            return (result["benchmark"], result["kind"], result["rows"], result["case"])
+
+        before = {key(result): result for result in baseline.get("results", [])}
+        self.stderr.write(f"Compared with {path} (commit {baseline.get('commit') or 'unknown'}):")
+        for result in results:
+            old = before.get(key(result))
+            metric = "median_ms" if "median_ms" in result else "seconds"
+            if old is None or not old.get(metric):
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            self.stderr.write(
+                f"  {result['benchmark']:<18} {result['rows']:>10,} {result['case'][:32]:<32} "
+                f"{old[metric]:>10.2f} -> {result[metric]:>10.2f} {metric}  {change:+.1%}"
+            )
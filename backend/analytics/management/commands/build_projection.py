@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Dataset, DatasetProjection
+from analytics.projection import build_projection, refresh_projection, stale_projections
+
+
+class Command(BaseCommand):
+    help = "Build, refresh or drop the typed column projection of one or more datasets; run from cron with --stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--refresh", action="store_true", help="Incrementally refresh existing projections instead of rebuilding")
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Only projections behind their dataset (rebuilding those with updated or deleted records)",
+        )
+        parser.add_argument("--drop", action="store_true", help="Drop the projections")
+
+    def handle(self, *args, **options):
+        if options["stale"]:
+            for projection, full in stale_projections():
+                self.report(refresh_projection(projection, full=full), "Rebuilt" if full else "Refreshed")
+            return
+
+        datasets = Dataset.objects.all()
+        if options["dataset_ids"]:
+            datasets = datasets.filter(id__in=options["dataset_ids"])
+            missing = set(options["dataset_ids"]) - set(datasets.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown dataset id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for dataset in datasets.order_by("id"):
+            if options["drop"]:
+                deleted, _ = DatasetProjection.objects.filter(dataset=dataset).delete()
+                if deleted:
+                    self.stdout.write(self.style.SUCCESS(f"Dropped projection for '{dataset.name}'."))
+                continue
+
+            projection = DatasetProjection.objects.filter(dataset=dataset).first()
+            if options["refresh"] and projection is not None:
+                self.report(refresh_projection(projection), "Refreshed")
+            else:
+                self.report(build_projection(dataset), "Built")
+
+    def report(self, projection, verb):
+        name = projection.dataset.name
+        if projection.error:
+            self.stdout.write(self.style.WARNING(f"{projection.table_name} for '{name}' is unusable: {projection.error}"))
+        elif projection.needs_rebuild:
+            self.stdout.write(f"{projection.table_name} for '{name}' needs a rebuild (run with --stale).")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{verb} {projection.table_name} for '{name}' "
+                f"({len(projection.columns)} columns, up to record {projection.last_record_id})."
+            ))
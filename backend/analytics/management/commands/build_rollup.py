@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Dataset, DatasetRollup
+from analytics.rollup import build_rollup, refresh_rollup, stale_rollups
+
+
+class Command(BaseCommand):
+    help = "Build, refresh or drop the pre-aggregated rollup cube of one or more datasets; run from cron with --stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--refresh", action="store_true", help="Incrementally refresh existing cubes instead of rebuilding")
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Only cubes behind their dataset (rebuilding those with updated or deleted records)",
+        )
+        parser.add_argument("--drop", action="store_true", help="Drop the cubes")
+
+    def handle(self, *args, **options):
+        if options["stale"]:
+            for rollup, full in stale_rollups():
+                self.report(refresh_rollup(rollup, full=full), "Rebuilt" if full else "Refreshed")
+            return
+
+        datasets = Dataset.objects.all()
+        if options["dataset_ids"]:
+            datasets = datasets.filter(id__in=options["dataset_ids"])
+            missing = set(options["dataset_ids"]) - set(datasets.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown dataset id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for dataset in datasets.order_by("id"):
+            if options["drop"]:
+                deleted, _ = DatasetRollup.objects.filter(dataset=dataset).delete()
+                if deleted:
+                    self.stdout.write(self.style.SUCCESS(f"Dropped rollup for '{dataset.name}'."))
+                continue
+
+            rollup = DatasetRollup.objects.filter(dataset=dataset).first()
+            if options["refresh"] and rollup is not None:
+                self.report(refresh_rollup(rollup), "Refreshed")
+            else:
+                self.report(build_rollup(dataset), "Built")
+
+    def report(self, rollup, verb):
+        if rollup.needs_rebuild:
+            self.stdout.write(f"{rollup.table_name} for '{rollup.dataset.name}' needs a rebuild (run with --stale).")
+            return
+        dimensions = ", ".join(rollup.dimensions) or "none"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {rollup.table_name} for '{rollup.dataset.name}' (dimensions: {dimensions}; "
+            f"{len(rollup.measures)} measures; date: {rollup.date_field or 'none'}; "
+            f"up to record {rollup.last_record_id})."
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Dataset, DatasetSample
+from analytics.sampling import build_sample, refresh_sample, stale_samples
+
+
+class Command(BaseCommand):
+    help = "Build, refresh or drop the uniform sample that approximate answers are estimated from; run from cron with --stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--refresh", action="store_true", help="Sample newly added records into existing samples instead of redrawing")
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Only samples behind their dataset (redrawing those with updated or deleted records)",
+        )
+        parser.add_argument("--drop", action="store_true", help="Drop the samples")
+
+    def handle(self, *args, **options):
+        if options["stale"]:
+            for sample, full in stale_samples():
+                self.report(refresh_sample(sample, full=full), "Redrew" if full else "Refreshed")
+            return
+
+        datasets = Dataset.objects.all()
+        if options["dataset_ids"]:
+            datasets = datasets.filter(id__in=options["dataset_ids"])
+            missing = set(options["dataset_ids"]) - set(datasets.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown dataset id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for dataset in datasets.order_by("id"):
+            if options["drop"]:
+                deleted, _ = DatasetSample.objects.filter(dataset=dataset).delete()
+                if deleted:
+                    self.stdout.write(self.style.SUCCESS(f"Dropped sample for '{dataset.name}'."))
+                continue
+
+            sample = DatasetSample.objects.filter(dataset=dataset).first()
+            if options["refresh"] and sample is not None:
+                self.report(refresh_sample(sample), "Refreshed")
+            else:
+                self.report(build_sample(dataset), "Built")
+
+    def report(self, sample, verb):
+        if sample.needs_rebuild:
+            self.stdout.write(f"{sample.table_name} for '{sample.dataset.name}' needs a redraw (run with --stale).")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {sample.table_name} for '{sample.dataset.name}' ({sample.sample_rows} of "
+            f"{sample.population_rows} records, rate {sample.rate:.4g})."
+        ))
@@ -0,0 +1,58 @@
+import json
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from analytics.ingestion import FORMATS, IngestionError, detect_format, ingest_rows, read_rows
+from analytics.models import Dataset
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV, NDJSON or Parquet file into a new or existing dataset via PostgreSQL COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to load")
+        parser.add_argument("--dataset-id", type=int, help="Append to this existing dataset")
+        parser.add_argument("--name", help="Name of the dataset to create (default: file name)")
+        parser.add_argument("--description", default="", help="Description of the dataset to create")
+        parser.add_argument("--metadata", help="JSON field->type mapping for the new dataset (default: inferred)")
+        parser.add_argument("--format", choices=FORMATS, help="File format (default: from extension)")
+        parser.add_argument("--batch-size", type=int, default=settings.INGEST_BATCH_SIZE, help="Rows per COPY batch")
+        parser.add_argument("--max-errors", type=int, default=0, help="Invalid rows to skip before aborting")
+        parser.add_argument("--owner", default="admin", help="Username that owns a newly created dataset")
+
+    def handle(self, *args, **options):
+        dataset = None
+        if options["dataset_id"]:
+            dataset = Dataset.objects.filter(id=options["dataset_id"]).first()
+            if dataset is None:
+                raise CommandError(f"Dataset {options['dataset_id']} does not exist.")
+
+        def report(stats, elapsed):
+            rate = stats["rows"] / elapsed if elapsed else 0
+            self.stdout.write(f"  batch {stats['batches']}: {stats['rows']:,} rows ({rate:,.0f} rows/s)")
+
+        try:
+            fmt = detect_format(options["path"], options["format"])
+            with open(options["path"], "rb") as fileobj:
+                stats = ingest_rows(
+                    read_rows(fileobj, fmt, options["batch_size"]),
+                    dataset=dataset,
+                    name=options["name"] or os.path.basename(options["path"]),
+                    description=options["description"],
+                    owner=User.objects.get_or_create(username=options["owner"])[0],
+                    metadata=json.loads(options["metadata"]) if options["metadata"] else None,
+                    batch_size=options["batch_size"],
+                    max_errors=options["max_errors"],
+                    progress=report,
+                )
+        except (IngestionError, OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in stats["errors"]:
+            self.stderr.write(f"  skipped {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {stats['rows']:,} rows into dataset {stats['dataset_id']} in {stats['seconds']}s "
+            f"({stats['rows_per_second']:,} rows/s, {stats['rejected']} rejected)."
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Dataset
+from analytics.profiling import refresh_profile, stale_profiles
+
+
+class Command(BaseCommand):
+    help = "Compute or incrementally refresh the column statistics profile of one or more datasets; run from cron with --stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--incremental", action="store_true", help="Only merge records added since the last refresh")
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Only datasets whose profile is missing or behind (rescanning only those with updated or deleted records)",
+        )
+
+    def handle(self, *args, **options):
+        if options["stale"]:
+            targets = [
+                (dataset, profile is None or profile.needs_rescan) for dataset, profile in stale_profiles()
+            ]
+        else:
+            datasets = Dataset.objects.all()
+            if options["dataset_ids"]:
+                datasets = datasets.filter(id__in=options["dataset_ids"])
+                missing = set(options["dataset_ids"]) - set(datasets.values_list("id", flat=True))
+                if missing:
+                    raise CommandError(f"Unknown dataset id(s): {', '.join(map(str, sorted(missing)))}")
+            targets = [(dataset, not options["incremental"]) for dataset in datasets.order_by("id")]
+
+        for dataset, full in targets:
+            profile = refresh_profile(dataset, full=full)
+            self.stdout.write(self.style.SUCCESS(
+                f"Profiled '{dataset.name}': {profile.row_count} rows, {len(profile.fields)} fields."
+            ))
+            for field, summary in profile.fields.items():
+                line = f"  {field} ({summary['type']}): {summary['distinct']} distinct, {summary['null_rate']:.1%} null"
+                if summary["min"] is not None:
+                    line += f", {summary['min']} .. {summary['max']}"
+                self.stdout.write(line)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import Dataset
+from analytics.prompt_builder import build_prompt, estimate_tokens
+
+
+class Command(BaseCommand):
+    help = "Show the LLM prompt built for one or more datasets and its estimated token count"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset_ids", nargs="*", type=int, help="Dataset ids (default: all datasets)")
+        parser.add_argument("--prompt", default="Give me an overview of this dataset", help="User request to build the prompt for")
+        parser.add_argument("--show", action="store_true", help="Print the full system and user messages")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.all()
+        if options["dataset_ids"]:
+            datasets = datasets.filter(id__in=options["dataset_ids"])
+            missing = set(options["dataset_ids"]) - set(datasets.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown dataset id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for dataset in datasets.order_by("id"):
+            system_message, user_message, info = build_prompt(options["prompt"], dataset)
+            if options["show"]:
+                self.stdout.write(f"--- system ---\n{system_message}\n--- user ---\n{user_message}\n")
+            style = self.style.WARNING if info["over_budget"] else self.style.SUCCESS
+            self.stdout.write(style(
+                f"'{dataset.name}': ~{info['estimated_tokens']} tokens "
+                f"(system ~{estimate_tokens(system_message)}, dataset/request ~{estimate_tokens(user_message)}; "
+                f"budget {info['budget']}, trim level {info['trim_level']})."
+            ))
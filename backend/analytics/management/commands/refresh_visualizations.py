@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import SavedVisualization
+from analytics.snapshots import due_visualizations, refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = "Replay saved visualizations that are due (or the given ones) and store their snapshots; run from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("visualization_ids", nargs="*", type=int, help="Refresh these visualizations regardless of schedule")
+        parser.add_argument("--stale", action="store_true", help="Also refresh any snapshot whose dataset has changed since")
+
+    def handle(self, *args, **options):
+        if options["visualization_ids"]:
+            visualizations = SavedVisualization.objects.filter(id__in=options["visualization_ids"]).select_related("dataset")
+            missing = set(options["visualization_ids"]) - set(visualizations.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown visualization id(s): {', '.join(map(str, sorted(missing)))}")
+        else:
+            visualizations = due_visualizations(stale=options["stale"])
+
+        failed = 0
+        for visualization in visualizations:
+            try:
+                snapshot = refresh_snapshot(visualization)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"Visualization {visualization.id}: {e}"))
+                continue
+            style = self.style.WARNING if snapshot.warnings else self.style.SUCCESS
+            self.stdout.write(style(
+                f"Visualization {visualization.id} ('{visualization}'): {len(snapshot.blocks)} blocks "
+                f"in {snapshot.duration_ms} ms, data version {snapshot.data_version}"
+                + (f", {len(snapshot.warnings)} warnings." if snapshot.warnings else ".")
+            ))
+        if failed:
+            raise CommandError(f"{failed} visualization(s) failed to refresh.")
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from analytics.jobs import run_worker
+
+
+def worker_main(index):
+    # Ctrl-C reaches the whole process group; the parent decides when to stop
+    # and sends SIGTERM.
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    # A SIGTERM that arrived since the fork was held until now.
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+    run_worker(f"{socket.gethostname()}:{os.getpid()}:{index}", lambda: bool(stopping))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the worker processes that execute queued ask jobs (POST /api/ask/jobs/), "
+        "restarting any that die; stop with SIGINT/SIGTERM"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=settings.ASK_JOB_WORKERS, help="Worker processes to run")
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1:
+            raise CommandError("--processes must be at least 1.")
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        stopping = []
+        signal.signal(signal.SIGINT, lambda *args: stopping.append(True))
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+        def start(index):
+            # The child inherits this process's SIGTERM handler until it sets
+            # its own, so SIGTERM stays blocked across the fork.
+            process = context.Process(target=worker_main, args=(index,), name=f"ask-worker-{index}")
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+            try:
+                process.start()
+            finally:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            return process
+
+        workers = {index: start(index) for index in range(options["processes"])}
+        self.stdout.write(f"Started {len(workers)} ask worker(s): {', '.join(str(p.pid) for p in workers.values())}")
+
+        while not stopping:
+            time.sleep(1)
+            for index, process in list(workers.items()):
+                if not process.is_alive() and not stopping:
+                    self.stderr.write(self.style.WARNING(
+                        f"Worker {process.pid} exited with code {process.exitcode}; restarting."
+                    ))
+                    workers[index] = start(index)
+
+        # Workers finish their current job, or give up waiting for one within
+        # ASK_JOB_POLL_SECONDS.
+        self.stdout.write("Stopping ask workers...")
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join(timeout=settings.ASK_JOB_STALE_SECONDS)
+            if process.is_alive():
+                process.kill()
+        self.stdout.write(self.style.SUCCESS("Ask workers stopped."))
@@ -0,0 +1,115 @@
+import gzip
+import re
+import time
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .instrumentation import Trace, end_trace, get_trace_store, metrics, record, start_trace
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# API media types (and the Prometheus text format) only: HTML pages (the
+# browsable API, admin) can carry a CSRF token next to reflected input, which
+# compression would expose (BREACH).
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/vnd.datasage.columnar+json", "application/msgpack",
+    "text/plain; version=0.0.4",
+)
+
+
+def accepted_encodings(header):
+    # Content codings the client accepts (q > 0), e.g. {"br", "gzip"}.
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        match = re.search(r"q=([0-9.]+)", params)
+        if coding and not (match and float(match.group(1)) == 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    # Compresses API responses with brotli (when installed) or gzip, as
+    # negotiated through Accept-Encoding. Streaming responses are left alone so
+    # streamed events reach the client as soon as they are produced.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES
+            or not response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accepted = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+        if brotli is not None and "br" in accepted:
+            content, coding = brotli.compress(response.content, quality=5), "br"
+        elif "gzip" in accepted:
+            content, coding = gzip.compress(response.content, compresslevel=6, mtime=0), "gzip"
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = coding
+        if response.has_header("ETag"):
+            response["ETag"] = re.sub(r'^"(.*)"$', r'W/"\1"', response["ETag"])
+        return response
+
+
+class TimingMiddleware:
+    # Traces each request: the time spent per stage goes out in a
+    # Server-Timing header (except on streams, whose headers are sent before
+    # the work is done), requests are counted per view and status, and the
+    # full trace of requests sent with "X-Trace: 1" (or of every request, with
+    # TRACE_ALL_REQUESTS) is kept for /api/traces/<id>/.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        keep = settings.TRACE_ALL_REQUESTS or request.headers.get("X-Trace", "") in ("1", "true")
+        trace = Trace(request.method, request.path, keep=keep)
+        token = start_trace(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_trace(token)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match is not None and match.url_name else "unmatched"
+        trace.finish(response.status_code, view)
+        metrics.incr("datasage_http_requests_total", view=view, status=response.status_code)
+        metrics.observe("datasage_http_request_seconds", trace.duration_ms / 1000, view=view)
+
+        if not response.streaming:
+            response["Server-Timing"] = trace.server_timing()
+        if keep:
+            get_trace_store().add(trace)
+            response["X-Trace-Id"] = trace.id
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (JSON, MessagePack, Arrow, ...) after the
+        # view returns; time that as the "render" stage.
+        if settings.INSTRUMENTATION_ENABLED:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: record("render", started, time.perf_counter() - started)
+            )
+        return response
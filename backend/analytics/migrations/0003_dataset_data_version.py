@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_renderplancacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_dataset_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetProjection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=63, unique=True)),
+                ('columns', models.JSONField()),
+                ('last_record_id', models.BigIntegerField(default=0)),
+                ('data_version', models.PositiveBigIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='projection', to='analytics.dataset')),
+            ],
+        ),
+    ]
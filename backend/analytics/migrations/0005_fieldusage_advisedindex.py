@@ -0,0 +1,42 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_datasetprojection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdvisedIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=63, unique=True)),
+                ('table_name', models.CharField(max_length=63)),
+                ('field', models.CharField(max_length=255)),
+                ('cast', models.CharField(max_length=32)),
+                ('definition', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='advised_indexes', to='analytics.dataset')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FieldUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=255)),
+                ('cast', models.CharField(max_length=32)),
+                ('clause', models.CharField(max_length=16)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField()),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='field_usage', to='analytics.dataset')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dataset', 'field', 'cast', 'clause'), name='unique_field_usage')],
+            },
+        ),
+    ]
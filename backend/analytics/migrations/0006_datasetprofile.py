@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_fieldusage_advisedindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_count', models.PositiveBigIntegerField(default=0)),
+                ('fields', models.JSONField(default=dict)),
+                ('sample_rows', models.JSONField(default=list)),
+                ('state', models.JSONField(default=dict)),
+                ('last_record_id', models.BigIntegerField(default=0)),
+                ('data_version', models.PositiveBigIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='analytics.dataset')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:34
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_datasetprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedvisualization',
+            name='dataset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='saved_visualizations', to='analytics.dataset'),
+        ),
+        migrations.AddField(
+            model_name='savedvisualization',
+            name='next_refresh_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='savedvisualization',
+            name='refresh_interval_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='VisualizationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blocks', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('warnings', models.JSONField(default=list)),
+                ('data_version', models.PositiveBigIntegerField()),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+                ('visualization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='analytics.savedvisualization')),
+            ],
+        ),
+    ]
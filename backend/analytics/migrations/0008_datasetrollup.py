@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_savedvisualization_dataset_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=63, unique=True)),
+                ('dimensions', models.JSONField(default=list)),
+                ('measures', models.JSONField(default=list)),
+                ('date_field', models.CharField(blank=True, max_length=255)),
+                ('last_record_id', models.BigIntegerField(default=0)),
+                ('data_version', models.PositiveBigIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rollup', to='analytics.dataset')),
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+from django.db import migrations
+
+# Rebuilds analytics_record as a table LIST-partitioned on dataset_id, with a
+# partition per existing dataset and a default partition, and copies the
+# records over. The primary key becomes (id, dataset_id), since a partitioned
+# table's unique constraints must include the partition key; ids keep coming
+# from one sequence, so they stay unique. Advised indexes on the old table go
+# with it and are recommended again by the index advisor, on the partitions.
+
+FOREIGN_KEY = "analytics_record_dataset_id_10c26002_fk_analytics_dataset_id"
+DATASET_INDEX = "analytics_record_dataset_id_10c26002"
+
+
+def _reset_sequence(execute):
+    execute(
+        "SELECT setval(pg_get_serial_sequence('analytics_record', 'id'), COALESCE(MAX(id), 0) + 1, false) "
+        "FROM analytics_record"
+    )
+
+
+def partition_records(apps, schema_editor):
+    execute = schema_editor.execute
+    execute("ALTER TABLE analytics_record RENAME TO analytics_record_unpartitioned")
+    execute("ALTER TABLE analytics_record_unpartitioned RENAME CONSTRAINT analytics_record_pkey TO analytics_record_unpartitioned_pkey")
+    execute("ALTER SEQUENCE analytics_record_id_seq RENAME TO analytics_record_unpartitioned_id_seq")
+    execute(
+        "CREATE TABLE analytics_record ("
+        "id bigint GENERATED BY DEFAULT AS IDENTITY, dataset_id bigint NOT NULL, "
+        "row_data jsonb NOT NULL, created_at timestamptz NOT NULL, "
+        "CONSTRAINT analytics_record_pkey PRIMARY KEY (id, dataset_id)"
+        ") PARTITION BY LIST (dataset_id)"
+    )
+    execute("CREATE TABLE analytics_record_default PARTITION OF analytics_record DEFAULT")
+    for dataset_id in apps.get_model("analytics", "Dataset").objects.values_list("id", flat=True):
+        execute(f"CREATE TABLE analytics_record_p{int(dataset_id)} PARTITION OF analytics_record FOR VALUES IN ({int(dataset_id)})")
+    execute(
+        "INSERT INTO analytics_record (id, dataset_id, row_data, created_at) "
+        "SELECT id, dataset_id, row_data, created_at FROM analytics_record_unpartitioned"
+    )
+    _reset_sequence(execute)
+    execute("DROP TABLE analytics_record_unpartitioned")
+    execute(
+        f"ALTER TABLE analytics_record ADD CONSTRAINT {FOREIGN_KEY} FOREIGN KEY (dataset_id) "
+        f"REFERENCES analytics_dataset (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    execute("ANALYZE analytics_record")
+    apps.get_model("analytics", "AdvisedIndex").objects.filter(table_name="analytics_record").delete()
+
+
+def unpartition_records(apps, schema_editor):
+    execute = schema_editor.execute
+    execute("ALTER TABLE analytics_record RENAME TO analytics_record_partitioned")
+    execute("ALTER TABLE analytics_record_partitioned RENAME CONSTRAINT analytics_record_pkey TO analytics_record_partitioned_pkey")
+    execute("ALTER SEQUENCE analytics_record_id_seq RENAME TO analytics_record_partitioned_id_seq")
+    execute(
+        "CREATE TABLE analytics_record ("
+        "id bigint GENERATED BY DEFAULT AS IDENTITY CONSTRAINT analytics_record_pkey PRIMARY KEY, "
+        "dataset_id bigint NOT NULL, row_data jsonb NOT NULL, created_at timestamptz NOT NULL)"
+    )
+    execute(
+        "INSERT INTO analytics_record (id, dataset_id, row_data, created_at) "
+        "SELECT id, dataset_id, row_data, created_at FROM analytics_record_partitioned"
+    )
+    _reset_sequence(execute)
+    execute("DROP TABLE analytics_record_partitioned CASCADE")
+    execute(f"CREATE INDEX {DATASET_INDEX} ON analytics_record (dataset_id)")
+    execute(
+        f"ALTER TABLE analytics_record ADD CONSTRAINT {FOREIGN_KEY} FOREIGN KEY (dataset_id) "
+        f"REFERENCES analytics_dataset (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    execute("ANALYZE analytics_record")
+    apps.get_model("analytics", "AdvisedIndex").objects.filter(table_name__startswith="analytics_record_").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_datasetsample'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_records, unpartition_records),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:57
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0011_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AskJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt', models.TextField()),
+                ('approximate', models.BooleanField(default=False)),
+                ('refine', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='queued', max_length=16)),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('plan_cache', models.CharField(blank=True, max_length=32)),
+                ('block_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('blocks', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('warnings', models.JSONField(default=list)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ask_jobs', to='analytics.dataset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='analytics_askjob_queue')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Moves any records left in analytics_record_default into partitions of their
+# own and drops the default partition: PostgreSQL can't detach a partition
+# CONCURRENTLY while the table has one, and deleting a dataset now does.
+
+
+def drop_default_partition(apps, schema_editor):
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT dataset_id FROM analytics_record_default")
+        dataset_ids = [row[0] for row in cursor.fetchall()]
+    execute("ALTER TABLE analytics_record DETACH PARTITION analytics_record_default")
+    for dataset_id in dataset_ids:
+        table = f"analytics_record_p{int(dataset_id)}"
+        execute(f"CREATE TABLE {table} (LIKE analytics_record INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        execute(
+            f"INSERT INTO {table} (id, dataset_id, row_data, created_at) "
+            f"SELECT id, dataset_id, row_data, created_at FROM analytics_record_default WHERE dataset_id = %s",
+            [int(dataset_id)],
+        )
+        execute(f"ALTER TABLE analytics_record ATTACH PARTITION {table} FOR VALUES IN ({int(dataset_id)})")
+    execute("DROP TABLE analytics_record_default")
+
+
+def create_default_partition(apps, schema_editor):
+    schema_editor.execute("CREATE TABLE analytics_record_default PARTITION OF analytics_record DEFAULT")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0012_askjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_default_partition, create_default_partition),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0013_drop_default_partition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetprofile',
+            name='needs_rescan',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0014_datasetprofile_needs_rescan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetprojection',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0015_datasetprojection_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetprojection',
+            name='needs_rebuild',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0016_datasetprojection_needs_rebuild'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetrollup',
+            name='needs_rebuild',
+            field=models.BooleanField(default=False),
+        ),
+    ]
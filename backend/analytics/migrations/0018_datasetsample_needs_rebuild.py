@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0017_datasetrollup_needs_rebuild'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetsample',
+            name='needs_rebuild',
+            field=models.BooleanField(default=False),
+        ),
+    ]
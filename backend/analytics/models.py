@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .signals import lock_record_writes, notify_records_changed
 
 # Create your models here.
 class Dataset(models.Model):
@@ -7,24 +10,266 @@ class Dataset(models.Model):
     description = models.TextField()
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='datasets')
     metadata = models.JSONField()
+    # Bumped on every insert/update/delete of the dataset's records; used to
+    # key and invalidate cached query results.
+    data_version = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+class CatalogVersion(models.Model):
+    # Single row bumped after every dataset create/change/delete commits; keys
+    # the cached dataset catalog and its ETag.
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+class RecordQuerySet(models.QuerySet):
+    # Record changes are announced here rather than through post_save/post_delete
+    # receivers, which would stop Django from fast-deleting a dataset's records.
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            lock_record_writes({obj.dataset_id for obj in objs})
+            created = super().bulk_create(objs, *args, **kwargs)
+            notify_records_changed({obj.dataset_id for obj in created}, "insert")
+        return created
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            dataset_ids = set(self.values_list("dataset_id", flat=True).distinct())
+            lock_record_writes(dataset_ids)
+            rows = super().update(**kwargs)
+            notify_records_changed(dataset_ids, "update")
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            dataset_ids = set(self.values_list("dataset_id", flat=True).distinct())
+            lock_record_writes(dataset_ids)
+            result = super().delete()
+            notify_records_changed(dataset_ids, "delete")
+        return result
+
+
 class Record(models.Model):
+    # The table is LIST-partitioned on dataset_id, with (id, dataset_id) as its
+    # primary key in the database; see partitions.py and migration 0010.
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='records')
     row_data = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RecordQuerySet.as_manager()
+
     def __str__(self):
         return f"Record in {self.dataset.name}"
 
+    def save(self, *args, **kwargs):
+        action = "insert" if self._state.adding else "update"
+        with transaction.atomic():
+            lock_record_writes({self.dataset_id})
+            super().save(*args, **kwargs)
+            notify_records_changed({self.dataset_id}, action)
+
+    def delete(self, *args, **kwargs):
+        dataset_id = self.dataset_id
+        with transaction.atomic():
+            lock_record_writes({dataset_id})
+            result = super().delete(*args, **kwargs)
+            notify_records_changed({dataset_id}, "delete")
+        return result
+
 
 class SavedVisualization(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_visualizations')
+    # The dataset the render plan's SQL runs against; required to replay it.
+    dataset = models.ForeignKey(
+        Dataset, on_delete=models.CASCADE, related_name='saved_visualizations', null=True, blank=True,
+    )
     prompt = models.TextField()
     render_plan = models.JSONField()
+    # When set, `manage.py refresh_visualizations` re-runs the plan this often.
+    refresh_interval_seconds = models.PositiveIntegerField(null=True, blank=True)
+    next_refresh_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return self.prompt[:50]
\ No newline at end of file
+        return self.prompt[:50]
+
+
+class VisualizationSnapshot(models.Model):
+    # The assembled dashboard of a saved visualization, as of ``data_version``
+    # of its dataset; served as is while the dataset hasn't changed.
+    visualization = models.OneToOneField(SavedVisualization, on_delete=models.CASCADE, related_name='snapshot')
+    blocks = models.JSONField(encoder=DjangoJSONEncoder)
+    warnings = models.JSONField(default=list)
+    data_version = models.PositiveBigIntegerField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Snapshot of {self.visualization}"
+
+class RenderPlanCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='cached_render_plans')
+    prompt = models.TextField()
+    render_plan = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.prompt[:50]
+
+
+class DatasetProjection(models.Model):
+    # Typed, per-dataset copy of row_data (one real column per metadata field)
+    # that block SQL is transparently rewritten to target.
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name='projection')
+    table_name = models.CharField(max_length=63, unique=True)
+    columns = models.JSONField()
+    last_record_id = models.BigIntegerField(default=0)
+    data_version = models.PositiveBigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    # Why the last refresh couldn't copy every value (the projection is unused
+    # meanwhile); empty when it holds them all.
+    error = models.TextField(blank=True, default="")
+    # Set when records are updated or deleted; the projection is unused until
+    # `build_projection --stale` rebuilds it.
+    needs_rebuild = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.table_name
+
+
+class DatasetRollup(models.Model):
+    # Pre-aggregated cube of a dataset (counts and numeric sums/min/max by
+    # categorical dimension and day) that aggregate block SQL is rewritten to
+    # read.
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name='rollup')
+    table_name = models.CharField(max_length=63, unique=True)
+    dimensions = models.JSONField(default=list)
+    measures = models.JSONField(default=list)
+    date_field = models.CharField(max_length=255, blank=True)
+    last_record_id = models.BigIntegerField(default=0)
+    data_version = models.PositiveBigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    # Set when records are updated or deleted; the cube is unused until
+    # `build_rollup --stale` rebuilds it.
+    needs_rebuild = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.table_name
+
+
+class DatasetSample(models.Model):
+    # Uniform (Bernoulli) sample of a dataset's records, kept at roughly
+    # APPROX_SAMPLE_ROWS rows, that approximate-mode block SQL runs against.
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name='sample')
+    table_name = models.CharField(max_length=63, unique=True)
+    rate = models.FloatField(default=1.0)
+    population_rows = models.PositiveBigIntegerField(default=0)
+    sample_rows = models.PositiveBigIntegerField(default=0)
+    last_record_id = models.BigIntegerField(default=0)
+    data_version = models.PositiveBigIntegerField(default=0)
+    # Set when records are updated or deleted; queries use a TABLESAMPLE
+    # until `build_sample --stale` redraws it.
+    needs_rebuild = models.BooleanField(default=False)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.table_name
+
+
+class FieldUsage(models.Model):
+    # How often generated SQL filters/groups/sorts on a dataset field, keyed by
+    # the cast applied to it. Feeds the index advisor.
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='field_usage')
+    field = models.CharField(max_length=255)
+    cast = models.CharField(max_length=32)
+    clause = models.CharField(max_length=16)
+    hits = models.PositiveBigIntegerField(default=0)
+    last_used_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dataset', 'field', 'cast', 'clause'], name='unique_field_usage'),
+        ]
+
+    def __str__(self):
+        return f"{self.field}::{self.cast} in {self.clause}"
+
+
+class AdvisedIndex(models.Model):
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='advised_indexes')
+    name = models.CharField(max_length=63, unique=True)
+    table_name = models.CharField(max_length=63)
+    field = models.CharField(max_length=255)
+    cast = models.CharField(max_length=32)
+    definition = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class DatasetProfile(models.Model):
+    # Per-field statistics computed in one pass over row_data and merged
+    # incrementally as records are appended. ``state`` holds the mergeable
+    # sketches (HyperLogLog registers, top-k counters, reservoirs) that
+    # ``fields`` is summarised from.
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name='profile')
+    row_count = models.PositiveBigIntegerField(default=0)
+    fields = models.JSONField(default=dict)
+    sample_rows = models.JSONField(default=list)
+    state = models.JSONField(default=dict)
+    last_record_id = models.BigIntegerField(default=0)
+    data_version = models.PositiveBigIntegerField(default=0)
+    # Set when records were updated or deleted since the last full scan; the
+    # sketches can't have them subtracted, so only a rescan clears it.
+    needs_rescan = models.BooleanField(default=False)
+    computed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Profile of {self.dataset}"
+
+
+class AskJob(models.Model):
+    # An ask request queued for the worker processes (`manage.py
+    # run_ask_workers`). ``blocks`` fills in as block results arrive, and
+    # ``revision`` is bumped on every change for long-polling clients.
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)]
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='ask_jobs')
+    prompt = models.TextField()
+    approximate = models.BooleanField(default=False)
+    refine = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    revision = models.PositiveIntegerField(default=0)
+    plan_cache = models.CharField(max_length=32, blank=True)
+    block_count = models.PositiveIntegerField(null=True, blank=True)
+    blocks = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    warnings = models.JSONField(default=list)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'], name='analytics_askjob_queue')]
+
+    def __str__(self):
+        return f"{self.status} job: {self.prompt[:50]}"
@@ -0,0 +1,176 @@
+import re
+
+from django.conf import settings
+from django.core import signing
+
+from .executor import ROW_LIMIT, run_blocks
+from .models import Dataset
+
+# Table blocks are paged with a signed cursor token instead of being cut off
+# at ROW_LIMIT. Plain row scans of analytics_record are paged by keyset on the
+# record id (each page is an index range scan); other ordered queries without
+# their own LIMIT/OFFSET are paged by OFFSET and pinned to the dataset version
+# they started on. OFFSET pages are ordered by the record id (row scans) or by
+# every output column (anything else) after the query's own ORDER BY, so rows
+# that tie don't move between pages; queries with no ORDER BY, or whose output
+# columns can't be counted (SELECT *), have no stable row order to page
+# through and aren't paged.
+
+PAGE_KEY = "_page_key"
+CURSOR_SALT = "analytics.table-cursor"
+
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_NESTED = re.compile(r"\([^()]*\)")
+_NOT_KEYSET = re.compile(
+    r"\b(GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET|FETCH|DISTINCT|UNION|INTERSECT|EXCEPT|WINDOW|JOIN|OVER"
+    r"|COUNT|SUM|AVG|MIN|MAX|ARRAY_AGG|STRING_AGG|JSONB?_AGG|JSONB?_OBJECT_AGG|BOOL_AND|BOOL_OR|EVERY)\b",
+    re.I,
+)
+_NOT_OFFSET = re.compile(r"\b(LIMIT|OFFSET|FETCH)\b", re.I)
+_ORDER_BY = re.compile(r"\bORDER\s+BY\b", re.I)
+_SELECT_LIST = re.compile(
+    r"^\s*SELECT\s+(?:ALL\s+|DISTINCT\s+(?:ON\s*\(\)\s*)?)?(?P<select>.+?)\s+FROM\b", re.I | re.S,
+)
+_SCAN = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+analytics_record\b"
+    r"(?P<alias_clause>\s+(?:AS\s+)?(?!WHERE\b)(?P<alias>\w+))?\s+WHERE\s+(?P<where>.+)$",
+    re.I | re.S,
+)
+
+
+class CursorError(Exception):
+    pass
+
+
+class CursorConflict(CursorError):
+    # The cursor is valid but its dataset has changed since the first page.
+    pass
+
+
+def _top_level(sql):
+    # Blanks out literals, quoted identifiers and everything in parentheses,
+    # leaving only the outermost query's keywords.
+    text = _QUOTED.sub("''", sql)
+    while True:
+        collapsed = _NESTED.sub("()", text)
+        if collapsed == text:
+            return text
+        text = collapsed
+
+
+def page_size():
+    return min(settings.TABLE_PAGE_SIZE, ROW_LIMIT)
+
+
+def _row_scan(sql):
+    # The _SCAN match when the query reads analytics_record rows one for one
+    # (no grouping, aggregates, DISTINCT, joins or set operations), whatever
+    # its ORDER BY; else None.
+    unquoted = _QUOTED.sub("''", sql)
+    if len(re.findall(r"\bSELECT\b", unquoted, re.I)) != 1:
+        return None
+    if _NOT_KEYSET.search(_ORDER_BY.sub("", _top_level(sql))):
+        return None
+    return _SCAN.match(sql)
+
+
+def _output_columns(sql):
+    # How many columns the outermost SELECT returns, or None when it can't be
+    # told from the SQL (a * or a SELECT without FROM).
+    match = _SELECT_LIST.match(_top_level(sql))
+    if match is None:
+        return None
+    items = [item.strip() for item in match.group("select").split(",")]
+    if any(item == "*" or item.endswith(".*") for item in items):
+        return None
+    return len(items)
+
+
+def page_mode(sql):
+    # "keyset", "offset", or None when the query can't be paged (it has its
+    # own LIMIT/OFFSET, has no row order, or isn't a SELECT).
+    sql = sql.strip().rstrip(";").strip()
+    if not sql.upper().startswith("SELECT"):
+        return None
+    top = _top_level(sql)
+    if not _ORDER_BY.search(top):
+        return "keyset" if _row_scan(sql) else None
+    if not _NOT_OFFSET.search(top) and (_row_scan(sql) or _output_columns(sql)):
+        return "offset"
+    return None
+
+
+def page_sql(sql, mode, position):
+    # The block SQL for one page starting after ``position`` (the last record
+    # id for keyset pages, the row offset otherwise). ``position`` is always an
+    # int, so it is inlined and the query keeps its single dataset_id parameter.
+    sql = sql.strip().rstrip(";").strip()
+    limit = page_size()
+    match = _row_scan(sql)
+    ref = (match.group("alias") or "analytics_record") if match else None
+    if mode == "keyset":
+        return (
+            f"SELECT {ref}.id AS {PAGE_KEY}, {match.group('select')} "
+            f"FROM analytics_record{match.group('alias_clause') or ''} "
+            f"WHERE ({match.group('where')}) AND {ref}.id > {int(position)} "
+            f"ORDER BY {ref}.id LIMIT {limit}"
+        )
+    if match:
+        sql = f"{sql}, {ref}.id"
+    else:
+        sql = f"{sql}, " + ", ".join(str(n) for n in range(1, _output_columns(sql) + 1))
+    return f"{sql} LIMIT {limit} OFFSET {int(position)}"
+
+
+def make_cursor(sql, mode, position, dataset_id, data_version):
+    return signing.dumps(
+        {"sql": sql, "mode": mode, "position": position, "dataset_id": dataset_id, "version": data_version},
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def read_cursor(token):
+    try:
+        return signing.loads(token, salt=CURSOR_SALT, max_age=settings.TABLE_CURSOR_MAX_AGE_SECONDS)
+    except signing.SignatureExpired:
+        raise CursorError("This cursor has expired; run the query again.")
+    except signing.BadSignature:
+        raise CursorError("Invalid cursor.")
+
+
+def finish_page(result, sql, mode, position, dataset_id, data_version):
+    # Turns a page query result into (columns, data, warning, next_cursor).
+    columns, data, warning = result
+    if warning or mode is None:
+        return columns, data, warning, None
+
+    if mode == "keyset":
+        last_key = data[-1][PAGE_KEY] if data else position
+        columns = [column for column in columns if column != PAGE_KEY]
+        data = [{k: v for k, v in row.items() if k != PAGE_KEY} for row in data]
+        next_position = last_key
+    else:
+        next_position = position + len(data)
+
+    next_cursor = None
+    if len(data) == page_size():
+        next_cursor = make_cursor(sql, mode, next_position, dataset_id, data_version)
+    return columns, data, None, next_cursor
+
+
+def fetch_page(token):
+    # Runs the page a cursor points at; returns (columns, data, warning,
+    # next_cursor).
+    cursor = read_cursor(token)
+    dataset = Dataset.objects.filter(id=cursor["dataset_id"]).first()
+    if dataset is None:
+        raise CursorError("The dataset for this cursor no longer exists.")
+    if cursor["mode"] == "offset" and dataset.data_version != cursor["version"]:
+        raise CursorConflict("The dataset has changed since this query ran; run it again.")
+
+    sql = page_sql(cursor["sql"], cursor["mode"], cursor["position"])
+    result = run_blocks([sql], dataset.id, data_version=dataset.data_version)[0]
+    return finish_page(
+        result, cursor["sql"], cursor["mode"], cursor["position"], dataset.id, cursor["version"],
+    )
@@ -0,0 +1,77 @@
+import logging
+
+from django.db import connection, transaction
+
+from .models import Record
+
+logger = logging.getLogger(__name__)
+
+# analytics_record is LIST-partitioned on dataset_id (migration 0010): each
+# dataset's records live in their own table, analytics_record_p<id>, created
+# along with the dataset and dropped with it. Block SQL keeps querying
+# analytics_record; its dataset_id filter prunes the scan to one partition.
+# There is no default partition (migration 0013), since it would rule out
+# detaching partitions concurrently, so records can only be written to a
+# dataset once its partition exists.
+
+RECORD_TABLE = Record._meta.db_table
+
+
+def partition_name(dataset_id):
+    return f"{RECORD_TABLE}_p{int(dataset_id)}"
+
+
+def is_record_table(name):
+    # Whether ``name`` is analytics_record or one of its partitions.
+    return name == RECORD_TABLE or (
+        name.startswith(f"{RECORD_TABLE}_p") and name[len(RECORD_TABLE) + 2:].isdigit()
+    )
+
+
+def create_partition(dataset_id):
+    # The partition is built detached and then attached. Attaching only takes
+    # a SHARE UPDATE EXCLUSIVE lock on analytics_record, so queries on other
+    # datasets keep running.
+    quote = connection.ops.quote_name
+    table = quote(partition_name(dataset_id))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [partition_name(dataset_id)])
+        if cursor.fetchone()[0]:
+            return
+        cursor.execute(f"CREATE TABLE {table} (LIKE {quote(RECORD_TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"ALTER TABLE {quote(RECORD_TABLE)} ATTACH PARTITION {table} FOR VALUES IN ({int(dataset_id)})"
+        )
+
+
+def drop_partition(dataset_id):
+    # Empties the dataset's partition in the deleting transaction (TRUNCATE
+    # locks the partition only, not analytics_record), so the cascade finds
+    # no records left. The partition is detached and dropped once that
+    # commits: DETACH CONCURRENTLY can't run in a transaction, and a plain
+    # DETACH or DROP would hold ACCESS EXCLUSIVE on analytics_record.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [partition_name(dataset_id)])
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(f"TRUNCATE {connection.ops.quote_name(partition_name(dataset_id))}")
+    transaction.on_commit(lambda: detach_partition(dataset_id))
+
+
+def detach_partition(dataset_id):
+    quote = connection.ops.quote_name
+    table = quote(partition_name(dataset_id))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(%s)",
+                [partition_name(dataset_id)],
+            )
+            attached = cursor.fetchone()
+            if attached is not None:
+                # A detach interrupted before it finished is completed instead.
+                mode = "FINALIZE" if attached[0] else "CONCURRENTLY"
+                cursor.execute(f"ALTER TABLE {quote(RECORD_TABLE)} DETACH PARTITION {table} {mode}")
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    except Exception:
+        logger.exception("Failed to detach partition %s", partition_name(dataset_id))
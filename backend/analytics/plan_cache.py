@@ -0,0 +1,288 @@
+import copy
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Subquery
+from django.utils import timezone
+
+from .llm_service import LLM_MODEL
+from .lru import LRUCache
+from .models import RenderPlanCacheEntry
+from .profiling import get_profile
+
+STOPWORDS = frozenset({
+    "a", "an", "the", "of", "for", "in", "on", "to", "me", "show", "give", "get",
+    "display", "what", "whats", "is", "are", "was", "were", "please", "can", "you",
+    "i", "want", "see", "list", "and", "with", "all", "my", "our", "tell", "how",
+})
+
+# Words that flip a filter: "orders that are not laptops" and "orders that
+# are laptops" share every other word.
+NEGATION_WORDS = frozenset({
+    "not", "no", "non", "never", "without", "except", "excluding", "exclude", "besides",
+    "isn", "aren", "don", "doesn", "wasn", "weren",
+})
+
+_singleton = None
+_singleton_lock = threading.Lock()
+
+
+def normalize_prompt(prompt):
+    text = re.sub(r"\s+", " ", prompt.strip().lower())
+    return text.rstrip(" ?.!")
+
+
+def schema_hash(schema):
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def plan_cache_key(normalized_prompt, dataset_id, schema_digest, model):
+    raw = json.dumps([normalized_prompt, dataset_id, schema_digest, model])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def prompt_tokens(normalized_prompt):
+    tokens = set()
+    for word in re.findall(r"[a-z0-9_]+", normalized_prompt):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(word)
+    return frozenset(tokens)
+
+
+def anchor_values(dataset):
+    # Lower-cased values of the dataset's categorical fields (every value its
+    # profile keeps a count for), or None when it has no profile yet.
+    profile = get_profile(dataset)
+    if profile is None:
+        return None
+    values = set()
+    for field_state in (profile.state or {}).get("fields", {}).values():
+        if field_state.get("kind") == "categorical":
+            values.update(str(value).lower() for value in field_state.get("top", {}))
+    return frozenset(values)
+
+
+def prompt_anchors(tokens, schema, values=()):
+    # Field names, filter values, negations and numbers must match exactly
+    # between near-duplicates: "revenue by region" and "revenue by product",
+    # or "orders in the north region" and "orders in the south region", are
+    # never interchangeable.
+    anchors = {t for t in tokens if t.isdigit() or t in NEGATION_WORDS}
+    for field in schema or {}:
+        field_lower = field.lower()
+        parts = [p for p in field_lower.split("_") if p]
+        if field_lower in tokens or (parts and all(prompt_tokens(p) <= tokens for p in parts)):
+            anchors.add(field_lower)
+    for value in values:
+        value_tokens = prompt_tokens(normalize_prompt(value))
+        if value_tokens and value_tokens <= tokens:
+            anchors.add(value)
+    return frozenset(anchors)
+
+
+class PromptSimilarityIndex:
+    # Word-set Jaccard index over recently cached prompts, partitioned by
+    # (dataset, schema hash, model) so near-duplicate lookups stay cheap.
+
+    def __init__(self, threshold, max_entries_per_scope=500):
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    def add(self, scope, key, tokens, anchors):
+        with self._lock:
+            entries = self._scopes.setdefault(scope, OrderedDict())
+            entries[key] = (tokens, anchors)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_scope:
+                entries.popitem(last=False)
+
+    def find(self, scope, tokens, anchors):
+        if not tokens:
+            return None
+        best_key, best_score = None, 0.0
+        with self._lock:
+            for key, (other_tokens, other_anchors) in self._scopes.get(scope, {}).items():
+                if other_anchors != anchors:
+                    continue
+                score = len(tokens & other_tokens) / len(tokens | other_tokens)
+                if score > best_score:
+                    best_key, best_score = key, score
+        return best_key if best_score >= self.threshold else None
+
+    def discard(self, scope, key):
+        with self._lock:
+            self._scopes.get(scope, {}).pop(key, None)
+
+
+class LocMemPlanBackend:
+    def __init__(self, max_entries, ttl):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, key):
+        return copy.deepcopy(self._cache.get(key))
+
+    def set(self, key, render_plan, dataset_id, prompt):
+        self._cache.set(key, copy.deepcopy(render_plan))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class DjangoCachePlanBackend:
+    # Eviction is delegated to the configured Django cache (LocMem culling,
+    # Redis/Memcached LRU, ...).
+
+    def __init__(self, alias, ttl):
+        self._cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self._cache.get(f"render-plan:{key}")
+
+    def set(self, key, render_plan, dataset_id, prompt):
+        self._cache.set(f"render-plan:{key}", render_plan, timeout=self.ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class DatabasePlanBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        now = timezone.now()
+        entry = (
+            RenderPlanCacheEntry.objects
+            .filter(key=key, expires_at__gt=now)
+            .values_list("id", "render_plan")
+            .first()
+        )
+        if entry is None:
+            return None
+        RenderPlanCacheEntry.objects.filter(id=entry[0]).update(last_used_at=now)
+        return entry[1]
+
+    def set(self, key, render_plan, dataset_id, prompt):
+        now = timezone.now()
+        RenderPlanCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={
+                "dataset_id": dataset_id,
+                "prompt": prompt,
+                "render_plan": render_plan,
+                "last_used_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl),
+            },
+        )
+        RenderPlanCacheEntry.objects.filter(expires_at__lte=now).delete()
+        overflow = RenderPlanCacheEntry.objects.order_by("-last_used_at").values("id")[self.max_entries:]
+        RenderPlanCacheEntry.objects.filter(id__in=Subquery(overflow)).delete()
+
+    def clear(self):
+        RenderPlanCacheEntry.objects.all().delete()
+
+
+class RenderPlanCache:
+    def __init__(self, backend, similarity_threshold=None):
+        self.backend = backend
+        self.similarity = PromptSimilarityIndex(similarity_threshold) if similarity_threshold else None
+        self._counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0}
+        self._lock = threading.Lock()
+
+    def _incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _scope(self, dataset, model):
+        return (dataset.id, schema_hash(dataset.metadata), model)
+
+    def lookup(self, prompt, dataset, model=LLM_MODEL):
+        # Returns (render_plan, status) where status is "hit", "semantic_hit" or "miss".
+        if self.backend is None:
+            self._incr("misses")
+            return None, "miss"
+
+        normalized = normalize_prompt(prompt)
+        scope = self._scope(dataset, model)
+        plan = self.backend.get(plan_cache_key(normalized, *scope))
+        if plan is not None:
+            self._incr("hits")
+            return plan, "hit"
+
+        # Near-duplicates are only matched once the dataset's profile can tell
+        # filter values apart from other words.
+        values = anchor_values(dataset) if self.similarity is not None else None
+        if values is not None:
+            tokens = prompt_tokens(normalized)
+            similar_key = self.similarity.find(scope, tokens, prompt_anchors(tokens, dataset.metadata, values))
+            if similar_key is not None:
+                plan = self.backend.get(similar_key)
+                if plan is not None:
+                    self._incr("semantic_hits")
+                    return plan, "semantic_hit"
+                self.similarity.discard(scope, similar_key)
+
+        self._incr("misses")
+        return None, "miss"
+
+    def store(self, prompt, dataset, render_plan, model=LLM_MODEL):
+        if self.backend is None:
+            return
+        normalized = normalize_prompt(prompt)
+        scope = self._scope(dataset, model)
+        key = plan_cache_key(normalized, *scope)
+        self.backend.set(key, render_plan, dataset.id, prompt)
+        values = anchor_values(dataset) if self.similarity is not None else None
+        if values is not None:
+            tokens = prompt_tokens(normalized)
+            self.similarity.add(scope, key, tokens, prompt_anchors(tokens, dataset.metadata, values))
+        self._incr("stores")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["semantic_hits"] + counters["misses"]
+        counters["lookups"] = lookups
+        counters["hit_rate"] = (
+            (counters["hits"] + counters["semantic_hits"]) / lookups if lookups else 0.0
+        )
+        counters["backend"] = settings.PLAN_CACHE_BACKEND
+        return counters
+
+
+def build_plan_backend(name):
+    ttl = settings.PLAN_CACHE_TTL_SECONDS
+    max_entries = settings.PLAN_CACHE_MAX_ENTRIES
+    if name == "locmem":
+        return LocMemPlanBackend(max_entries, ttl)
+    if name == "django":
+        return DjangoCachePlanBackend(settings.PLAN_CACHE_DJANGO_ALIAS, ttl)
+    if name == "database":
+        return DatabasePlanBackend(max_entries, ttl)
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown PLAN_CACHE_BACKEND '{name}'.")
+
+
+def get_plan_cache():
+    global _singleton
+    with _singleton_lock:
+        if _singleton is None:
+            _singleton = RenderPlanCache(
+                build_plan_backend(settings.PLAN_CACHE_BACKEND),
+                similarity_threshold=settings.PLAN_CACHE_SIMILARITY_THRESHOLD,
+            )
+    return _singleton
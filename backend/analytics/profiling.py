@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import math
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Dataset, DatasetProfile, Record
+from .signals import settled_records
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_TYPES = {"integer", "int", "float", "number", "numeric", "decimal"}
+TEMPORAL_TYPES = {"date", "datetime", "timestamp"}
+HLL_PRECISION = 12
+
+
+class HyperLogLog:
+    # Distinct-count sketch: 2**precision one-byte registers (4 KB at the
+    # default precision, ~1.6% standard error), mergeable by register max.
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+
+    @classmethod
+    def loads(cls, data):
+        return cls(base64.b64decode(data))
+
+    def dumps(self):
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+def merge_top_k(counters, batch_counts, capacity):
+    # Misra-Gries summary: keeps at most ``capacity`` candidates and
+    # undercounts each by at most the returned cutoff.
+    for value, count in batch_counts.items():
+        counters[value] = counters.get(value, 0) + count
+    if len(counters) <= capacity:
+        return counters, 0
+    cutoff = sorted(counters.values(), reverse=True)[capacity]
+    return {value: count - cutoff for value, count in counters.items() if count > cutoff}, cutoff
+
+
+def _field_kind(field_type):
+    field_type = str(field_type).lower()
+    if field_type in NUMERIC_TYPES:
+        return "numeric"
+    if field_type in TEMPORAL_TYPES:
+        return "temporal"
+    return "categorical"
+
+
+def _text(value):
+    # Matches what row_data->>'field' returns for the value.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        raise ValueError("boolean is not a number")
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        number = float(text)
+    if not math.isfinite(number):
+        raise ValueError("not a finite number")
+    return number
+
+
+def _new_field_state(kind):
+    state = {"kind": kind, "count": 0, "hll": None, "top": {}, "top_error": 0, "min": None, "max": None}
+    if kind == "numeric":
+        state.update({"sum": 0, "invalid": 0, "seen": 0, "reservoir": []})
+    return state
+
+
+def _scan_batch(state, metadata, rows, rng):
+    fields = state["fields"]
+    capacity = settings.PROFILE_TOP_K_CAPACITY
+    reservoir_size = settings.PROFILE_RESERVOIR_SIZE
+    batch_values = {}
+
+    for row in rows:
+        for field, value in row.items():
+            if value is None or value == "":
+                continue
+            batch_values.setdefault(field, []).append(value)
+
+    for field, values in batch_values.items():
+        field_state = fields.get(field)
+        if field_state is None:
+            field_state = fields[field] = _new_field_state(_field_kind(metadata.get(field, "string")))
+        field_state["count"] += len(values)
+
+        texts = [_text(value) for value in values]
+        hll = HyperLogLog.loads(field_state["hll"]) if field_state["hll"] else HyperLogLog()
+        for text in set(texts):
+            hll.add(text)
+        field_state["hll"] = hll.dumps()
+        field_state["top"], cutoff = merge_top_k(field_state["top"], Counter(texts), capacity)
+        field_state["top_error"] += cutoff
+
+        if field_state["kind"] == "numeric":
+            numbers = []
+            for value in values:
+                try:
+                    numbers.append(_to_number(value))
+                except (TypeError, ValueError):
+                    field_state["invalid"] += 1
+            if not numbers:
+                continue
+            field_state["sum"] += sum(numbers)
+            low, high = min(numbers), max(numbers)
+            reservoir = field_state["reservoir"]
+            for number in numbers:
+                field_state["seen"] += 1
+                if len(reservoir) < reservoir_size:
+                    reservoir.append(number)
+                else:
+                    slot = rng.randrange(field_state["seen"])
+                    if slot < reservoir_size:
+                        reservoir[slot] = number
+        elif field_state["kind"] == "temporal":
+            low, high = min(texts), max(texts)
+        else:
+            continue
+        field_state["min"] = low if field_state["min"] is None else min(field_state["min"], low)
+        field_state["max"] = high if field_state["max"] is None else max(field_state["max"], high)
+
+
+def histogram(values, low, high, total, bins):
+    # Equal-width histogram of the reservoir, scaled to the full value count.
+    if not values or low is None or low == high:
+        return None
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    scale = total / len(values)
+    return {
+        "edges": [low + width * i for i in range(bins + 1)],
+        "counts": [round(count * scale) for count in counts],
+    }
+
+
+def summarize(state, row_count):
+    summary = {}
+    for field, field_state in state.get("fields", {}).items():
+        count = field_state["count"]
+        # The top-k summary holds every value until it first overflows, so the
+        # distinct count is exact until then and a HyperLogLog estimate after.
+        exact = field_state["top_error"] == 0
+        if exact:
+            distinct = len(field_state["top"])
+        else:
+            distinct = min(HyperLogLog.loads(field_state["hll"]).estimate(), count)
+        top = sorted(field_state["top"].items(), key=lambda item: (-item[1], item[0]))
+        entry = {
+            "type": field_state["kind"],
+            "count": count,
+            "nulls": row_count - count,
+            "null_rate": (row_count - count) / row_count if row_count else 0.0,
+            "distinct": distinct,
+            "distinct_exact": exact,
+            "top": [
+                {"value": value, "count": value_count}
+                for value, value_count in top[:settings.PROFILE_TOP_K]
+            ],
+            "top_error": field_state["top_error"],
+            "min": field_state["min"],
+            "max": field_state["max"],
+        }
+        if field_state["kind"] == "numeric":
+            valid = field_state["seen"]
+            entry["invalid"] = field_state["invalid"]
+            entry["mean"] = field_state["sum"] / valid if valid else None
+            entry["histogram"] = histogram(
+                field_state["reservoir"], field_state["min"], field_state["max"],
+                valid, settings.PROFILE_HISTOGRAM_BINS,
+            )
+        summary[field] = entry
+    return summary
+
+
+def refresh_profile(dataset, full=False):
+    # Scans records appended since the last refresh (all records when
+    # ``full``) and merges them into the stored sketches.
+    with transaction.atomic():
+        profile, _ = DatasetProfile.objects.select_for_update().get_or_create(dataset=dataset)
+        settled = settled_records(dataset.pk)
+        if settled is None:
+            return profile
+        upper_id, data_version = settled
+        if full:
+            profile.row_count = 0
+            profile.state = {}
+            profile.sample_rows = []
+            profile.last_record_id = 0
+            profile.needs_rescan = False
+
+        state = profile.state or {}
+        state.setdefault("fields", {})
+        rng = random.Random()
+        records = (
+            Record.objects
+            .filter(dataset_id=dataset.pk, id__gt=profile.last_record_id, id__lte=upper_id)
+            .order_by("id")
+            .values_list("id", "row_data")
+            .iterator(chunk_size=settings.PROFILE_CHUNK_SIZE)
+        )
+        for batch in itertools.batched(records, settings.PROFILE_CHUNK_SIZE):
+            rows = [row_data for _, row_data in batch if isinstance(row_data, dict)]
+            _scan_batch(state, dataset.metadata or {}, rows, rng)
+            missing = settings.PROFILE_SAMPLE_ROWS - len(profile.sample_rows)
+            if missing > 0:
+                profile.sample_rows.extend(rows[:missing])
+            profile.row_count += len(batch)
+            profile.last_record_id = batch[-1][0]
+
+        profile.state = state
+        profile.fields = summarize(state, profile.row_count)
+        profile.data_version = data_version
+        profile.computed_at = timezone.now()
+        profile.save()
+    return profile
+
+
+def refresh_profile_for_dataset(dataset_id, action):
+    # Runs in the writer's on_commit, so it only does work in proportion to
+    # the write: appends of up to PROFILE_INLINE_MAX_ROWS records are merged
+    # in (profiling a new, small dataset from scratch). Updates and deletes
+    # need a full rescan, and bigger loads a long one; both are left to
+    # `profile_dataset --stale`, with the stored profile served meanwhile.
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if dataset is None:
+        return
+    try:
+        profile = DatasetProfile.objects.filter(dataset=dataset).first()
+        if action != "insert":
+            if profile is not None:
+                DatasetProfile.objects.filter(pk=profile.pk).update(needs_rescan=True)
+            return
+        last_record_id = profile.last_record_id if profile is not None else 0
+        appended = Record.objects.filter(dataset_id=dataset_id, id__gt=last_record_id).order_by("id")
+        if appended[settings.PROFILE_INLINE_MAX_ROWS:settings.PROFILE_INLINE_MAX_ROWS + 1].exists():
+            return
+        refresh_profile(dataset)
+    except Exception:
+        logger.exception("Failed to refresh profile of dataset %s", dataset_id)
+
+
+def get_profile(dataset):
+    # The dataset's stored profile, or None when it has never been profiled.
+    # Never scans: a profile behind the dataset is served as is (see
+    # profile_is_stale) until `profile_dataset --stale` catches it up.
+    return DatasetProfile.objects.filter(dataset=dataset).first()
+
+
+def profile_is_stale(profile, dataset):
+    return profile.needs_rescan or profile.data_version != dataset.data_version
+
+
+def stale_profiles():
+    # (dataset, profile or None) for every dataset whose profile is missing
+    # or behind, for `profile_dataset --stale`.
+    profiles = {profile.dataset_id: profile for profile in DatasetProfile.objects.all()}
+    for dataset in Dataset.objects.order_by("id"):
+        profile = profiles.get(dataset.id)
+        if profile is None or profile_is_stale(profile, dataset):
+            yield dataset, profile
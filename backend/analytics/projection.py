@@ -0,0 +1,283 @@
+import logging
+import re
+
+from django.db import DataError, connection, transaction
+from django.utils import timezone
+
+from .models import Dataset, DatasetProjection
+from .signals import settled_records
+from .sql_fields import CAST_FIELD, TEXT_FIELD, canonical_cast
+
+logger = logging.getLogger(__name__)
+
+# Dataset.metadata type -> PostgreSQL column type.
+COLUMN_TYPES = {
+    "integer": "bigint",
+    "int": "bigint",
+    "float": "double precision",
+    "number": "numeric",
+    "numeric": "numeric",
+    "decimal": "numeric",
+    "date": "date",
+    "datetime": "timestamptz",
+    "timestamp": "timestamptz",
+    "boolean": "boolean",
+    "bool": "boolean",
+    "string": "text",
+    "text": "text",
+}
+
+# Values the rollup cube can read as each type; ones that don't match are
+# left out of its aggregates.
+VALUE_PATTERNS = {
+    "bigint": r"^\s*-?\d{1,18}\s*$",
+    "double precision": r"^\s*-?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$",
+    "numeric": r"^\s*-?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$",
+    "date": r"^\d{4}-\d{2}-\d{2}$",
+    "timestamptz": r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?([+-]\d{2}(:?\d{2})?|Z)?$",
+    "boolean": r"^(true|false)$",
+}
+
+# Columns analytics_record exposes that the projection mirrors as-is.
+SYSTEM_COLUMNS = ("id", "dataset_id", "created_at")
+RESERVED_FIELDS = set(SYSTEM_COLUMNS) | {"row_data"}
+FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,62}$")
+
+SQL_KEYWORDS = {
+    "WHERE", "GROUP", "ORDER", "LIMIT", "OFFSET", "HAVING", "WINDOW", "UNION", "INTERSECT",
+    "EXCEPT", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "ON", "USING",
+    "FETCH", "FOR", "TABLESAMPLE",
+}
+
+# Types the projection stores instead, so the column keeps everything queries
+# read from the record's text. As timestamptz, timestamps would read back in
+# another format and fall on the session time zone's day when cast to date; as
+# double precision, floats would lose digits when cast to numeric.
+STORED_TYPES = {"timestamptz": "text", "double precision": "numeric"}
+
+# Casts of a typed column that give what the same cast of the record's text
+# gives, for every value the column can hold (a value is stored as its text
+# cast to the column type). Other casts, and plain text access, aren't
+# rewritten: a bigint column doesn't remember "007", and a numeric one rounds
+# where the text wouldn't cast to integer at all.
+EXACT_CASTS = {
+    "bigint": {"integer", "smallint", "numeric", "double precision", "real"},
+    "numeric": {"double precision", "real"},
+}
+
+_FROM_RECORD = re.compile(r"\b(FROM|JOIN)(\s+)analytics_record\b(\s+(?:AS\s+)?(\w+))?", re.I)
+_RECORD_TABLE = re.compile(r"\banalytics_record\b(?!\s*\.)", re.I)
+_STAR_SELECT = re.compile(r"(?:\bSELECT|,)\s*(?:\w+\.)?\*", re.I)
+
+
+def projection_table_name(dataset_id):
+    return f"analytics_projection_{int(dataset_id)}"
+
+
+def projection_columns(metadata):
+    columns = {}
+    for field, field_type in (metadata or {}).items():
+        if not FIELD_NAME.match(field) or field.lower() in RESERVED_FIELDS:
+            continue
+        column_type = COLUMN_TYPES.get(str(field_type).lower(), "text")
+        columns[field] = STORED_TYPES.get(column_type, column_type)
+    return columns
+
+
+def _column_expression(field, column_type):
+    # A value that doesn't cast fails the refresh, which then marks the
+    # projection unusable: queries casting it would have failed too.
+    source = f"r.row_data->>{_literal(field)}"
+    if column_type == "text":
+        return source
+    return f"({source})::{column_type}"
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def build_projection(dataset):
+    columns = projection_columns(dataset.metadata)
+    table = projection_table_name(dataset.id)
+    quote = connection.ops.quote_name
+    column_defs = ", ".join(f"{quote(field)} {column_type}" for field, column_type in columns.items())
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            cursor.execute(
+                f"CREATE TABLE {quote(table)} ("
+                f"id bigint PRIMARY KEY, dataset_id bigint NOT NULL, created_at timestamptz NOT NULL"
+                f"{', ' + column_defs if column_defs else ''})"
+            )
+        projection, _ = DatasetProjection.objects.update_or_create(
+            dataset=dataset,
+            defaults={
+                "table_name": table,
+                "columns": columns,
+                "last_record_id": 0,
+                "data_version": 0,
+                "refreshed_at": None,
+                "error": "",
+                "needs_rebuild": False,
+            },
+        )
+    projection = refresh_projection(projection, full=True)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {quote(table)}")
+    return projection
+
+
+def refresh_projection(projection, full=False):
+    # Appends records added since the last refresh, or copies them all anew
+    # when ``full``. A projection flagged for a rebuild is left alone unless
+    # ``full``.
+    quote = connection.ops.quote_name
+    table = quote(projection.table_name)
+    fields = list(projection.columns.items())
+    target_columns = ", ".join([*SYSTEM_COLUMNS, *(quote(field) for field, _ in fields)])
+    select_columns = ", ".join(
+        [*(f"r.{column}" for column in SYSTEM_COLUMNS), *(_column_expression(f, t) for f, t in fields)]
+    )
+
+    with transaction.atomic():
+        # Row lock serializes concurrent refreshes of the same projection.
+        projection = DatasetProjection.objects.select_for_update().get(pk=projection.pk)
+        settled = settled_records(projection.dataset_id)
+        if settled is None:
+            return projection
+        upper_id, data_version = settled
+        if (projection.error or projection.needs_rebuild) and not full:
+            return projection
+        last_record_id = 0 if full else projection.last_record_id
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if full:
+                    cursor.execute(f"TRUNCATE {table}")
+                cursor.execute(
+                    f"INSERT INTO {table} ({target_columns}) "
+                    f"SELECT {select_columns} FROM analytics_record r "
+                    f"WHERE r.dataset_id = %s AND r.id > %s AND r.id <= %s",
+                    [projection.dataset_id, last_record_id, upper_id],
+                )
+        except DataError as e:
+            # Stays unusable until a rebuild after the data changes succeeds.
+            projection.error = str(e).strip().splitlines()[0]
+            logger.warning("Projection %s is unusable: %s", projection.table_name, projection.error)
+        else:
+            projection.last_record_id = max(upper_id, last_record_id)
+            projection.error = ""
+        if full:
+            projection.needs_rebuild = False
+        projection.data_version = data_version
+        projection.refreshed_at = timezone.now()
+        projection.save(update_fields=["last_record_id", "data_version", "refreshed_at", "error", "needs_rebuild"])
+    return projection
+
+
+def refresh_projection_for_dataset(dataset_id, action):
+    # Runs in the writer's on_commit, so it only does work in proportion to
+    # the write: inserts are appended. Updates and deletes can touch any row,
+    # so they flag the projection for `build_projection --stale` instead, and
+    # queries read analytics_record until it is rebuilt.
+    projection = DatasetProjection.objects.filter(dataset_id=dataset_id).first()
+    if projection is None:
+        return
+    try:
+        if action != "insert":
+            DatasetProjection.objects.filter(pk=projection.pk).update(needs_rebuild=True)
+            return
+        refresh_projection(projection)
+    except Exception:
+        logger.exception("Failed to refresh projection %s", projection.table_name)
+
+
+def stale_projections():
+    # (projection, full) for every projection behind its dataset, for
+    # `build_projection --stale`: flagged ones (and ones that failed, once
+    # the data has changed) are rebuilt, the rest only catch up on appends.
+    versions = dict(Dataset.objects.values_list("id", "data_version"))
+    for projection in DatasetProjection.objects.select_related("dataset").order_by("dataset_id"):
+        behind = projection.data_version != versions.get(projection.dataset_id)
+        if projection.needs_rebuild or behind:
+            yield projection, projection.needs_rebuild or bool(projection.error)
+
+
+def drop_projection_table(table_name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(table_name)}")
+
+
+def get_active_projection(dataset_id, data_version):
+    # A projection is only used when it has caught up with the dataset's
+    # records, holds every value, and still matches its metadata.
+    projection = (
+        DatasetProjection.objects
+        .filter(dataset_id=dataset_id, data_version=data_version, error="", needs_rebuild=False)
+        .select_related("dataset")
+        .first()
+    )
+    if projection is None or projection.columns != projection_columns(projection.dataset.metadata):
+        return None
+    return projection
+
+
+def projection_expression(field, cast, column_type):
+    # Projection equivalent of (row_data->>'field')::cast, or None when the
+    # typed column can't give the same result. Casts the column already
+    # satisfies are dropped so plain column indexes apply.
+    column = connection.ops.quote_name(field)
+    if cast == column_type:
+        return column
+    if column_type == "text" or cast in EXACT_CASTS.get(column_type, ()):
+        return f"{column}::{cast}"
+    return None
+
+
+def rewrite_for_projection(sql, projection):
+    # Returns the SQL rewritten to read typed projection columns, or None when
+    # the query uses row_data/analytics_record in a way that can't be mapped.
+    columns = projection.columns
+    if _STAR_SELECT.search(sql):
+        return None
+    if any(field not in columns for _, field in TEXT_FIELD.findall(sql)):
+        return None
+
+    quote = connection.ops.quote_name
+
+    def rewrite(prefix, field, cast):
+        # Unmappable references are left as they are, which fails the row_data
+        # check below.
+        expression = projection_expression(field, cast, columns[field])
+        return prefix + expression if expression is not None else None
+
+    def cast_field(match):
+        prefix, field, cast = match.groups()
+        return rewrite(prefix, field, canonical_cast(cast)) or match.group(0)
+
+    def text_field(match):
+        prefix, field = match.groups()
+        return rewrite(prefix, field, "text") or match.group(0)
+
+    rewritten = CAST_FIELD.sub(cast_field, sql)
+    rewritten = TEXT_FIELD.sub(text_field, rewritten)
+    if re.search(r"\brow_data\b", rewritten, re.I):
+        return None
+
+    table_refs = len(_RECORD_TABLE.findall(rewritten))
+    replaced = 0
+
+    def from_table(match):
+        nonlocal replaced
+        keyword, space, alias_clause, alias = match.groups()
+        replaced += 1
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            return f"{keyword}{space}{quote(projection.table_name)}{alias_clause}"
+        return f"{keyword}{space}{quote(projection.table_name)} AS analytics_record{alias_clause or ''}"
+
+    rewritten = _FROM_RECORD.sub(from_table, rewritten)
+    if replaced == 0 or replaced != table_refs:
+        return None
+    return rewritten
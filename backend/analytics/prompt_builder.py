@@ -0,0 +1,135 @@
+import json
+import math
+import re
+import threading
+
+from django.conf import settings
+
+from .profiling import get_profile
+
+# The instruction block is identical for every request, so it is built once
+# and sent as the system message (providers can prefix-cache it); only the
+# dataset context and request vary, in the user message.
+SYSTEM_PROMPT = """You are an expert PostgreSQL data analyst. Turn the user's request into a dashboard: a JSON array of blocks, each a KPI, a chart or a table.
+
+SQL RULES:
+- Data lives in table `analytics_record`. Dataset fields are NOT table columns; they exist ONLY inside the JSONB column `row_data`.
+- Access every field as row_data->>'field' (text) or (row_data->>'field')::numeric / ::float / ::int, in SELECT, WHERE, GROUP BY and ORDER BY alike. Referencing a field directly (e.g. revenue) crashes. Never cast to ::json.
+- Always filter with dataset_id = %s.
+- Use simple aliases (AS total_revenue) with no spaces or special characters.
+
+Example: SELECT row_data->>'region' AS region, SUM((row_data->>'revenue')::numeric) AS total_revenue FROM analytics_record WHERE dataset_id = %s GROUP BY row_data->>'region' ORDER BY total_revenue DESC
+
+BLOCKS:
+{"render": "kpi", "title": "...", "sql": "..."} (SQL returns exactly one row and one column; its alias is the value label)
+{"render": "chart", "title": "...", "chart_type": "bar" | "line" | "pie", "x_axis": "<x alias>", "y_axis": "<y alias>", "sql": "..."}
+{"render": "table", "title": "...", "sql": "..."}
+
+OUTPUT: only the raw JSON array of blocks. No markdown, no backticks, no text before or after; start with [ and end with ]. Return at least one block, and several when the request calls for it."""
+
+PLAIN_VALUE = re.compile(r"^[\w.:/ -]*\w$")
+
+_counters_lock = threading.Lock()
+_counters = {"prompts": 0, "estimated_tokens": 0, "trimmed": 0}
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and SQL.
+    return math.ceil(len(text) / 4)
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def column_stats(dataset):
+    # Per-field summary used in place of raw rows, read from the dataset
+    # profile: min/max for numeric and temporal fields, distinct count (plus
+    # the values when few) otherwise. Returns (stats, sample_rows), or
+    # (None, []) until the dataset has been profiled.
+    profile = get_profile(dataset)
+    if profile is None:
+        return None, []
+    stats = {"rows": profile.row_count, "fields": {}}
+    for field, summary in profile.fields.items():
+        if summary["type"] != "categorical":
+            stats["fields"][field] = {"min": summary["min"], "max": summary["max"]}
+            continue
+        entry = stats["fields"][field] = {"distinct": summary["distinct"]}
+        if summary["distinct_exact"] and 0 < summary["distinct"] <= settings.PROMPT_MAX_CATEGORIES:
+            counters = profile.state["fields"][field]["top"]
+            entry["values"] = sorted(counters, key=lambda value: (-counters[value], value))
+    return stats, profile.sample_rows
+
+
+def _field_line(field, field_type, summary, max_values):
+    line = f"- {field} ({field_type})"
+    if summary is None:
+        return line
+    if "min" in summary:
+        if summary["min"] is None:
+            return line
+        return f"{line}: {_format_value(summary['min'])} .. {_format_value(summary['max'])}"
+    values = summary.get("values")
+    if values and max_values:
+        shown = ", ".join(v if PLAIN_VALUE.match(v) else json.dumps(v) for v in values[:max_values])
+        more = f", +{len(values) - max_values} more" if len(values) > max_values else ""
+        return f"{line}: {summary['distinct']} values: {shown}{more}"
+    return f"{line}: {summary['distinct']} distinct"
+
+
+def render_context(prompt, metadata, stats, sample_rows, max_values):
+    lines = [f"DATASET ({stats['rows']} rows)" if stats else "DATASET", "FIELDS:"]
+    field_stats = stats["fields"] if stats else {}
+    for field, field_type in metadata.items():
+        lines.append(_field_line(field, field_type, field_stats.get(field), max_values))
+    if sample_rows:
+        lines.append("SAMPLE ROWS:")
+        lines.extend(json.dumps(row, separators=(",", ":"), default=str) for row in sample_rows)
+    lines += ["", f"REQUEST: {prompt}", "Return only the JSON array of blocks."]
+    return "\n".join(lines)
+
+
+def build_prompt(prompt, dataset):
+    # Returns (system_message, user_message, info). The dataset context is
+    # degraded step by step (samples, then category values, then stats) until
+    # the estimated total fits PROMPT_TOKEN_BUDGET.
+    metadata = dataset.metadata or {}
+    stats, sample_rows = column_stats(dataset)
+    sample_rows = sample_rows[:settings.PROMPT_SAMPLE_ROWS]
+
+    levels = [
+        (stats, sample_rows, settings.PROMPT_MAX_CATEGORIES),
+        (stats, [], settings.PROMPT_MAX_CATEGORIES),
+        (stats, [], 3),
+        (None, [], 0),
+    ]
+    system_tokens = estimate_tokens(SYSTEM_PROMPT)
+    for level, (level_stats, rows, max_values) in enumerate(levels):
+        user_message = render_context(prompt, metadata, level_stats, rows, max_values)
+        tokens = system_tokens + estimate_tokens(user_message)
+        if tokens <= settings.PROMPT_TOKEN_BUDGET:
+            break
+
+    info = {
+        "estimated_tokens": tokens,
+        "budget": settings.PROMPT_TOKEN_BUDGET,
+        "trim_level": level,
+        "over_budget": tokens > settings.PROMPT_TOKEN_BUDGET,
+    }
+    with _counters_lock:
+        _counters["prompts"] += 1
+        _counters["estimated_tokens"] += tokens
+        _counters["trimmed"] += bool(level)
+    return SYSTEM_PROMPT, user_message, info
+
+
+def prompt_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    counters["avg_estimated_tokens"] = (
+        counters["estimated_tokens"] / counters["prompts"] if counters["prompts"] else 0.0
+    )
+    return counters
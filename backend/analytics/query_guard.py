@@ -0,0 +1,68 @@
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .partitions import is_record_table
+
+# Admission control for block SQL: the plan Postgres would use is checked with
+# EXPLAIN (nothing is executed) before the query runs, so a runaway generated
+# query (a cross join, a sort over every dataset's records) is turned away
+# instead of tying up the shared database.
+
+GUARDED_TABLE = "analytics_record"
+FILTER_KEYS = ("Filter", "Index Cond", "Recheck Cond")
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _nodes(child)
+
+
+def plan_problem(plan):
+    # Why the plan (the "Plan" of EXPLAIN (FORMAT JSON)) is not admitted, or None.
+    cost = plan["Total Cost"]
+    if cost > settings.QUERY_GUARD_MAX_COST:
+        return f"its estimated cost {cost:,.0f} is over the limit of {settings.QUERY_GUARD_MAX_COST:,.0f}"
+
+    nodes = list(_nodes(plan))
+    widest = max(nodes, key=lambda node: node["Plan Rows"])
+    if widest["Plan Rows"] > settings.QUERY_GUARD_MAX_ROWS:
+        return (
+            f"a {widest['Node Type']} step is estimated to produce {widest['Plan Rows']:,} rows, "
+            f"over the limit of {settings.QUERY_GUARD_MAX_ROWS:,}"
+        )
+
+    for node in nodes:
+        # Each partition of analytics_record is scanned as a relation of its own.
+        if is_record_table(node.get("Relation Name", "")) and not any(
+            "dataset_id" in node.get(key, "") for key in FILTER_KEYS
+        ):
+            alias = node.get("Alias", GUARDED_TABLE)
+            # Partitions get aliases like analytics_record_1 in the plan.
+            table = GUARDED_TABLE if alias.startswith(GUARDED_TABLE) else f"{GUARDED_TABLE} (as {alias})"
+            return f"it reads {table} without filtering on dataset_id"
+    return None
+
+
+def check_query(cursor, sql, params):
+    # Raises QueryRejected with the reason when the query's plan is over the
+    # configured limits. Runs inside the block's transaction, so the block's
+    # statement_timeout also bounds planning. SQL that can't even be planned
+    # is let through to fail with its own error.
+    try:
+        with transaction.atomic():
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            explained = cursor.fetchone()[0]
+    except DatabaseError:
+        return
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    problem = plan_problem(explained[0]["Plan"])
+    if problem:
+        raise QueryRejected(problem)
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .index_advisor import drop_advised_index
+from .models import AdvisedIndex, Dataset, DatasetProjection, DatasetRollup, DatasetSample
+from .partitions import create_partition, drop_partition
+from .profiling import refresh_profile_for_dataset
+from .projection import drop_projection_table, refresh_projection_for_dataset
+from .result_cache import get_result_cache
+from .rollup import drop_rollup_table, refresh_rollup_for_dataset
+from .sampling import drop_sample_table, refresh_sample_for_dataset
+from .signals import records_changed
+
+
+@receiver(records_changed)
+def invalidate_result_cache(sender, dataset_id, action, **kwargs):
+    get_result_cache().invalidate_dataset(dataset_id)
+
+
+@receiver(records_changed)
+def refresh_dataset_projection(sender, dataset_id, action, **kwargs):
+    if settings.PROJECTION_AUTO_REFRESH:
+        refresh_projection_for_dataset(dataset_id, action)
+
+
+@receiver(records_changed)
+def refresh_dataset_rollup(sender, dataset_id, action, **kwargs):
+    if settings.ROLLUP_AUTO_REFRESH:
+        refresh_rollup_for_dataset(dataset_id, action)
+
+
+@receiver(records_changed)
+def refresh_dataset_sample(sender, dataset_id, action, **kwargs):
+    if settings.APPROX_AUTO_REFRESH:
+        refresh_sample_for_dataset(dataset_id, action)
+
+
+@receiver(records_changed)
+def refresh_dataset_profile(sender, dataset_id, action, **kwargs):
+    if settings.PROFILE_AUTO_REFRESH:
+        refresh_profile_for_dataset(dataset_id, action)
+
+
+@receiver(post_save, sender=Dataset)
+def create_dataset_partition(sender, instance, created, **kwargs):
+    if created:
+        create_partition(instance.id)
+
+
+@receiver(pre_delete, sender=Dataset)
+def drop_dataset_partition(sender, instance, **kwargs):
+    # Runs before the cascade, which then finds no records left to delete.
+    drop_partition(instance.id)
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def invalidate_catalog(sender, instance, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=DatasetProjection)
+def drop_dataset_projection(sender, instance, **kwargs):
+    drop_projection_table(instance.table_name)
+
+
+@receiver(post_delete, sender=DatasetRollup)
+def drop_dataset_rollup(sender, instance, **kwargs):
+    drop_rollup_table(instance.table_name)
+
+
+@receiver(post_delete, sender=DatasetSample)
+def drop_dataset_sample(sender, instance, **kwargs):
+    drop_sample_table(instance.table_name)
+
+
+@receiver(post_delete, sender=AdvisedIndex)
+def drop_dataset_advised_index(sender, instance, **kwargs):
+    drop_advised_index(instance.name)
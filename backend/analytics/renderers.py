@@ -0,0 +1,101 @@
+import datetime
+import decimal
+import uuid
+
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+
+# Opt-in encodings for block results, picked by DRF content negotiation
+# (Accept header or ?format=). All of them send each block's data
+# column-oriented: "data" is a list of per-column value arrays aligned with
+# "columns", instead of one dict per row repeating every column name.
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def _columnar_block(block):
+    if not isinstance(block, dict) or not isinstance(block.get("data"), list) or "columns" not in block:
+        return block
+    columns = block["columns"] or []
+    rows = block["data"]
+    return {**block, "data": [[row.get(column) for row in rows] for column in columns]}
+
+
+def columnarize(payload):
+    if not isinstance(payload, dict):
+        return payload
+    payload = _columnar_block(payload)
+    if isinstance(payload.get("blocks"), list):
+        payload = {**payload, "blocks": [_columnar_block(block) for block in payload["blocks"]]}
+    return {**payload, "encoding": "columnar"}
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} as MessagePack")
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = "application/vnd.datasage.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnarize(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(columnarize(data), default=_msgpack_default, use_bin_type=True)
+
+
+class ArrowRenderer(BaseRenderer):
+    # Arrow IPC stream for single-result payloads ({"columns", "data", ...});
+    # the remaining top-level keys (e.g. next_cursor) go in schema metadata.
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict) or "columns" not in data:
+            # Errors and other non-tabular payloads.
+            table = pa.table({"error": [str((data or {}).get("error", data))]})
+        else:
+            rows = data["data"]
+            table = pa.table({column: [row.get(column) for row in rows] for column in data["columns"]})
+            metadata = {k: str(v) for k, v in data.items() if k not in ("columns", "data") and v is not None}
+            table = table.replace_schema_metadata(metadata)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def result_renderers(tabular=False):
+    # The renderer classes for a block-result view: plain JSON first (the
+    # default), then whichever optional encodings are installed.
+    renderers = [JSONRenderer, BrowsableAPIRenderer, ColumnarJSONRenderer]
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    if tabular and pa is not None:
+        renderers.append(ArrowRenderer)
+    return renderers
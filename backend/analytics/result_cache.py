@@ -0,0 +1,74 @@
+import re
+import threading
+
+from django.conf import settings
+
+from .lru import LRUCache
+
+_singleton = None
+_singleton_lock = threading.Lock()
+
+_SQL_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql):
+    # Collapse whitespace outside string literals and quoted identifiers so
+    # cosmetic differences in generated SQL share one cache entry.
+    parts = _SQL_LITERAL.split(sql.strip().rstrip(";").strip())
+    return "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part)
+        for i, part in enumerate(parts)
+    )
+
+
+class QueryResultCache:
+    # Entries are keyed on (normalized SQL, dataset id, dataset data_version), so
+    # a version bump makes stale entries unreachable in every process;
+    # invalidate_dataset additionally frees them in this one.
+
+    def __init__(self, max_entries, max_rows, ttl=None):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl, max_cost=max_rows)
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+
+    def _incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, sql, dataset_id, data_version):
+        result = self._cache.get((normalize_sql(sql), dataset_id, data_version))
+        self._incr("hits" if result is not None else "misses")
+        return result
+
+    def set(self, sql, dataset_id, data_version, columns, data):
+        if self._cache.set((normalize_sql(sql), dataset_id, data_version), (columns, data), cost=max(len(data), 1)):
+            self._incr("stores")
+
+    def invalidate_dataset(self, dataset_id):
+        self._cache.delete_where(lambda key: key[1] == dataset_id)
+        self._incr("invalidations")
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["lookups"] = lookups
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        counters["entries"] = len(self._cache)
+        counters["rows"] = self._cache.total_cost
+        return counters
+
+
+def get_result_cache():
+    global _singleton
+    with _singleton_lock:
+        if _singleton is None:
+            _singleton = QueryResultCache(
+                max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+                max_rows=settings.RESULT_CACHE_MAX_ROWS,
+                ttl=settings.RESULT_CACHE_TTL_SECONDS or None,
+            )
+    return _singleton
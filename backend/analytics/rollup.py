@@ -0,0 +1,450 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Dataset, DatasetRollup
+from .profiling import get_profile, profile_is_stale, refresh_profile
+from .projection import COLUMN_TYPES, FIELD_NAME, VALUE_PATTERNS
+from .signals import settled_records
+from .sql_fields import CAST_FIELD, TEXT_FIELD, canonical_cast, closing_paren, mask_literals, split_top_level
+
+logger = logging.getLogger(__name__)
+
+# Per-dataset rollup cube: record count plus count/sum/min/max of every numeric
+# field, grouped by (dimension, value, day) for each low-cardinality
+# categorical field (dimension '' is the whole dataset) and the dataset's date
+# field. Aggregate block SQL over at most one categorical field and the date
+# is rewritten to read the cube, so it costs O(groups) rather than O(rows).
+
+TEMPORAL_TYPES = {"date", "timestamptz"}
+NUMERIC_COLUMN_TYPES = {"bigint", "double precision", "numeric"}
+INTEGER_CASTS = {"integer", "bigint", "smallint"}
+# Result type of SUM/AVG over each cast, so rewritten queries return the
+# same types as the originals.
+SUM_TYPES = {
+    "integer": "bigint", "smallint": "bigint", "bigint": "numeric", "numeric": "numeric",
+    "double precision": "double precision", "real": "real",
+}
+AVG_TYPES = {
+    "integer": "numeric", "smallint": "numeric", "bigint": "numeric", "numeric": "numeric",
+    "double precision": "double precision", "real": "double precision",
+}
+
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX)\s*\(", re.I)
+_STATEMENT = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+analytics_record\b"
+    r"(?P<alias_clause>\s+(?:AS\s+)?(?!WHERE\b)\w+)?\s+WHERE\s+(?P<where>.+?)"
+    r"(?:\s+GROUP\s+BY\s+(?P<group>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?(?:\s+OFFSET\s+(?P<offset>\d+))?\s*;?\s*$",
+    re.I | re.S,
+)
+_UNSUPPORTED = re.compile(
+    r"\b(JOIN|HAVING|OVER|UNION|INTERSECT|EXCEPT|WINDOW|FILTER|FETCH|WITHIN|TABLESAMPLE)\b"
+    r"|\bSELECT\s+DISTINCT\b",
+    re.I,
+)
+_DATASET_FILTER = re.compile(r"^\(?\s*(?:\w+\.)?dataset_id\s*=\s*%s\s*\)?$", re.I)
+_FOREIGN_COLUMN = re.compile(r"\b(row_data|id|created_at)\b", re.I)
+_ALIAS = re.compile(r"\s+AS\s+(\w+|\"[^\"]+\")\s*$", re.I)
+_FUNCTION_CALL = re.compile(r"^\s*(\w+)\s*\(", re.I)
+
+
+class NotRollupable(Exception):
+    pass
+
+
+def rollup_table_name(dataset_id):
+    return f"analytics_rollup_{int(dataset_id)}"
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _field_types(metadata):
+    return {
+        field: COLUMN_TYPES.get(str(field_type).lower(), "text")
+        for field, field_type in (metadata or {}).items()
+        if FIELD_NAME.match(field)
+    }
+
+
+def rollup_measures(metadata):
+    return [field for field, column_type in _field_types(metadata).items() if column_type in NUMERIC_COLUMN_TYPES]
+
+
+def rollup_date_field(metadata):
+    # The first date/datetime field is the cube's time axis.
+    return next(
+        (field for field, column_type in _field_types(metadata).items() if column_type in TEMPORAL_TYPES), "",
+    )
+
+
+def rollup_dimensions(dataset):
+    # Categorical fields with few enough distinct values (per the dataset
+    # profile) to keep the cube small; ids and free text are left out.
+    types = _field_types(dataset.metadata)
+    # Cubes are built off the request path, so a missing or stale profile
+    # is brought up to date first.
+    profile = get_profile(dataset)
+    if profile is None or profile_is_stale(profile, dataset):
+        profile = refresh_profile(dataset, full=profile is None or profile.needs_rescan)
+    dimensions = []
+    for field, column_type in types.items():
+        if column_type not in ("text", "boolean"):
+            continue
+        summary = profile.fields.get(field)
+        if summary is not None and summary["distinct"] <= settings.ROLLUP_MAX_DIMENSION_VALUES:
+            dimensions.append(field)
+    return dimensions
+
+
+def _value_expression(source, column_type):
+    return f"CASE WHEN {source} ~ {_literal(VALUE_PATTERNS[column_type])} THEN ({source})::{column_type} END"
+
+
+def _day_expression(field, column_type):
+    source = f"row_data->>{_literal(field)}"
+    return f"CASE WHEN {source} ~ {_literal(VALUE_PATTERNS[column_type])} THEN ({source})::date END"
+
+
+def _measure_columns(index):
+    return [f"m{index}_sum", f"m{index}_min", f"m{index}_max", f"m{index}_count"]
+
+
+def build_rollup(dataset):
+    quote = connection.ops.quote_name
+    table = rollup_table_name(dataset.id)
+    dimensions = rollup_dimensions(dataset)
+    measures = rollup_measures(dataset.metadata)
+    date_field = rollup_date_field(dataset.metadata)
+    measure_defs = "".join(
+        f", {column} numeric" for i in range(len(measures)) for column in _measure_columns(i)
+    )
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            cursor.execute(
+                f"CREATE TABLE {quote(table)} ("
+                f"dataset_id bigint NOT NULL, _dimension text NOT NULL, _value text, _day date, "
+                f"_rows bigint NOT NULL{measure_defs})"
+            )
+            cursor.execute(f"CREATE INDEX ON {quote(table)} (_dimension, _value, _day)")
+        rollup, _ = DatasetRollup.objects.update_or_create(
+            dataset=dataset,
+            defaults={
+                "table_name": table,
+                "dimensions": dimensions,
+                "measures": measures,
+                "date_field": date_field,
+                "last_record_id": 0,
+                "data_version": 0,
+                "refreshed_at": None,
+                "needs_rebuild": False,
+            },
+        )
+    rollup = refresh_rollup(rollup, full=True)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {quote(table)}")
+    return rollup
+
+
+def _delta_query(rollup):
+    # Aggregates the records in (%s, %s] of the dataset into cube rows.
+    types = _field_types(rollup.dataset.metadata)
+    day = _day_expression(rollup.date_field, types[rollup.date_field]) if rollup.date_field else "NULL::date"
+    measures = "".join(
+        f", {_value_expression(f'row_data->>{_literal(field)}', 'numeric')} AS m{i}"
+        for i, field in enumerate(rollup.measures)
+    )
+    dimensions = ", ".join(
+        ["('', NULL::text)", *(f"({_literal(field)}, r.row_data->>{_literal(field)})" for field in rollup.dimensions)]
+    )
+    aggregates = "".join(
+        f", SUM(m{i}), MIN(m{i}), MAX(m{i}), COUNT(m{i})" for i in range(len(rollup.measures))
+    )
+    return (
+        f"SELECT r.dataset_id, d._dimension, d._value, r._day, COUNT(*){aggregates} "
+        f"FROM (SELECT dataset_id, row_data, {day} AS _day{measures} FROM analytics_record "
+        f"WHERE dataset_id = %s AND id > %s AND id <= %s) r "
+        f"CROSS JOIN LATERAL (VALUES {dimensions}) AS d(_dimension, _value) "
+        f"GROUP BY r.dataset_id, d._dimension, d._value, r._day"
+    )
+
+
+def refresh_rollup(rollup, full=False):
+    # Merges records added since the last refresh into the cube, or rebuilds
+    # it when ``full``. A cube flagged for a rebuild is left alone unless
+    # ``full``.
+    quote = connection.ops.quote_name
+    table = quote(rollup.table_name)
+    columns = ["dataset_id", "_dimension", "_value", "_day", "_rows"]
+    merges = ["_rows = t._rows + d._rows"]
+    for i in range(len(rollup.measures)):
+        total, low, high, count = _measure_columns(i)
+        columns += [total, low, high, count]
+        merges += [
+            f"{total} = COALESCE(t.{total} + d.{total}, t.{total}, d.{total})",
+            f"{low} = LEAST(t.{low}, d.{low})",
+            f"{high} = GREATEST(t.{high}, d.{high})",
+            f"{count} = t.{count} + d.{count}",
+        ]
+    column_list = ", ".join(columns)
+    same_group = (
+        "{a}._dimension = {b}._dimension AND {a}._value IS NOT DISTINCT FROM {b}._value "
+        "AND {a}._day IS NOT DISTINCT FROM {b}._day"
+    )
+
+    with transaction.atomic():
+        # Row lock serializes concurrent refreshes of the same cube.
+        rollup = DatasetRollup.objects.select_for_update().select_related("dataset").get(pk=rollup.pk)
+        settled = settled_records(rollup.dataset_id)
+        if settled is None:
+            return rollup
+        upper_id, data_version = settled
+        if rollup.needs_rebuild and not full:
+            return rollup
+        last_record_id = 0 if full else rollup.last_record_id
+        upper_id = max(upper_id, last_record_id)
+
+        with connection.cursor() as cursor:
+            params = [rollup.dataset_id, last_record_id, upper_id]
+            if full:
+                cursor.execute(f"TRUNCATE {table}")
+                cursor.execute(f"INSERT INTO {table} ({column_list}) {_delta_query(rollup)}", params)
+            elif upper_id > last_record_id:
+                # Appended records merge into existing groups (counts and sums
+                # add, min/max widen) or start new ones.
+                cursor.execute(
+                    f"WITH d ({column_list}) AS ({_delta_query(rollup)}), "
+                    f"merged AS (UPDATE {table} t SET {', '.join(merges)} FROM d "
+                    f"WHERE {same_group.format(a='t', b='d')} RETURNING d._dimension, d._value, d._day) "
+                    f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM d "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM merged m WHERE {same_group.format(a='m', b='d')})",
+                    params,
+                )
+
+        rollup.last_record_id = upper_id
+        rollup.data_version = data_version
+        rollup.needs_rebuild = False
+        rollup.refreshed_at = timezone.now()
+        rollup.save(update_fields=["last_record_id", "data_version", "needs_rebuild", "refreshed_at"])
+    return rollup
+
+
+def refresh_rollup_for_dataset(dataset_id, action):
+    # Runs in the writer's on_commit, so it only does work in proportion to
+    # the write: appends merge in. Updates and deletes can't be subtracted
+    # from min/max, so they flag the cube for `build_rollup --stale`, and
+    # queries skip it until it is rebuilt.
+    rollup = DatasetRollup.objects.filter(dataset_id=dataset_id).first()
+    if rollup is None:
+        return
+    try:
+        if action != "insert":
+            DatasetRollup.objects.filter(pk=rollup.pk).update(needs_rebuild=True)
+            return
+        refresh_rollup(rollup)
+    except Exception:
+        logger.exception("Failed to refresh rollup %s", rollup.table_name)
+
+
+def stale_rollups():
+    # (rollup, full) for every cube behind its dataset, for `build_rollup
+    # --stale`: flagged ones are rebuilt, the rest only merge in appends.
+    versions = dict(Dataset.objects.values_list("id", "data_version"))
+    for rollup in DatasetRollup.objects.select_related("dataset").order_by("dataset_id"):
+        if rollup.needs_rebuild or rollup.data_version != versions.get(rollup.dataset_id):
+            yield rollup, rollup.needs_rebuild
+
+
+def drop_rollup_table(table_name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(table_name)}")
+
+
+def get_active_rollup(dataset_id, data_version):
+    # A cube is only used when it has caught up with the dataset's records and
+    # its measures/date field still match the metadata.
+    rollup = (
+        DatasetRollup.objects
+        .filter(dataset_id=dataset_id, data_version=data_version, needs_rebuild=False)
+        .select_related("dataset")
+        .first()
+    )
+    if rollup is None:
+        return None
+    metadata = rollup.dataset.metadata
+    if rollup.measures != rollup_measures(metadata) or rollup.date_field != rollup_date_field(metadata):
+        return None
+    types = _field_types(metadata)
+    if any(types.get(field) not in ("text", "boolean") for field in rollup.dimensions):
+        return None
+    return rollup
+
+
+def _closing_paren(masked, start):
+    close = closing_paren(masked, start)
+    if close is None:
+        raise NotRollupable("unbalanced parentheses")
+    return close
+
+
+class _Rewriter:
+    # Rewrites expressions over row_data into cube columns; remembers the one
+    # categorical field the query may touch.
+
+    def __init__(self, rollup):
+        self.rollup = rollup
+        self.types = _field_types(rollup.dataset.metadata)
+        self.dimension = None
+
+    def _use_dimension(self, field):
+        if field not in self.rollup.dimensions:
+            raise NotRollupable(f"{field} is not a cube dimension")
+        if self.dimension not in (None, field):
+            raise NotRollupable("more than one dimension")
+        self.dimension = field
+        return "_value"
+
+    def _date(self, field, cast):
+        # The cube holds the date part only, so the field is usable as a date,
+        # or as a timestamp when it has no time part to begin with.
+        if field != self.rollup.date_field:
+            raise NotRollupable(f"{field} is not the cube's date field")
+        if cast == "date":
+            return "_day"
+        if cast in ("timestamp", "timestamptz") and self.types[field] == "date":
+            return f"_day::{cast}"
+        raise NotRollupable(f"{field}::{cast} needs more than the date part")
+
+    def _aggregate(self, function, inner):
+        function = function.upper()
+        inner = inner.strip()
+        # COUNT is 0, not NULL, when no rows match; SUM of the counts is NULL.
+        if function == "COUNT" and inner in ("*", "1"):
+            return "COALESCE(SUM(_rows), 0)::bigint"
+        distinct = re.match(r"^DISTINCT\s+(.+)$", inner, re.I | re.S)
+        if distinct:
+            if function != "COUNT":
+                raise NotRollupable("DISTINCT aggregate")
+            return f"COUNT(DISTINCT {self.expression(distinct.group(1))})"
+
+        cast_match = CAST_FIELD.fullmatch(inner)
+        if cast_match is None:
+            raise NotRollupable(f"unsupported aggregate argument {inner}")
+        _, field, cast = cast_match.groups()
+        cast = canonical_cast(cast)
+        if field == self.rollup.date_field and function in ("MIN", "MAX"):
+            return f"{function}({self._date(field, cast)})"
+        if field not in self.rollup.measures:
+            raise NotRollupable(f"{field} is not a cube measure")
+        if cast in INTEGER_CASTS and self.types[field] != "bigint":
+            raise NotRollupable("integer cast of a non-integer field")
+        if cast not in SUM_TYPES:
+            raise NotRollupable(f"unsupported cast {cast}")
+
+        total, low, high, count = _measure_columns(self.rollup.measures.index(field))
+        if function == "SUM":
+            return f"(SUM({total}))::{SUM_TYPES[cast]}"
+        if function == "AVG":
+            return f"(SUM({total}) / NULLIF(SUM({count}), 0))::{AVG_TYPES[cast]}"
+        if function == "COUNT":
+            return f"COALESCE(SUM({count}), 0)::bigint"
+        column = low if function == "MIN" else high
+        return f"({function}({column}))::{cast}"
+
+    def _fields(self, text):
+        def cast_field(match):
+            _, field, cast = match.groups()
+            if field in self.rollup.dimensions and canonical_cast(cast) == "text":
+                return self._use_dimension(field)
+            return self._date(field, canonical_cast(cast))
+
+        def text_field(match):
+            _, field = match.groups()
+            return self._use_dimension(field)
+
+        return TEXT_FIELD.sub(text_field, CAST_FIELD.sub(cast_field, text))
+
+    def expression(self, text, aggregates=True):
+        masked = mask_literals(text)
+        parts, position = [], 0
+        for match in _AGGREGATE.finditer(masked):
+            if match.start() < position:
+                continue
+            if not aggregates:
+                raise NotRollupable("aggregate outside the select list")
+            close = _closing_paren(masked, match.end() - 1)
+            parts.append(self._fields(text[position:match.start()]))
+            parts.append(self._aggregate(match.group(1), text[match.end():close]))
+            position = close + 1
+        parts.append(self._fields(text[position:]))
+        rewritten = "".join(parts)
+        if _FOREIGN_COLUMN.search(mask_literals(rewritten)):
+            raise NotRollupable("references columns the cube doesn't have")
+        return rewritten
+
+
+def _select_item(rewriter, item):
+    # Keeps the output column name the original query would have had.
+    alias = _ALIAS.search(mask_literals(item))
+    if alias:
+        expression, name = item[:alias.start()], item[alias.start():]
+    else:
+        function = _FUNCTION_CALL.match(item)
+        if function is None or _closing_paren(mask_literals(item), function.end() - 1) != len(item.rstrip()) - 1:
+            raise NotRollupable("select item without an alias")
+        expression, name = item, f' AS "{function.group(1).lower()}"'
+    rewritten = rewriter.expression(expression)
+    return rewritten + name, bool(_AGGREGATE.search(mask_literals(expression)))
+
+
+def rewrite_for_rollup(sql, rollup):
+    # Returns the SQL rewritten to aggregate the dataset's cube, or None when
+    # the query isn't an aggregate the cube can answer.
+    sql = sql.strip().rstrip(";").strip()
+    masked = mask_literals(sql)
+    if len(re.findall(r"\bSELECT\b", masked, re.I)) != 1 or _UNSUPPORTED.search(masked):
+        return None
+    statement = _STATEMENT.match(masked)
+    if statement is None:
+        return None
+
+    def part(name):
+        return sql[statement.start(name):statement.end(name)] if statement.group(name) is not None else None
+
+    rewriter = _Rewriter(rollup)
+    try:
+        if not any(_DATASET_FILTER.match(conjunct) for conjunct in split_top_level(part("where"), r"\bAND\b")):
+            raise NotRollupable("no top-level dataset filter")
+        select = [_select_item(rewriter, item) for item in split_top_level(part("select"), ",")]
+        where = rewriter.expression(part("where"), aggregates=False)
+        group = part("group")
+        if group is not None:
+            group = rewriter.expression(group, aggregates=False)
+        elif not all(is_aggregate for _, is_aggregate in select):
+            # A plain row listing; the cube only has groups.
+            raise NotRollupable("not an aggregate query")
+        order = rewriter.expression(part("order")) if part("order") is not None else None
+    except NotRollupable:
+        return None
+
+    rewritten = (
+        f"SELECT {', '.join(item for item, _ in select)} "
+        f"FROM {connection.ops.quote_name(rollup.table_name)}{part('alias_clause') or ' AS analytics_record'} "
+        f"WHERE _dimension = {_literal(rewriter.dimension or '')} AND ({where})"
+    )
+    if group is not None:
+        rewritten += f" GROUP BY {group}"
+    if order is not None:
+        rewritten += f" ORDER BY {order}"
+    if part("limit") is not None:
+        rewritten += f" LIMIT {int(part('limit'))}"
+    if part("offset") is not None:
+        rewritten += f" OFFSET {int(part('offset'))}"
+    return rewritten
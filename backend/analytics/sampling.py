@@ -0,0 +1,329 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Dataset, DatasetSample
+from .partitions import partition_name
+from .projection import SQL_KEYWORDS
+from .signals import settled_records
+from .sql_fields import closing_paren, mask_literals, split_top_level
+
+logger = logging.getLogger(__name__)
+
+# Approximate mode: KPI and chart SQL runs against a per-dataset uniform
+# sample of analytics_record (same columns, ~APPROX_SAMPLE_ROWS rows) instead
+# of the full dataset. COUNT and SUM are scaled up by population/sample, and
+# 95% margins of error are computed alongside single COUNT/SUM/AVG columns.
+# Until a dataset's sample has been built (and caught up, or redrawn after
+# updates and deletes), queries read a BERNOULLI TABLESAMPLE of its partition at the same target size instead.
+
+Z_95 = 1.96
+
+_SCALED_AGGREGATE = re.compile(r"\b(COUNT|SUM)\s*\(", re.I)
+_MARGIN_AGGREGATE = re.compile(r"^(COUNT|SUM|AVG)\s*\(", re.I)
+_UNSUPPORTED = re.compile(
+    r"\b(JOIN|UNION|INTERSECT|EXCEPT|OVER|WINDOW|TABLESAMPLE)\b|\bSELECT\s+DISTINCT\b", re.I,
+)
+_HAS_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX)\s*\(", re.I)
+_SELECT_LIST = re.compile(r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+analytics_record\b", re.I | re.S)
+_FROM_RECORD = re.compile(r"\bFROM(\s+)analytics_record\b(\s+(?:AS\s+)?(\w+))?", re.I)
+_RECORD_TABLE = re.compile(r"\banalytics_record\b", re.I)
+_ALIAS = re.compile(r"\s+AS\s+(\w+|\"[^\"]+\")\s*$", re.I)
+_ROUND = re.compile(r"^ROUND\s*\(", re.I)
+_TRAILING_CAST = re.compile(r"::\s*(double\s+precision|\w+)\s*$", re.I)
+
+
+def sample_table_name(dataset_id):
+    return f"analytics_sample_{int(dataset_id)}"
+
+
+def build_sample(dataset):
+    quote = connection.ops.quote_name
+    table = sample_table_name(dataset.id)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            cursor.execute(
+                f"CREATE TABLE {quote(table)} ("
+                f"id bigint PRIMARY KEY, dataset_id bigint NOT NULL, row_data jsonb NOT NULL, "
+                f"created_at timestamptz NOT NULL)"
+            )
+        sample, _ = DatasetSample.objects.update_or_create(
+            dataset=dataset,
+            defaults={
+                "table_name": table,
+                "rate": 1.0,
+                "population_rows": 0,
+                "sample_rows": 0,
+                "last_record_id": 0,
+                "data_version": 0,
+                "needs_rebuild": False,
+                "refreshed_at": None,
+            },
+        )
+    sample = refresh_sample(sample, full=True)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {quote(table)}")
+    return sample
+
+
+def refresh_sample(sample, full=False):
+    # Appended records are sampled at the current rate, which keeps the sample
+    # uniform; once it has grown to twice the target size (or on ``full``) it
+    # is redrawn at a new rate. A sample flagged for a redraw is left alone
+    # unless ``full``.
+    table = connection.ops.quote_name(sample.table_name)
+    with transaction.atomic():
+        # Row lock serializes concurrent refreshes of the same sample.
+        sample = DatasetSample.objects.select_for_update().get(pk=sample.pk)
+        settled = settled_records(sample.dataset_id)
+        if settled is None:
+            return sample
+        upper_id, data_version = settled
+        if sample.needs_rebuild and not full:
+            return sample
+        full = full or sample.sample_rows > 2 * settings.APPROX_SAMPLE_ROWS
+
+        with connection.cursor() as cursor:
+            if full:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM analytics_record WHERE dataset_id = %s AND id <= %s",
+                    [sample.dataset_id, upper_id],
+                )
+                population, last_record_id = cursor.fetchone()[0], upper_id
+                sample.rate = min(1.0, settings.APPROX_SAMPLE_ROWS / population) if population else 1.0
+                cursor.execute(f"TRUNCATE {table}")
+                lower_id = 0
+            else:
+                last_record_id = max(upper_id, sample.last_record_id)
+                cursor.execute(
+                    "SELECT COUNT(*) FROM analytics_record WHERE dataset_id = %s AND id > %s AND id <= %s",
+                    [sample.dataset_id, sample.last_record_id, last_record_id],
+                )
+                added = cursor.fetchone()[0]
+                population = sample.population_rows + added
+                lower_id = sample.last_record_id
+            cursor.execute(
+                f"INSERT INTO {table} (id, dataset_id, row_data, created_at) "
+                f"SELECT id, dataset_id, row_data, created_at FROM analytics_record "
+                f"WHERE dataset_id = %s AND id > %s AND id <= %s AND random() < %s",
+                [sample.dataset_id, lower_id, last_record_id, sample.rate],
+            )
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            sample.sample_rows = cursor.fetchone()[0]
+
+        sample.population_rows = population
+        sample.last_record_id = last_record_id
+        sample.data_version = data_version
+        sample.needs_rebuild = False
+        sample.refreshed_at = timezone.now()
+        sample.save()
+    return sample
+
+
+def refresh_sample_for_dataset(dataset_id, action):
+    # Runs in the writer's on_commit, so appends are sampled in place.
+    # Updates and deletes can touch sampled rows, so they flag the sample for
+    # `build_sample --stale` to redraw, and queries use a TABLESAMPLE until then.
+    sample = DatasetSample.objects.filter(dataset_id=dataset_id).first()
+    if sample is None:
+        return
+    try:
+        if action != "insert":
+            DatasetSample.objects.filter(pk=sample.pk).update(needs_rebuild=True)
+            return
+        refresh_sample(sample)
+    except Exception:
+        logger.exception("Failed to refresh sample %s", sample.table_name)
+
+
+def stale_samples():
+    # (sample, full) for every sample behind its dataset, for `build_sample
+    # --stale`: flagged ones are redrawn, the rest only sample in appends.
+    versions = dict(Dataset.objects.values_list("id", "data_version"))
+    for sample in DatasetSample.objects.select_related("dataset").order_by("dataset_id"):
+        if sample.needs_rebuild or sample.data_version != versions.get(sample.dataset_id):
+            yield sample, sample.needs_rebuild
+
+
+def drop_sample_table(table_name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(table_name)}")
+
+
+class TableSample:
+    # Stands in for a DatasetSample that hasn't been built: rows are drawn at
+    # ``rate`` by TABLESAMPLE BERNOULLI as the query runs, and the population
+    # is the planner's estimate of the partition's row count.
+    def __init__(self, population_rows, rate):
+        self.population_rows = population_rows
+        self.rate = rate
+        self.sample_rows = round(population_rows * rate)
+
+
+def _table_sample(dataset_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [partition_name(dataset_id)])
+        row = cursor.fetchone()
+    # reltuples is -1 until the partition has been analyzed.
+    population = int(row[0]) if row is not None and row[0] > 0 else 0
+    if population < settings.APPROX_MIN_ROWS:
+        return None
+    return TableSample(population, min(1.0, settings.APPROX_SAMPLE_ROWS / population))
+
+
+def get_active_sample(dataset_id, data_version):
+    # Only a sample that has caught up with the dataset, of a dataset large
+    # enough that sampling pays off, is used; failing that, a TABLESAMPLE.
+    sample = DatasetSample.objects.filter(
+        dataset_id=dataset_id, data_version=data_version, needs_rebuild=False,
+    ).first()
+    if sample is not None and sample.sample_rows and sample.population_rows >= settings.APPROX_MIN_ROWS:
+        return sample
+    if settings.APPROX_TABLESAMPLE_FALLBACK:
+        return _table_sample(dataset_id)
+    return None
+
+
+def _fraction(sample):
+    if isinstance(sample, TableSample):
+        return sample.rate
+    return sample.sample_rows / sample.population_rows
+
+
+def sample_info(sample):
+    return {
+        "sample_rows": sample.sample_rows,
+        "population_rows": sample.population_rows,
+        "sample_fraction": _fraction(sample),
+        "confidence": 0.95,
+    }
+
+
+def _number(value):
+    return f"{value:.12f}".rstrip("0").rstrip(".") or "0"
+
+
+def _scale_aggregates(text, factor):
+    # COUNT(...) and SUM(...) estimate population totals once multiplied by
+    # population/sample; COUNT(DISTINCT ...) doesn't scale and is left alone.
+    masked = mask_literals(text)
+    parts, position = [], 0
+    for match in _SCALED_AGGREGATE.finditer(masked):
+        if match.start() < position:
+            continue
+        close = closing_paren(masked, match.end() - 1)
+        if close is None:
+            return None
+        call = text[match.start():close + 1]
+        inner = text[match.end():close].strip()
+        parts.append(text[position:match.start()])
+        if re.match(r"^DISTINCT\b", inner, re.I):
+            parts.append(call)
+        elif match.group(1).upper() == "COUNT":
+            parts.append(f"ROUND({call} * {factor})::bigint")
+        else:
+            parts.append(f"({call} * {factor})")
+        position = close + 1
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _single_aggregate(expression):
+    # (function, argument) when the expression is one COUNT/SUM/AVG call,
+    # possibly rounded or cast; else None.
+    expression = expression.strip()
+    while True:
+        masked = mask_literals(expression)
+        cast = _TRAILING_CAST.search(masked)
+        if _ROUND.match(masked) and closing_paren(masked, masked.index("(")) == len(masked) - 1:
+            expression = split_top_level(expression[masked.index("(") + 1:-1], ",")[0]
+        elif cast:
+            expression = expression[:cast.start()].strip()
+        elif masked.startswith("(") and closing_paren(masked, 0) == len(masked) - 1:
+            expression = expression[1:-1].strip()
+        else:
+            break
+    masked = mask_literals(expression)
+    match = _MARGIN_AGGREGATE.match(masked)
+    if match is None or closing_paren(masked, match.end() - 1) != len(masked) - 1:
+        return None
+    argument = expression[match.end():-1].strip()
+    if re.match(r"^DISTINCT\b", argument, re.I):
+        return None
+    return match.group(1).upper(), argument
+
+
+def _margin_expression(function, argument, fraction):
+    # Normal-approximation 95% margin of the scaled estimate under Bernoulli
+    # sampling at ``fraction``.
+    keep = _number(1 - fraction)
+    if function == "COUNT":
+        return f"{Z_95} * SQRT({keep} * COUNT({argument})) / {_number(fraction)}"
+    if function == "SUM":
+        return f"{Z_95} * SQRT({keep} * SUM(POWER(({argument})::float8, 2))) / {_number(fraction)}"
+    return f"{Z_95} * SQRT({keep} * VAR_SAMP(({argument})::float8) / NULLIF(COUNT({argument}), 0))"
+
+
+def rewrite_for_sample(sql, sample):
+    # Returns the aggregate query rewritten to run on the dataset's sample,
+    # with scaled COUNT/SUM and a "<alias>_margin" column after each select
+    # item it can bound, or None when the query isn't a plain aggregate over
+    # analytics_record.
+    sql = sql.strip().rstrip(";").strip()
+    masked = mask_literals(sql)
+    if (
+        len(re.findall(r"\bSELECT\b", masked, re.I)) != 1
+        or _UNSUPPORTED.search(masked)
+        or not _HAS_AGGREGATE.search(masked)
+        or len(_RECORD_TABLE.findall(masked)) != 1
+    ):
+        return None
+    select_list = _SELECT_LIST.match(masked)
+    table = _FROM_RECORD.search(masked)
+    if select_list is None or table is None:
+        return None
+
+    fraction = _fraction(sample)
+    factor = _number(1 / fraction)
+    items, margins = [], []
+    for item in split_top_level(sql[select_list.start("select"):select_list.end("select")], ","):
+        alias = _ALIAS.search(mask_literals(item))
+        expression = item[:alias.start()] if alias else item
+        aggregate = _single_aggregate(expression)
+        name = alias.group(1).strip('"') if alias else None
+        if name is None and aggregate is not None and _MARGIN_AGGREGATE.match(mask_literals(expression.strip())):
+            # Keep the column name Postgres gives a bare aggregate ("count",
+            # "sum"), which scaling would otherwise turn into "round"/"?column?".
+            name = aggregate[0].lower()
+            item = f'{expression} AS "{name}"'
+        scaled = _scale_aggregates(item, factor)
+        if scaled is None:
+            return None
+        items.append(scaled)
+        if aggregate is not None and name is not None:
+            margins.append(f'{_margin_expression(*aggregate, fraction)} AS "{name}_margin"')
+
+    tail = _scale_aggregates(sql[table.start():], factor)
+    if tail is None:
+        return None
+    quote = connection.ops.quote_name
+    alias = table.group(3)
+    if isinstance(sample, TableSample):
+        # TABLESAMPLE goes after the table's alias, if it has one.
+        tablesample = f" TABLESAMPLE BERNOULLI ({_number(fraction * 100)})"
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            source = f"FROM{table.group(1)}analytics_record{table.group(2)}{tablesample}"
+        else:
+            source = f"FROM{table.group(1)}analytics_record{tablesample}{table.group(2) or ''}"
+    elif alias and alias.upper() not in SQL_KEYWORDS:
+        source = f"FROM{table.group(1)}{quote(sample.table_name)}{table.group(2)}"
+    else:
+        source = f"FROM{table.group(1)}{quote(sample.table_name)} AS analytics_record{table.group(2) or ''}"
+    tail = source + tail[table.end() - table.start():]
+    select = ", ".join(items + margins)
+    return f"{sql[:select_list.start('select')]}{select}{sql[select_list.end('select'):table.start()]}{tail}"
+
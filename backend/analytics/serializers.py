@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Dataset, SavedVisualization
+from .snapshots import ReplayError, plan_blocks
 
 class DatasetSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,5 +10,12 @@ class DatasetSerializer(serializers.ModelSerializer):
 class SavedVisualizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = SavedVisualization
-        fields = ['id', 'prompt', 'render_plan', 'created_at']
-        read_only_fields = ['id', 'created_at']
\ No newline at end of file
+        fields = ['id', 'dataset', 'prompt', 'render_plan', 'refresh_interval_seconds', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate_render_plan(self, value):
+        try:
+            plan_blocks(value)
+        except ReplayError as e:
+            raise serializers.ValidationError(str(e))
+        return value
\ No newline at end of file
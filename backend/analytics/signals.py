@@ -0,0 +1,68 @@
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+# Sent after commit whenever a dataset's records are inserted, updated or
+# deleted, with ``dataset_id`` and ``action`` ("insert", "update", "delete").
+# Bulk loaders that bypass the ORM must call lock_record_writes before writing
+# and notify_records_changed after. Receivers live in receivers.py.
+records_changed = Signal()
+
+# Advisory lock classes (the first key of the two-key form; the second is the
+# dataset id). Record ids are drawn before commit, so they don't commit in
+# order: while a write is open, a refresher that took MAX(id) as its
+# watermark could step over the open write's lower ids for good. Writers hold
+# WRITE_LOCK_CLASS shared for their transaction; refreshers only read the
+# watermark while no writer holds it, and serialize among themselves on
+# SETTLE_LOCK_CLASS so they don't mistake each other for a writer.
+WRITE_LOCK_CLASS = 73_071
+SETTLE_LOCK_CLASS = 73_072
+
+
+def _lock_key(dataset_id):
+    return int(dataset_id) % 2 ** 31
+
+
+def lock_record_writes(dataset_ids):
+    # Call inside the writing transaction, before the first record is written.
+    with connection.cursor() as cursor:
+        for dataset_id in sorted(dataset_ids):
+            cursor.execute("SELECT pg_advisory_xact_lock_shared(%s, %s)", [WRITE_LOCK_CLASS, _lock_key(dataset_id)])
+
+
+def settled_records(dataset_id):
+    # (highest record id, data_version) of the dataset when no write to it is
+    # open, else None; the open write's commit sends records_changed again.
+    # Every record up to that id has committed, and those written later get
+    # higher ids.
+    Dataset = apps.get_model("analytics", "Dataset")
+    key = _lock_key(dataset_id)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s, %s)", [SETTLE_LOCK_CLASS, key])
+        try:
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [WRITE_LOCK_CLASS, key])
+            if not cursor.fetchone()[0]:
+                return None
+            try:
+                cursor.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM analytics_record WHERE dataset_id = %s", [dataset_id],
+                )
+                max_id = cursor.fetchone()[0]
+                data_version = Dataset.objects.values_list("data_version", flat=True).get(pk=dataset_id)
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [WRITE_LOCK_CLASS, key])
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [SETTLE_LOCK_CLASS, key])
+    return max_id, data_version
+
+
+def notify_records_changed(dataset_ids, action):
+    Dataset = apps.get_model("analytics", "Dataset")
+    for dataset_id in dataset_ids:
+        Dataset.objects.filter(id=dataset_id).update(data_version=F("data_version") + 1)
+        transaction.on_commit(
+            lambda dataset_id=dataset_id: records_changed.send(
+                sender=Dataset, dataset_id=dataset_id, action=action
+            )
+        )
@@ -0,0 +1,115 @@
+import datetime
+import time
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .dashboard import build_dashboard
+from .models import Dataset, SavedVisualization, VisualizationSnapshot
+from .pagination import make_cursor, read_cursor
+
+# Saved visualizations are replayed from their stored render plan (the block
+# SQL runs directly; the LLM is never called) and the assembled dashboard is
+# kept as a snapshot, so reopening one is a single read until the dataset
+# changes. Table cursors are signed with an expiry, which a snapshot can
+# outlive, so tables are stored with the page their cursor pointed at and
+# get a fresh cursor each time the snapshot is served.
+
+
+class ReplayError(Exception):
+    pass
+
+
+def plan_blocks(render_plan):
+    # A render plan is saved either as the list of blocks or wrapped as
+    # {"blocks": [...]}.
+    blocks = render_plan.get("blocks") if isinstance(render_plan, dict) else render_plan
+    if not isinstance(blocks, list) or not all(isinstance(block, dict) for block in blocks):
+        raise ReplayError("The saved render plan is not a list of blocks.")
+    return blocks
+
+
+def _stored_block(block):
+    if block.get("render") != "table" or not block.get("next_cursor"):
+        return block
+    cursor = read_cursor(block["next_cursor"])
+    return {
+        **block,
+        "next_cursor": None,
+        "next_page": {key: cursor[key] for key in ("sql", "mode", "position")},
+    }
+
+
+def snapshot_blocks(snapshot, dataset_id):
+    # The snapshot's blocks as served, with table cursors minted now.
+    blocks = []
+    for block in snapshot.blocks:
+        page = block.get("next_page")
+        if page is not None:
+            block = {key: value for key, value in block.items() if key != "next_page"}
+            block["next_cursor"] = make_cursor(
+                page["sql"], page["mode"], page["position"], dataset_id, snapshot.data_version,
+            )
+        blocks.append(block)
+    return blocks
+
+
+def refresh_snapshot(visualization):
+    if visualization.dataset_id is None:
+        raise ReplayError("This visualization has no dataset to run its render plan against.")
+    blocks = plan_blocks(visualization.render_plan)
+    # Read the version fresh: the snapshot is only as new as the data it ran on.
+    dataset = Dataset.objects.get(pk=visualization.dataset_id)
+
+    started = time.perf_counter()
+    assembled_blocks, warnings = build_dashboard(blocks, dataset)
+    duration_ms = round((time.perf_counter() - started) * 1000)
+
+    now = timezone.now()
+    snapshot, _ = VisualizationSnapshot.objects.update_or_create(
+        visualization=visualization,
+        defaults={
+            "blocks": [_stored_block(block) for block in assembled_blocks],
+            "warnings": warnings,
+            "data_version": dataset.data_version,
+            "duration_ms": duration_ms,
+            "computed_at": now,
+        },
+    )
+    if visualization.refresh_interval_seconds:
+        visualization.next_refresh_at = now + datetime.timedelta(seconds=visualization.refresh_interval_seconds)
+        visualization.save(update_fields=["next_refresh_at"])
+    visualization.snapshot = snapshot
+    return snapshot
+
+
+def current_snapshot(visualization):
+    # The stored snapshot if it is up to date with the dataset, else a fresh
+    # one. ``visualization`` should come with dataset and snapshot
+    # select_related, so the up-to-date case costs no further queries.
+    snapshot = getattr(visualization, "snapshot", None)
+    if (
+        snapshot is not None
+        and visualization.dataset is not None
+        and snapshot.data_version == visualization.dataset.data_version
+    ):
+        return snapshot, False
+    return refresh_snapshot(visualization), True
+
+
+def due_visualizations(stale=False):
+    # Scheduled visualizations whose refresh time has come (or that were never
+    # run), plus, when ``stale``, any snapshot behind its dataset's data.
+    now = timezone.now()
+    due = Q(refresh_interval_seconds__isnull=False) & (
+        Q(next_refresh_at__isnull=True) | Q(next_refresh_at__lte=now)
+    )
+    if stale:
+        due |= Q(snapshot__isnull=False) & ~Q(snapshot__data_version=F("dataset__data_version"))
+    return (
+        SavedVisualization.objects
+        .filter(due, dataset__isnull=False)
+        .select_related("dataset")
+        .order_by("next_refresh_at", "id")
+    )
+
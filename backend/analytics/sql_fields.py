@@ -0,0 +1,135 @@
+import re
+
+# Helpers for recognising dataset field references (row_data->>'field') in
+# generated block SQL, and for scanning it outside literals and parentheses.
+
+CAST_FIELD = re.compile(
+    r"\(\s*((?:\w+\.)?)row_data\s*->>\s*'([^']+)'\s*\)\s*::\s*(double\s+precision|\w+)", re.I
+)
+TEXT_FIELD = re.compile(r"((?:\w+\.)?)row_data\s*->>\s*'([^']+)'", re.I)
+QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+JSONB_OPERATOR = re.compile(r"(?:\w+\.)?row_data\s*(?:@>|\?\||\?&|\?)", re.I)
+FIELD_ALIAS = re.compile(
+    r"(\(\s*(?:\w+\.)?row_data\s*->>\s*'[^']+'\s*\)\s*::\s*(?:double\s+precision|\w+)"
+    r"|(?:\w+\.)?row_data\s*->>\s*'[^']+')\s+AS\s+(\w+)",
+    re.I,
+)
+CLAUSE_KEYWORD = re.compile(
+    r"\b(SELECT|FROM|WHERE|ON|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET|WINDOW|UNION|INTERSECT|EXCEPT)\b",
+    re.I,
+)
+CLAUSE_NAMES = {"WHERE": "where", "ON": "where", "GROUP BY": "group_by", "ORDER BY": "order_by"}
+
+CAST_ALIASES = {
+    "int": "integer",
+    "int4": "integer",
+    "integer": "integer",
+    "int8": "bigint",
+    "bigint": "bigint",
+    "int2": "smallint",
+    "smallint": "smallint",
+    "float": "double precision",
+    "float8": "double precision",
+    "double precision": "double precision",
+    "float4": "real",
+    "real": "real",
+    "decimal": "numeric",
+    "numeric": "numeric",
+    "bool": "boolean",
+    "boolean": "boolean",
+    "date": "date",
+    "timestamp": "timestamp",
+    "timestamptz": "timestamptz",
+    "text": "text",
+    "varchar": "text",
+}
+
+
+def canonical_cast(cast):
+    cast = re.sub(r"\s+", " ", cast.strip().lower())
+    return CAST_ALIASES.get(cast, cast)
+
+
+def field_refs(expression):
+    # (field, cast) pairs referenced in an SQL fragment; bare ->> access is "text".
+    refs = [(field, canonical_cast(cast)) for _, field, cast in CAST_FIELD.findall(expression)]
+    remainder = CAST_FIELD.sub(" ", expression)
+    refs.extend((field, "text") for _, field in TEXT_FIELD.findall(remainder))
+    return refs
+
+
+def record_expression(field, cast):
+    # The analytics_record expression a query uses for (field, cast); index
+    # definitions must match it exactly to be usable.
+    literal = "'" + field.replace("'", "''") + "'"
+    if cast == "text":
+        return f"(row_data->>{literal})"
+    return f"((row_data->>{literal})::{cast})"
+
+
+def clause_segments(sql):
+    segments = []
+    matches = list(CLAUSE_KEYWORD.finditer(sql))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(sql)
+        keyword = re.sub(r"\s+", " ", match.group(1).upper())
+        segments.append((keyword, sql[match.end():end]))
+    return segments
+
+
+def field_usage(sql):
+    # {(clause, field, cast)} for fields used in WHERE/ON, GROUP BY and ORDER BY;
+    # JSONB containment/existence filters are reported as field "*" cast "jsonb".
+    aliases = {alias.lower(): field_refs(expr)[0] for expr, alias in FIELD_ALIAS.findall(sql)}
+    usage = set()
+    for keyword, text in clause_segments(sql):
+        clause = CLAUSE_NAMES.get(keyword)
+        if clause is None:
+            continue
+        for field, cast in field_refs(text):
+            usage.add((clause, field, cast))
+        if clause != "where":
+            remainder = TEXT_FIELD.sub(" ", CAST_FIELD.sub(" ", text))
+            for word in re.findall(r"\b\w+\b", remainder):
+                if word.lower() in aliases:
+                    usage.add((clause, *aliases[word.lower()]))
+        elif JSONB_OPERATOR.search(text):
+            usage.add((clause, "*", "jsonb"))
+    return usage
+
+
+def mask_literals(sql):
+    # Same-length copy of sql with string literals and quoted identifiers
+    # blanked, so keyword/parenthesis scanning can't be fooled by their
+    # contents and offsets still line up with the original.
+    return QUOTED.sub(lambda m: m.group(0)[0] + "x" * (len(m.group(0)) - 2) + m.group(0)[-1], sql)
+
+
+def closing_paren(masked, start):
+    # Index of the parenthesis closing the one at ``start``, or None.
+    depth = 0
+    for i in range(start, len(masked)):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+
+def split_top_level(text, separator):
+    # Splits on a separator regex that occurs outside parentheses and literals.
+    masked = mask_literals(text)
+    parts, depth, start = [], 0, 0
+    for match in re.finditer(rf"\(|\)|{separator}", masked, re.I):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return [part.strip() for part in parts]
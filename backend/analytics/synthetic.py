@@ -0,0 +1,158 @@
+import datetime
+import json
+import random
+import uuid
+
+import numpy as np
+
+# Synthetic sales, website traffic and HR rows for seeding and benchmarks.
+# Generation is seeded, so the same (kind, count, seed) always yields the
+# same data. generate_rows yields row dicts lazily; copy_chunk builds a whole
+# chunk of COPY input at once with NumPy, for seeding at scale.
+
+DATASET_CONFIGS = [
+    {
+        "name": "Q4 Global Sales",
+        "description": "Seeded dataset for LLM testing",
+        "generation_type": "sales",
+        "metadata": {
+            "order_id": "string",
+            "date": "date",
+            "region": "string",
+            "product": "string",
+            "units": "integer",
+            "revenue": "integer",
+        },
+    },
+    {
+        "name": "Website Traffic Analytics",
+        "description": "Seeded website session data for LLM testing",
+        "generation_type": "traffic",
+        "metadata": {
+            "session_id": "string",
+            "date": "date",
+            "device_type": "string",
+            "browser": "string",
+            "page_views": "integer",
+            "time_on_site_seconds": "integer",
+        },
+    },
+    {
+        "name": "HR Employee Data",
+        "description": "Seeded employee HR data for LLM testing",
+        "generation_type": "hr",
+        "metadata": {
+            "employee_id": "string",
+            "department": "string",
+            "years_at_company": "integer",
+            "salary": "integer",
+            "performance_score": "integer",
+            "remote_worker": "boolean",
+        },
+    },
+]
+DATASET_KINDS = {config["generation_type"]: config for config in DATASET_CONFIGS}
+
+REGIONS = ["North", "South", "East", "West"]
+PRODUCTS = ["Laptop", "Phone", "Tablet", "Monitor"]
+DEVICE_TYPES = ["Mobile", "Desktop", "Tablet"]
+BROWSERS = ["Chrome", "Safari", "Firefox", "Edge"]
+DEPARTMENTS = ["Engineering", "Sales", "HR", "Marketing", "Finance"]
+
+# Dates fall within the year up to end_date. It defaults to a fixed day, not
+# the current date, so a seed yields the same rows whenever it is run.
+END_DATE = datetime.date(2025, 12, 31)
+DATE_RANGE_DAYS = 365
+
+# Field generators per dataset kind: "uuid", "date" (within DATE_RANGE_DAYS),
+# "bool", ("choice", values) or ("int", low, high) with both ends inclusive.
+ROW_SPECS = {
+    "sales": [
+        ("order_id", "uuid"),
+        ("date", "date"),
+        ("region", ("choice", REGIONS)),
+        ("product", ("choice", PRODUCTS)),
+        ("units", ("int", 1, 50)),
+        ("revenue", ("int", 100, 5000)),
+    ],
+    "traffic": [
+        ("session_id", "uuid"),
+        ("date", "date"),
+        ("device_type", ("choice", DEVICE_TYPES)),
+        ("browser", ("choice", BROWSERS)),
+        ("page_views", ("int", 1, 15)),
+        ("time_on_site_seconds", ("int", 10, 600)),
+    ],
+    "hr": [
+        ("employee_id", "uuid"),
+        ("department", ("choice", DEPARTMENTS)),
+        ("years_at_company", ("int", 1, 15)),
+        ("salary", ("int", 50000, 150000)),
+        ("performance_score", ("int", 1, 100)),
+        ("remote_worker", "bool"),
+    ],
+}
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+# Where the 32 hex digits go in the 36-character dashed UUID form.
+UUID_DIGIT_POSITIONS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+
+
+def _value(rng, end_date, generator):
+    if generator == "uuid":
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    if generator == "date":
+        return (end_date - datetime.timedelta(days=rng.randint(0, DATE_RANGE_DAYS))).isoformat()
+    if generator == "bool":
+        return rng.choice([True, False])
+    if generator[0] == "choice":
+        return rng.choice(generator[1])
+    return rng.randint(generator[1], generator[2])
+
+
+def generate_rows(kind, count, seed=None, end_date=END_DATE):
+    # Row dicts one at a time, for callers that go through ingest_rows.
+    rng = random.Random(seed)
+    spec = ROW_SPECS[kind]
+    for _ in range(count):
+        yield {field: _value(rng, end_date, generator) for field, generator in spec}
+
+
+def _uuid_column(rng, count):
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    digits = HEX_DIGITS[np.stack([raw >> 4, raw & 0x0F], axis=2).reshape(count, 32)]
+    text = np.full((count, 36), ord("-"), dtype=np.uint8)
+    text[:, UUID_DIGIT_POSITIONS] = digits
+    return text.view("S36").ravel().astype(str)
+
+
+def _json_column(rng, end_date, generator, count):
+    # The column's values already JSON-encoded, as a string array.
+    if generator == "uuid":
+        return np.strings.add(np.strings.add('"', _uuid_column(rng, count)), '"')
+    if generator == "date":
+        days = np.datetime64(end_date, "D") - rng.integers(0, DATE_RANGE_DAYS + 1, size=count)
+        return np.strings.add(np.strings.add('"', days.astype(str)), '"')
+    if generator == "bool":
+        return np.array(["false", "true"])[rng.integers(0, 2, size=count)]
+    if generator[0] == "choice":
+        encoded = np.array([json.dumps(value) for value in generator[1]])
+        return encoded[rng.integers(0, len(encoded), size=count)]
+    return rng.integers(generator[1], generator[2] + 1, size=count).astype(str)
+
+
+def copy_chunk(kind, dataset_id, created_at, count, seed, chunk, end_date=END_DATE):
+    # ``count`` rows in COPY text format (dataset_id, row_data, created_at),
+    # built column-wise with NumPy. Each chunk draws from its own stream of
+    # ``seed``, so the output doesn't depend on how chunks are spread over
+    # processes. Values never contain backslashes, tabs or newlines, so no
+    # COPY escaping is needed.
+    rng = np.random.default_rng([seed, list(ROW_SPECS).index(kind), chunk])
+    line = np.full(count, f"{dataset_id}\t{{")
+    for i, (field, generator) in enumerate(ROW_SPECS[kind]):
+        key = f'{"," if i else ""}"{field}":'
+        line = np.strings.add(np.strings.add(line, key), _json_column(rng, end_date, generator, count))
+    line = np.strings.add(line, f"}}\t{created_at}\n")
+    return "".join(line.tolist())
@@ -0,0 +1,74 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..executor import execute_block_sql
+from ..models import Dataset, Record
+
+# Shared fixture for the tests that check a query rewrite (fused GROUPING
+# SETS, rollup cube, sample, intent plans, ...) against the query it stands in
+# for, on the same data.
+
+REGIONS = ["North", "South", "East", "West"]
+PRODUCTS = ["Laptop", "Monitor", "Phone", "Desk"]
+
+
+def fixture_rows(count=240, seed=7):
+    rng = random.Random(seed)
+    start = datetime.date(2025, 1, 1)
+    for n in range(count):
+        yield {
+            "order_id": f"ORD-{n:05d}",
+            "date": (start + datetime.timedelta(days=rng.randrange(90))).isoformat(),
+            "region": rng.choice(REGIONS),
+            "product": rng.choice(PRODUCTS),
+            "units": rng.randint(1, 9),
+            "revenue": round(rng.uniform(10, 2000), 2),
+        }
+
+
+def normalized(data):
+    # Rows with numbers rounded, so values computed along different paths
+    # (e.g. AVG as SUM / COUNT) compare equal.
+    def value(v):
+        if isinstance(v, (Decimal, float)) and not isinstance(v, bool):
+            return round(float(v), 6)
+        return v
+
+    return [{column: value(v) for column, v in row.items()} for row in data]
+
+
+class RewriteTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("analyst")
+        cls.dataset = Dataset.objects.create(
+            name="Sales",
+            description="Fixture data",
+            created_by=cls.user,
+            metadata={
+                "order_id": "string",
+                "date": "date",
+                "region": "string",
+                "product": "string",
+                "units": "integer",
+                "revenue": "float",
+            },
+        )
+        Record.objects.bulk_create(Record(dataset=cls.dataset, row_data=row) for row in fixture_rows())
+
+    def run_sql(self, sql):
+        columns, data, warning = execute_block_sql(sql, self.dataset.id)
+        self.assertIsNone(warning, sql)
+        return columns, data
+
+    def assertSameResult(self, original, rewritten, ordered=True):
+        columns, data = self.run_sql(original)
+        rewritten_columns, rewritten_data = rewritten
+        self.assertEqual(rewritten_columns, columns, original)
+        if not ordered:
+            data, rewritten_data = (sorted(rows, key=repr) for rows in (data, rewritten_data))
+        self.assertEqual(normalized(rewritten_data), normalized(data), original)
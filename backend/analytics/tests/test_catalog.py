@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from .. import catalog
+from ..models import Dataset
+
+URL = "/api/datasets/"
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        # Test rollbacks reuse catalog versions the per-process snapshot has seen.
+        catalog._snapshot = None
+        self.user = User.objects.create_user("analyst")
+        self.datasets = [self.create(f"Dataset {n}") for n in range(5)]
+
+    def create(self, name):
+        # The catalog version is bumped when the change commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            return Dataset.objects.create(name=name, description="", created_by=self.user, metadata={})
+
+    def test_pages_cover_every_dataset_once(self):
+        ids, cursor = [], ""
+        while True:
+            body = self.client.get(URL, {"limit": 2, "cursor": cursor}).json()
+            self.assertLessEqual(len(body["results"]), 2)
+            ids.extend(item["id"] for item in body["results"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(ids, [dataset.id for dataset in self.datasets])
+
+    def test_fields_select_the_columns(self):
+        body = self.client.get(URL, {"fields": "name"}).json()
+        self.assertEqual(body["results"][0], {"id": self.datasets[0].id, "name": "Dataset 0"})
+
+    def test_unchanged_catalog_answers_304(self):
+        response = self.client.get(URL, {"limit": 2})
+        etag = response["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(URL, {"limit": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Another page or field list is another representation.
+        self.assertEqual(self.client.get(URL, {"limit": 3}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.create("Dataset 5")
+        response = self.client.get(URL, {"limit": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_changes_show_up_in_the_next_response(self):
+        self.client.get(URL)
+        self.datasets[0].name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.datasets[0].save()
+        names = [item["name"] for item in self.client.get(URL).json()["results"]]
+        self.assertEqual(names, ["Renamed", "Dataset 1", "Dataset 2", "Dataset 3", "Dataset 4"])
+
+    def test_bad_parameters(self):
+        for params in [{"fields": "name,secret"}, {"limit": 0}, {"limit": "ten"}, {"cursor": "not-a-cursor"}]:
+            self.assertEqual(self.client.get(URL, params).status_code, 400, params)
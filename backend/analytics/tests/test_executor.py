@@ -0,0 +1,63 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from ..executor import run_blocks
+from ..models import Dataset, Record
+
+COUNT = "SELECT COUNT(*) AS n FROM analytics_record WHERE dataset_id = %s"
+
+
+# Block queries run on the pool's own connections, which only see committed
+# rows, so these tests commit their fixture.
+@override_settings(BLOCK_EXECUTOR_MAX_WORKERS=4, BLOCK_FUSION_ENABLED=False)
+class ConcurrentBlockTests(TransactionTestCase):
+    def run(self, result=None):
+        # Pool threads would keep their connections open for CONN_MAX_AGE and
+        # stop the test database from being dropped.
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0):
+            return super().run(result)
+
+    def setUp(self):
+        self.dataset = Dataset.objects.create(
+            name="Orders", description="", created_by=User.objects.create_user("analyst"),
+            metadata={"n": "integer"},
+        )
+        Record.objects.bulk_create(Record(dataset=self.dataset, row_data={"n": n}) for n in range(10))
+
+    def test_results_keep_block_order(self):
+        # The first block finishes last; results still line up with sql_list.
+        results = run_blocks([
+            f"SELECT COUNT(*) AS n, pg_sleep(0.3)::text AS slept FROM analytics_record WHERE dataset_id = %s",
+            None,
+            "SELECT MAX((row_data->>'n')::int) AS top FROM analytics_record WHERE dataset_id = %s",
+            COUNT,
+        ], self.dataset.id)
+        self.assertEqual(results[0][:2], (["n", "slept"], [{"n": 10, "slept": ""}]))
+        self.assertIsNone(results[1])
+        self.assertEqual(results[2], (["top"], [{"top": 9}], None))
+        self.assertEqual(results[3], (["n"], [{"n": 10}], None))
+
+    def test_blocks_run_at_the_same_time(self):
+        sql = "SELECT pg_sleep(0.4)::text AS slept FROM analytics_record WHERE dataset_id = %s LIMIT 1"
+        started = time.monotonic()
+        results = run_blocks([sql, sql, sql], self.dataset.id)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual([warning for _, _, warning in results], [None, None, None])
+
+    @override_settings(BLOCK_STATEMENT_TIMEOUT_MS=200)
+    def test_a_failing_block_only_fails_itself(self):
+        results = run_blocks([
+            "SELECT nope FROM analytics_record WHERE dataset_id = %s",
+            "DELETE FROM analytics_record WHERE dataset_id = %s",
+            "SELECT pg_sleep(1)::text AS slept FROM analytics_record WHERE dataset_id = %s LIMIT 1",
+            COUNT,
+        ], self.dataset.id)
+        self.assertIn('column "nope" does not exist', results[0][2])
+        self.assertTrue(results[1][2].startswith("Query rejected"))
+        self.assertIn("statement timeout", results[2][2])
+        self.assertEqual(results[3], (["n"], [{"n": 10}], None))
+        self.assertEqual(Record.objects.filter(dataset=self.dataset).count(), 10)
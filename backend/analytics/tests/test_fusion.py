@@ -0,0 +1,41 @@
+from ..executor import ROW_LIMIT, execute_fused_sql
+from ..fusion import fuse_blocks, fusion_groups, parse_block
+from .base import RewriteTestCase
+
+
+class FusionTests(RewriteTestCase):
+    BLOCKS = [
+        "SELECT COUNT(*) AS n, SUM((row_data->>'revenue')::numeric) AS total "
+        "FROM analytics_record WHERE dataset_id = %s",
+        "SELECT row_data->>'region' AS region, SUM((row_data->>'revenue')::numeric) AS total "
+        "FROM analytics_record WHERE dataset_id = %s GROUP BY region ORDER BY total DESC LIMIT 3",
+        "SELECT row_data->>'product' AS product, AVG((row_data->>'units')::numeric) AS avg_units, count(*) "
+        "FROM analytics_record WHERE dataset_id = %s GROUP BY 1 ORDER BY 1",
+        "SELECT row_data->>'region' AS x, row_data->>'product' AS y, MAX((row_data->>'revenue')::numeric) AS m "
+        "FROM analytics_record WHERE dataset_id = %s GROUP BY x, y ORDER BY m DESC, x, y LIMIT 5",
+    ]
+
+    def test_fused_blocks_match_their_own_queries(self):
+        parsed = {i: parse_block(sql, ROW_LIMIT) for i, sql in enumerate(self.BLOCKS)}
+        self.assertTrue(all(block is not None for block in parsed.values()))
+        self.assertEqual(fusion_groups(parsed), [list(parsed)])
+
+        fused = fuse_blocks(parsed, list(parsed))
+        results, warning = execute_fused_sql(fused, fused.sql, self.dataset.id)
+        self.assertIsNone(warning)
+        for i, sql in enumerate(self.BLOCKS):
+            columns, data, block_warning = results[i]
+            self.assertIsNone(block_warning)
+            self.assertSameResult(sql, (columns, data))
+
+    def test_blocks_over_different_rows_are_not_fused(self):
+        parsed = {
+            0: parse_block(self.BLOCKS[0], ROW_LIMIT),
+            1: parse_block(self.BLOCKS[0].replace("dataset_id = %s", "dataset_id = %s AND row_data->>'region' = 'North'"), ROW_LIMIT),
+        }
+        self.assertEqual(fusion_groups(parsed), [])
+
+    def test_non_aggregates_are_not_fused(self):
+        self.assertIsNone(parse_block(
+            "SELECT row_data->>'region' AS region FROM analytics_record WHERE dataset_id = %s LIMIT 3", ROW_LIMIT,
+        ))
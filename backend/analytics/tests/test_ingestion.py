@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..ingestion import IngestionError, ingest_rows
+from ..models import Dataset, Record
+
+
+class IngestRowsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("analyst")
+
+    def test_nested_values_are_stored_as_json(self):
+        rows = [
+            {"id": 1, "tags": ["a", "b"], "address": {"city": "Oslo", "zip": "0150"}},
+            {"id": 2, "tags": "c", "address": None},
+        ]
+        stats = ingest_rows(rows, name="Nested", owner=self.user)
+        self.assertEqual((stats["rows"], stats["rejected"]), (2, 0))
+        stored = Record.objects.filter(dataset_id=stats["dataset_id"]).order_by("id")
+        self.assertEqual([record.row_data for record in stored], [
+            {"id": 1, "tags": ["a", "b"], "address": {"city": "Oslo", "zip": "0150"}},
+            {"id": 2, "tags": "c", "address": None},
+        ])
+
+    def test_nested_values_in_typed_fields_are_row_errors(self):
+        with self.assertRaisesMessage(IngestionError, "Row 2: field 'id'"):
+            ingest_rows([{"id": 1}, {"id": {"n": 2}}], name="Typed", owner=self.user, metadata={"id": "integer"})
+
+    def test_batches_postgres_rejects_name_the_row(self):
+        # jsonb can't hold a NUL, so COPY rejects the second batch.
+        rows = [{"note": "ok"}, {"note": "fine"}, {"note": "bad\x00"}, {"note": "ok"}]
+        with self.assertRaisesRegex(IngestionError, r"^Row 3 \(batch 2\): "):
+            ingest_rows(rows, name="Notes", owner=self.user, batch_size=2)
+        # The load is one transaction, so nothing from batch 1 is kept either.
+        self.assertFalse(Dataset.objects.filter(name="Notes").exists())
+        self.assertFalse(Record.objects.exists())
@@ -0,0 +1,43 @@
+from ..intents import match_intent
+from .base import RewriteTestCase, normalized
+
+
+class IntentTests(RewriteTestCase):
+    # Prompt -> the query a person would have written for it.
+    CASES = [
+        ("total revenue", "SELECT SUM((row_data->>'revenue')::numeric) FROM analytics_record WHERE dataset_id = %s"),
+        ("count of records", "SELECT COUNT(*) FROM analytics_record WHERE dataset_id = %s"),
+        (
+            "average units by region",
+            "SELECT row_data->>'region', AVG((row_data->>'units')::numeric) FROM analytics_record "
+            "WHERE dataset_id = %s GROUP BY 1",
+        ),
+        (
+            "top 2 products by revenue",
+            "SELECT row_data->>'product', SUM((row_data->>'revenue')::numeric) AS total FROM analytics_record "
+            "WHERE dataset_id = %s GROUP BY 1 ORDER BY total DESC LIMIT 2",
+        ),
+        (
+            "number of distinct products",
+            "SELECT COUNT(DISTINCT row_data->>'product') FROM analytics_record WHERE dataset_id = %s",
+        ),
+    ]
+
+    def test_intent_plans_match_hand_written_queries(self):
+        for prompt, expected in self.CASES:
+            blocks = match_intent(prompt, self.dataset)
+            self.assertIsNotNone(blocks, prompt)
+            self.assertEqual(len(blocks), 1, prompt)
+            _, data = self.run_sql(blocks[0]["sql"])
+            _, expected_data = self.run_sql(expected)
+            values = sorted(normalized([dict(enumerate(row.values())) for row in data]), key=repr)
+            expected_values = sorted(normalized([dict(enumerate(row.values())) for row in expected_data]), key=repr)
+            self.assertEqual(values, expected_values, prompt)
+
+    def test_clauses_become_one_block_each(self):
+        blocks = match_intent("total revenue and count by region", self.dataset)
+        self.assertEqual([block["render"] for block in blocks], ["kpi", "chart"])
+
+    def test_unrecognised_words_are_left_to_the_llm(self):
+        self.assertIsNone(match_intent("revenue in 2024", self.dataset))
+        self.assertIsNone(match_intent("total revenue and forecast next quarter", self.dataset))
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..jobs import QueueFull, _update_claimed, cancel_job, claim_job, enqueue_job, recover_stale_jobs
+from ..models import AskJob, Dataset
+
+
+@override_settings(ASK_JOB_MAX_RUNNING=0, ASK_JOB_MAX_QUEUED=1000, ASK_JOB_MAX_ATTEMPTS=2)
+class AskJobQueueTests(TestCase):
+    def setUp(self):
+        self.dataset = Dataset.objects.create(
+            name="Sales", description="", created_by=User.objects.create_user("analyst"), metadata={},
+        )
+
+    def enqueue(self, count):
+        return [enqueue_job(self.dataset, f"prompt {n}") for n in range(count)]
+
+    def go_stale(self, job):
+        AskJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first, second = self.enqueue(2)
+        claimed = [claim_job("w1"), claim_job("w2"), claim_job("w3")]
+        self.assertEqual([job and job.pk for job in claimed], [first.pk, second.pk, None])
+        job = AskJob.objects.get(pk=first.pk)
+        self.assertEqual((job.status, job.worker, job.attempts), (AskJob.RUNNING, "w1", 1))
+
+    @override_settings(ASK_JOB_MAX_RUNNING=1)
+    def test_running_jobs_are_capped(self):
+        self.enqueue(2)
+        running = claim_job("w1")
+        self.assertIsNone(claim_job("w2"))
+        _update_claimed(running, status=AskJob.SUCCEEDED, finished_at=timezone.now())
+        self.assertIsNotNone(claim_job("w2"))
+
+    @override_settings(ASK_JOB_MAX_QUEUED=1)
+    def test_full_queue_is_refused(self):
+        self.enqueue(1)
+        with self.assertRaises(QueueFull):
+            self.enqueue(1)
+
+    def test_cancel(self):
+        queued, running = self.enqueue(2)
+        self.assertTrue(cancel_job(queued.pk))
+        self.assertEqual(claim_job("w1").pk, running.pk)
+        # A running job stops at its next write.
+        self.assertTrue(cancel_job(running.pk))
+        self.assertFalse(_update_claimed(running, blocks=[{"render": "kpi"}]))
+        self.assertEqual(AskJob.objects.get(pk=running.pk).status, AskJob.CANCELLED)
+        # Finished jobs can't be cancelled again.
+        self.assertFalse(cancel_job(running.pk))
+        response = self.client.post(f"/api/ask/jobs/{queued.pk}/cancel/")
+        self.assertEqual((response.status_code, response.json()["status"]), (409, AskJob.CANCELLED))
+
+    def test_stale_jobs_are_retried_then_failed(self):
+        job, = self.enqueue(1)
+        first = claim_job("w1")
+        self.go_stale(first)
+        with self.assertLogs("analytics.jobs", "WARNING"):
+            self.assertEqual(recover_stale_jobs(), (1, 0))
+        second = claim_job("w2")
+        self.assertEqual((second.pk, second.attempts), (job.pk, 2))
+        # The first claim no longer holds, so its worker's writes are dropped.
+        self.assertFalse(_update_claimed(first, status=AskJob.SUCCEEDED))
+        self.assertTrue(_update_claimed(second, blocks=[]))
+
+        self.go_stale(second)
+        with self.assertLogs("analytics.jobs", "WARNING"):
+            self.assertEqual(recover_stale_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, AskJob.FAILED)
+        self.assertIsNone(claim_job("w3"))
+
+    def test_jobs_with_a_live_heartbeat_are_left_alone(self):
+        self.enqueue(1)
+        claim_job("w1")
+        self.assertEqual(recover_stale_jobs(), (0, 0))
@@ -0,0 +1,81 @@
+from django.core import signing
+from django.test import override_settings
+
+from ..executor import run_blocks
+from ..models import Record
+from ..pagination import CURSOR_SALT, finish_page, make_cursor, page_mode, page_sql
+from .base import RewriteTestCase
+
+
+@override_settings(TABLE_PAGE_SIZE=7)
+class TablePageTests(RewriteTestCase):
+    def setUp(self):
+        self.dataset.refresh_from_db()
+
+    def first_page(self, sql):
+        mode = page_mode(sql)
+        result = run_blocks([page_sql(sql, mode, 0)], self.dataset.id, data_version=self.dataset.data_version)[0]
+        return mode, finish_page(result, sql, mode, 0, self.dataset.id, self.dataset.data_version)
+
+    def all_pages(self, sql):
+        mode, (columns, data, warning, cursor) = self.first_page(sql)
+        self.assertIsNone(warning)
+        rows = list(data)
+        while cursor:
+            response = self.client.get("/api/blocks/page/", {"cursor": cursor})
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            self.assertEqual(body["columns"], columns)
+            rows.extend(body["data"])
+            cursor = body["next_cursor"]
+        return mode, columns, rows
+
+    def test_keyset_pages_cover_every_row_once(self):
+        sql = "SELECT row_data->>'order_id' AS order_id FROM analytics_record WHERE dataset_id = %s"
+        mode, columns, rows = self.all_pages(sql)
+        self.assertEqual(mode, "keyset")
+        self.assertSameResult(f"{sql} ORDER BY id", (columns, rows))
+
+    def test_offset_pages_with_ties_cover_every_row_once(self):
+        # Many rows share a region, so only the appended output columns keep
+        # them from moving between pages.
+        sql = (
+            "SELECT row_data->>'region' AS region, row_data->>'product' AS product, COUNT(*) AS n "
+            "FROM analytics_record WHERE dataset_id = %s GROUP BY 1, 2 ORDER BY 1"
+        )
+        self.assertTrue(page_sql(sql, "offset", 0).endswith("ORDER BY 1, 1, 2, 3 LIMIT 7 OFFSET 0"))
+        mode, columns, rows = self.all_pages(sql)
+        self.assertEqual(mode, "offset")
+        self.assertSameResult(sql, (columns, rows), ordered=False)
+        self.assertEqual([row["region"] for row in rows], sorted(row["region"] for row in rows))
+
+    def test_select_star_with_order_by_is_not_paged(self):
+        self.assertIsNone(page_mode(
+            "SELECT * FROM (SELECT row_data->>'region' AS region FROM analytics_record WHERE dataset_id = %s) s "
+            "ORDER BY 1"
+        ))
+
+    def test_bad_cursors(self):
+        self.assertEqual(self.client.get("/api/blocks/page/").status_code, 400)
+        self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": "not-a-cursor"}).status_code, 400)
+        forged = signing.dumps({"sql": "SELECT 1", "mode": "offset", "position": 0}, salt="other")
+        self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": forged}).status_code, 400)
+        with override_settings(TABLE_CURSOR_MAX_AGE_SECONDS=-1):
+            cursor = make_cursor("SELECT 1", "offset", 0, self.dataset.id, self.dataset.data_version)
+            self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": cursor}).status_code, 400)
+        cursor = signing.dumps(
+            {"sql": "SELECT 1", "mode": "offset", "position": 0, "dataset_id": 0, "version": 0},
+            salt=CURSOR_SALT, compress=True,
+        )
+        self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": cursor}).status_code, 400)
+
+    def test_offset_cursors_conflict_once_the_dataset_changes(self):
+        sql = "SELECT row_data->>'order_id' AS order_id FROM analytics_record WHERE dataset_id = %s"
+        _, (_, _, _, keyset) = self.first_page(sql)
+        mode, (_, _, _, offset) = self.first_page(f"{sql} ORDER BY 1 DESC")
+        self.assertEqual(mode, "offset")
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(dataset=self.dataset, row_data={"order_id": "ORD-99999"})
+        self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": offset}).status_code, 409)
+        # Keyset pages don't move when rows are added, so they carry on.
+        self.assertEqual(self.client.get("/api/blocks/page/", {"cursor": keyset}).status_code, 200)
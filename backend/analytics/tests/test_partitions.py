@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase
+
+from ..models import Dataset, Record
+from ..partitions import is_record_table, partition_name
+
+
+def exists(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [table])
+        return cursor.fetchone()[0]
+
+
+# Partitions are detached CONCURRENTLY once the delete commits, which can't
+# happen inside a test transaction.
+class PartitionTests(TransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user("analyst")
+        self.datasets = [
+            Dataset.objects.create(name=name, description="", created_by=user, metadata={"n": "integer"})
+            for name in ("Orders", "Returns")
+        ]
+        for dataset in self.datasets:
+            Record.objects.bulk_create(Record(dataset=dataset, row_data={"n": n}) for n in range(5))
+
+    def test_each_dataset_gets_a_partition(self):
+        for dataset in self.datasets:
+            table = partition_name(dataset.id)
+            self.assertTrue(is_record_table(table))
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*), MIN(dataset_id), MAX(dataset_id) FROM {table}")
+                self.assertEqual(cursor.fetchone(), (5, dataset.id, dataset.id))
+
+    def test_dataset_filters_prune_to_one_partition(self):
+        kept, other = self.datasets
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN SELECT COUNT(*) FROM analytics_record WHERE dataset_id = %s", [kept.id])
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn(partition_name(kept.id), plan)
+        self.assertNotIn(partition_name(other.id), plan)
+
+    def test_deleting_a_dataset_drops_its_partition(self):
+        deleted, kept = self.datasets
+        deleted_id = deleted.id
+        deleted.delete()
+        self.assertFalse(exists(partition_name(deleted_id)))
+        self.assertFalse(Record.objects.filter(dataset_id=deleted_id).exists())
+        self.assertTrue(exists(partition_name(kept.id)))
+        self.assertEqual(Record.objects.filter(dataset=kept).count(), 5)
+
+    def test_only_record_tables_match(self):
+        self.assertTrue(is_record_table("analytics_record"))
+        self.assertTrue(is_record_table("analytics_record_p12"))
+        self.assertFalse(is_record_table("analytics_record_p12_x"))
+        self.assertFalse(is_record_table("analytics_recordrollup"))
@@ -0,0 +1,43 @@
+from ..plan_cache import LocMemPlanBackend, RenderPlanCache
+from ..profiling import refresh_profile
+from .base import RewriteTestCase
+
+PLAN = [{"render": "kpi", "title": "Total Revenue", "sql": "SELECT 1"}]
+
+
+class NearDuplicateTests(RewriteTestCase):
+    # Prompts that differ only in a filter value or a negation ask for other
+    # rows, so they must not share a cached plan.
+    PAIRS = [
+        (
+            "show total revenue and units by product over date for orders in the north region",
+            "show total revenue and units by product over date for orders in the south region",
+        ),
+        (
+            "show total revenue and units by region over date for orders that are not laptops and not phones",
+            "show total revenue and units by region over date for orders that are laptops and phones",
+        ),
+    ]
+
+    def setUp(self):
+        self.cache = RenderPlanCache(LocMemPlanBackend(100, 3600), similarity_threshold=0.8)
+
+    def test_other_filter_values_and_negations_miss(self):
+        refresh_profile(self.dataset, full=True)
+        for stored, asked in self.PAIRS:
+            self.cache.store(stored, self.dataset, PLAN)
+            self.assertEqual(self.cache.lookup(asked, self.dataset), (None, "miss"), asked)
+            self.assertEqual(self.cache.lookup(stored, self.dataset), (PLAN, "hit"), stored)
+
+    def test_rewordings_of_the_same_filter_hit(self):
+        refresh_profile(self.dataset, full=True)
+        self.cache.store(self.PAIRS[0][0], self.dataset, PLAN)
+        plan, status = self.cache.lookup(
+            "show the total revenue and units by product over date for orders in north region", self.dataset,
+        )
+        self.assertEqual((plan, status), (PLAN, "semantic_hit"))
+
+    def test_datasets_without_a_profile_only_match_exactly(self):
+        stored, asked = self.PAIRS[0]
+        self.cache.store(stored, self.dataset, PLAN)
+        self.assertEqual(self.cache.lookup(asked, self.dataset), (None, "miss"))
@@ -0,0 +1,112 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..executor import execute_block_sql
+from ..models import Dataset, Record
+from ..projection import (
+    build_projection, get_active_projection, refresh_projection, rewrite_for_projection, stale_projections,
+)
+from .base import RewriteTestCase
+
+
+class ProjectionTests(RewriteTestCase):
+    QUERIES = [
+        "SELECT COUNT(*) AS n, SUM((row_data->>'revenue')::numeric) AS total FROM analytics_record WHERE dataset_id = %s",
+        "SELECT row_data->>'region' AS region, AVG((row_data->>'units')::int) AS avg_units, "
+        "SUM((row_data->>'units')::numeric) AS units FROM analytics_record WHERE dataset_id = %s GROUP BY 1 ORDER BY 1",
+        "SELECT (row_data->>'date')::date AS day, SUM((row_data->>'revenue')::float) AS total "
+        "FROM analytics_record WHERE dataset_id = %s GROUP BY 1 ORDER BY 1 LIMIT 5",
+        "SELECT r.row_data->>'order_id' AS order_id, (r.row_data->>'revenue')::numeric AS revenue "
+        "FROM analytics_record r WHERE r.dataset_id = %s AND r.row_data->>'product' = 'Desk' "
+        "ORDER BY 2 DESC, 1 LIMIT 10",
+    ]
+
+    def test_projection_rewrites_match_the_original(self):
+        projection = build_projection(self.dataset)
+        self.assertEqual(projection.error, "")
+        for sql in self.QUERIES:
+            rewritten = rewrite_for_projection(sql, projection)
+            self.assertIsNotNone(rewritten, sql)
+            self.assertSameResult(sql, self.run_sql(rewritten))
+
+    def test_text_of_typed_columns_is_not_rewritten(self):
+        # A bigint column can't give back the record's text ("007", "5 ").
+        projection = build_projection(self.dataset)
+        self.assertIsNone(rewrite_for_projection(
+            "SELECT row_data->>'units' AS units FROM analytics_record WHERE dataset_id = %s", projection,
+        ))
+
+
+class ProjectionRefreshTests(RewriteTestCase):
+    SQL = "SELECT SUM((row_data->>'units')::numeric) AS units FROM analytics_record WHERE dataset_id = %s"
+
+    def write(self, fn):
+        # Runs the writer's on_commit refreshes, as a real commit would.
+        with self.captureOnCommitCallbacks(execute=True):
+            fn()
+        self.dataset.refresh_from_db()
+        return get_active_projection(self.dataset.id, self.dataset.data_version)
+
+    def test_inserts_are_appended(self):
+        build_projection(self.dataset)
+        projection = self.write(lambda: Record.objects.create(dataset=self.dataset, row_data={"units": 5}))
+        self.assertIsNotNone(projection)
+        self.assertSameResult(self.SQL, self.run_sql(rewrite_for_projection(self.SQL, projection)))
+
+    def test_updates_and_deletes_flag_a_rebuild(self):
+        projection = build_projection(self.dataset)
+        records = Record.objects.filter(dataset=self.dataset).order_by("id")
+        for write in [
+            lambda: records.filter(id=records[0].id).update(row_data={"units": 99}),
+            lambda: records.filter(id=records[1].id).delete(),
+        ]:
+            self.assertIsNone(self.write(write))
+            # Appends don't bring a flagged projection back into use.
+            self.assertIsNone(self.write(lambda: Record.objects.create(dataset=self.dataset, row_data={"units": 1})))
+            self.assertEqual([(p.pk, full) for p, full in stale_projections()], [(projection.pk, True)])
+
+            refresh_projection(projection, full=True)
+            projection = get_active_projection(self.dataset.id, self.dataset.data_version)
+            self.assertIsNotNone(projection)
+            self.assertSameResult(self.SQL, self.run_sql(rewrite_for_projection(self.SQL, projection)))
+
+
+class TypedValueTests(TestCase):
+    ROWS = [
+        {"ts": "2024-01-05T23:30:00-05:00", "n": 1},
+        {"ts": "2024-01-05T10:00:00", "n": 2},
+        {"ts": "2024-01-06T08:15:00+00:00", "n": 3},
+    ]
+
+    def setUp(self):
+        self.dataset = Dataset.objects.create(
+            name="Events", description="", created_by=User.objects.create_user("analyst"),
+            metadata={"ts": "timestamp", "n": "integer"},
+        )
+
+    def load(self, rows):
+        Record.objects.bulk_create(Record(dataset=self.dataset, row_data=row) for row in rows)
+        self.dataset.refresh_from_db()
+
+    def test_timestamps_read_back_as_written(self):
+        self.load(self.ROWS)
+        projection = build_projection(self.dataset)
+        for sql in [
+            "SELECT row_data->>'ts' AS ts, COUNT(*) AS n FROM analytics_record WHERE dataset_id = %s GROUP BY 1 ORDER BY 1",
+            "SELECT (row_data->>'ts')::date AS day, SUM((row_data->>'n')::numeric) AS n "
+            "FROM analytics_record WHERE dataset_id = %s GROUP BY 1 ORDER BY 1",
+            "SELECT COUNT(*) AS n FROM analytics_record WHERE dataset_id = %s AND row_data->>'ts' > '2024-01-05T12'",
+        ]:
+            rewritten = rewrite_for_projection(sql, projection)
+            self.assertIsNotNone(rewritten, sql)
+            self.assertEqual(
+                execute_block_sql(rewritten, self.dataset.id)[:2], execute_block_sql(sql, self.dataset.id)[:2], sql,
+            )
+
+    def test_values_that_dont_cast_make_the_projection_unusable(self):
+        # "1.0" would be NULL in a bigint column, dropping out of SUM(...::numeric).
+        self.load([*self.ROWS, {"ts": "2024-01-07T00:00:00", "n": "1.0"}])
+        with self.assertLogs("analytics.projection", "WARNING"):
+            projection = build_projection(self.dataset)
+        self.assertIn("bigint", projection.error)
+        self.assertIsNone(get_active_projection(self.dataset.id, self.dataset.data_version))
@@ -0,0 +1,41 @@
+from django.db import connection
+from django.test import override_settings
+
+from ..executor import execute_block_sql
+from ..partitions import partition_name
+from .base import RewriteTestCase
+
+COUNT = "SELECT COUNT(*) AS n FROM analytics_record WHERE dataset_id = %s"
+CROSS_JOIN = "SELECT COUNT(*) AS n FROM analytics_record a, analytics_record b WHERE a.dataset_id = %s"
+
+
+class QueryGuardTests(RewriteTestCase):
+    def warning(self, sql):
+        return execute_block_sql(sql, self.dataset.id)[2]
+
+    def test_queries_within_the_limits_run(self):
+        self.assertEqual(self.run_sql(COUNT), (["n"], [{"n": 240}]))
+
+    def test_reads_of_other_datasets_are_rejected(self):
+        self.assertEqual(
+            self.warning(CROSS_JOIN),
+            "Query rejected: it reads analytics_record (as b) without filtering on dataset_id.",
+        )
+        with override_settings(QUERY_GUARD_ENABLED=False):
+            self.assertIsNone(self.warning(CROSS_JOIN))
+
+    @override_settings(QUERY_GUARD_MAX_COST=1)
+    def test_plans_over_the_cost_limit_are_rejected(self):
+        self.assertRegex(self.warning(COUNT), r"^Query rejected: its estimated cost [\d,]+ is over the limit of 1\.$")
+
+    @override_settings(QUERY_GUARD_MAX_ROWS=100)
+    def test_plans_over_the_row_limit_are_rejected(self):
+        # Estimates come from the statistics, so the 240 records need to be counted.
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {partition_name(self.dataset.id)}")
+        self.assertRegex(self.warning(COUNT), r"^Query rejected: a .+ step is estimated to produce [\d,]+ rows")
+
+    def test_sql_that_cant_be_planned_fails_with_its_own_error(self):
+        self.assertIn('column "nope" does not exist', self.warning(
+            "SELECT nope FROM analytics_record WHERE dataset_id = %s"
+        ))
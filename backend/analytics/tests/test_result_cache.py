@@ -0,0 +1,33 @@
+from ..executor import run_blocks
+from ..models import Record
+from ..result_cache import get_result_cache
+from .base import RewriteTestCase
+
+COUNT = "SELECT COUNT(*) AS n FROM analytics_record WHERE dataset_id = %s"
+
+
+class ResultCacheTests(RewriteTestCase):
+    def setUp(self):
+        self.cache = get_result_cache()
+        self.cache.clear()
+        self.dataset.refresh_from_db()
+
+    def run_count(self, sql=COUNT):
+        return run_blocks([sql], self.dataset.id, data_version=self.dataset.data_version)[0]
+
+    def test_repeats_are_served_from_the_cache(self):
+        hits = self.cache.stats()["hits"]
+        self.assertEqual(self.run_count(), (["n"], [{"n": 240}], None))
+        # Whitespace outside literals doesn't change the key.
+        self.assertEqual(self.run_count(COUNT.replace(" FROM ", "\n  FROM ")), (["n"], [{"n": 240}], None))
+        self.assertEqual(self.cache.stats()["hits"], hits + 1)
+
+    def test_writes_invalidate_the_dataset(self):
+        self.run_count()
+        version = self.dataset.data_version
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(dataset=self.dataset, row_data={"units": 1})
+        self.dataset.refresh_from_db()
+        self.assertGreater(self.dataset.data_version, version)
+        self.assertIsNone(self.cache.get(COUNT, self.dataset.id, version))
+        self.assertEqual(self.run_count(), (["n"], [{"n": 241}], None))
@@ -0,0 +1,66 @@
+from django.db import connection
+from django.test import override_settings
+
+from ..models import Record
+from ..partitions import partition_name
+from ..sampling import (
+    TableSample, build_sample, get_active_sample, refresh_sample, rewrite_for_sample, stale_samples,
+)
+from .base import RewriteTestCase
+
+
+class SampleTests(RewriteTestCase):
+    # At a sampling rate of 1 the sample holds every record, so scaled
+    # estimates must equal the exact answers and their margins be 0.
+    QUERIES = [
+        "SELECT COUNT(*) AS n, SUM((row_data->>'revenue')::numeric) AS total FROM analytics_record WHERE dataset_id = %s",
+        "SELECT r.row_data->>'region' AS region, COUNT(*) AS n, AVG((r.row_data->>'units')::numeric) AS avg_units "
+        "FROM analytics_record r WHERE r.dataset_id = %s GROUP BY 1 ORDER BY 1",
+    ]
+
+    def assertSameEstimates(self, sql, sample):
+        rewritten = rewrite_for_sample(sql, sample)
+        self.assertIsNotNone(rewritten, sql)
+        columns, data = self.run_sql(rewritten)
+        margins = [column for column in columns if column.endswith("_margin")]
+        self.assertTrue(margins)
+        for row in data:
+            for column in margins:
+                self.assertAlmostEqual(float(row.pop(column) or 0), 0)
+        self.assertSameResult(sql, ([column for column in columns if column not in margins], data))
+
+    @override_settings(APPROX_SAMPLE_ROWS=100000)
+    def test_sample_table_rewrites_match_the_original(self):
+        sample = build_sample(self.dataset)
+        self.assertEqual(sample.sample_rows, sample.population_rows)
+        for sql in self.QUERIES:
+            self.assertSameEstimates(sql, sample)
+
+    def test_tablesample_rewrites_match_the_original(self):
+        sample = TableSample(Record.objects.filter(dataset=self.dataset).count(), 1.0)
+        for sql in self.QUERIES:
+            self.assertSameEstimates(sql, sample)
+
+    @override_settings(APPROX_SAMPLE_ROWS=100000, APPROX_MIN_ROWS=1, APPROX_TABLESAMPLE_FALLBACK=True)
+    def test_updates_and_deletes_defer_the_redraw(self):
+        # Only appends are sampled in as they commit; after an update or
+        # delete queries use a TABLESAMPLE until `build_sample --stale`.
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {partition_name(self.dataset.id)}")
+        sample = build_sample(self.dataset)
+        records = Record.objects.filter(dataset=self.dataset).order_by("id")
+        for write in [
+            lambda: records.filter(id=records[0].id).update(row_data={"region": "North", "units": 99}),
+            lambda: records.filter(id=records[1].id).delete(),
+        ]:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.dataset.refresh_from_db()
+            self.assertIsInstance(get_active_sample(self.dataset.id, self.dataset.data_version), TableSample)
+            self.assertEqual([(s.pk, full) for s, full in stale_samples()], [(sample.pk, True)])
+
+            refresh_sample(sample, full=True)
+            active = get_active_sample(self.dataset.id, self.dataset.data_version)
+            self.assertEqual(active, sample)
+            for sql in self.QUERIES:
+                self.assertSameEstimates(sql, active)
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from ..models import Record, SavedVisualization, VisualizationSnapshot
+from .base import RewriteTestCase
+
+PLAN = [
+    {
+        "render": "kpi", "title": "Units",
+        "sql": "SELECT SUM((row_data->>'units')::numeric) AS units FROM analytics_record WHERE dataset_id = %s",
+    },
+    {
+        "render": "table", "title": "Orders",
+        "sql": "SELECT row_data->>'order_id' AS order_id FROM analytics_record WHERE dataset_id = %s",
+    },
+]
+
+
+# Replays must never reach the LLM. Blocks run inline, on the test
+# transaction that holds the fixture.
+@mock.patch("analytics.llm_service.analyze_prompt_with_llm", side_effect=AssertionError("LLM called"))
+@override_settings(TABLE_PAGE_SIZE=100, BLOCK_EXECUTOR_MAX_WORKERS=1)
+class SnapshotReplayTests(RewriteTestCase):
+    def setUp(self):
+        self.dataset.refresh_from_db()
+        self.visualization = SavedVisualization.objects.create(
+            user=self.user, prompt="units and orders", render_plan=PLAN, dataset=self.dataset,
+        )
+        self.url = f"/api/saved-visualizations/{self.visualization.id}/"
+
+    def units(self):
+        return self.run_sql(PLAN[0]["sql"])[1][0]["units"]
+
+    def test_replays_the_plan_and_serves_the_snapshot_until_the_data_changes(self, llm):
+        first = self.client.get(self.url).json()
+        self.assertTrue(first["snapshot"]["refreshed"])
+        self.assertEqual(first["snapshot"]["data_version"], self.dataset.data_version)
+        kpi, table = first["blocks"]
+        self.assertEqual(kpi["title"], "Units")
+        self.assertEqual(float(kpi["value"]), self.units())
+        self.assertEqual(len(table["data"]), 100)
+
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url).json()
+        self.assertFalse(second["snapshot"]["refreshed"])
+        self.assertEqual(second["blocks"][0], kpi)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(dataset=self.dataset, row_data={"order_id": "ORD-99999", "units": 1000})
+        third = self.client.get(self.url).json()
+        self.assertTrue(third["snapshot"]["refreshed"])
+        self.assertGreater(third["snapshot"]["data_version"], first["snapshot"]["data_version"])
+        self.assertEqual(float(third["blocks"][0]["value"]), self.units())
+
+    def test_table_cursors_are_minted_when_served(self, llm):
+        table = self.client.get(self.url).json()["blocks"][1]
+        stored = VisualizationSnapshot.objects.get(visualization=self.visualization).blocks[1]
+        # Cursors expire, so the snapshot keeps the page they point at instead.
+        self.assertIsNone(stored["next_cursor"])
+        self.assertEqual(stored["next_page"]["mode"], "keyset")
+        self.assertIsNotNone(table["next_cursor"])
+        response = self.client.get("/api/blocks/page/", {"cursor": table["next_cursor"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]), 100)
+
+    def test_visualizations_without_a_dataset_conflict(self, llm):
+        visualization = SavedVisualization.objects.create(user=self.user, prompt="legacy", render_plan=PLAN)
+        response = self.client.get(f"/api/saved-visualizations/{visualization.id}/")
+        self.assertEqual(response.status_code, 409)
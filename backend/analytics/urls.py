@@ -3,7 +3,24 @@ from . import views
 
 urlpatterns = [
     path('datasets/', views.get_datasets, name='get_datasets'),
+    path('datasets/ingest/', views.ingest_new_dataset, name='ingest_new_dataset'),
+    path('datasets/<int:id>/ingest/', views.ingest_dataset, name='ingest_dataset'),
     path('datasets/<int:id>/sample/', views.get_dataset_sample, name='get_dataset_sample'),
+    path('datasets/<int:id>/profile/', views.get_dataset_profile, name='get_dataset_profile'),
     path('ask/', views.ask_dataset, name='ask_dataset'),
+    path('ask/stream/', views.ask_dataset_stream, name='ask_dataset_stream'),
+    path('ask/jobs/', views.submit_ask_job, name='submit_ask_job'),
+    path('ask/jobs/<int:id>/', views.get_ask_job, name='get_ask_job'),
+    path('ask/jobs/<int:id>/cancel/', views.cancel_ask_job, name='cancel_ask_job'),
+    path('blocks/page/', views.get_table_page, name='get_table_page'),
+    path('plan-cache/stats/', views.plan_cache_stats, name='plan_cache_stats'),
+    path('intents/stats/', views.intent_match_stats, name='intent_stats'),
+    path('result-cache/stats/', views.result_cache_stats, name='result_cache_stats'),
+    path('llm/stats/', views.llm_stats, name='llm_stats'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('traces/', views.list_traces, name='list_traces'),
+    path('traces/<str:trace_id>/', views.get_trace, name='get_trace'),
     path('saved-visualizations/', views.save_visualization, name='save_visualization'),
+    path('saved-visualizations/<int:id>/', views.get_saved_visualization, name='get_saved_visualization'),
+    path('saved-visualizations/<int:id>/refresh/', views.refresh_saved_visualization, name='refresh_saved_visualization'),
 ]
\ No newline at end of file
@@ -1,76 +1,162 @@
 # backend/analytics/views.py
 import json
-import re
-import decimal
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.db import DataError, IntegrityError
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db import connection
-
-from .serializers import DatasetSerializer, SavedVisualizationSerializer
-from .models import Dataset, Record, SavedVisualization
-from .llm_service import analyze_prompt_with_llm
-
-ROW_LIMIT = 500
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.contrib.auth.models import User
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .serializers import SavedVisualizationSerializer
+from .models import AskJob, Dataset, DatasetProfile, Record, SavedVisualization
+from .dashboard import build_dashboard, dump_event, get_render_plan, remember_render_plan, stream_dashboard
+from .plan_cache import get_plan_cache
+from .intents import intent_stats
+from .llm_client import get_llm_client
+from .prompt_builder import prompt_stats
+from .profiling import get_profile, profile_is_stale
+from .pagination import CursorConflict, CursorError, fetch_page
+from .renderers import result_renderers
+from .ingestion import IngestionError, detect_format, ingest_rows, read_rows
+from .result_cache import get_result_cache
+from .snapshots import ReplayError, current_snapshot, refresh_snapshot, snapshot_blocks
+from .instrumentation import get_trace_store, metrics
+from .jobs import QueueFull, cancel_job, enqueue_job, job_payload, wait_for_change
+from .catalog import (
+    CatalogError, catalog_etag, catalog_page, catalog_state, get_snapshot, parse_fields, parse_limit, read_cursor,
+)
 
+@api_view(['GET'])
+def get_datasets(request):
+    # Paged dataset catalog, served from the cached snapshot. Supports
+    # ?fields=id,name, ?limit= and ?cursor=, and answers conditional GETs with
+    # 304 while the catalog hasn't changed.
+    try:
+        fields = parse_fields(request.query_params.get("fields"))
+        limit = parse_limit(request.query_params.get("limit"))
+        after_id = read_cursor(request.query_params.get("cursor"))
+    except CatalogError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    state = catalog_state()
+    etag = catalog_etag(state.version, after_id, limit, fields)
+    last_modified = int(state.updated_at.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    results, next_cursor = catalog_page(get_snapshot(state), after_id, limit, fields)
+    response = Response({"results": results, "next_cursor": next_cursor, "version": state.version})
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # Clients may keep the catalog but must revalidate it on every use.
+    patch_cache_control(response, no_cache=True)
+    return response
 
-def serialize_row(columns, row):
-    result = {}
-    for i, v in enumerate(row):
-        if isinstance(v, decimal.Decimal):
-            result[columns[i]] = float(v)
-        else:
-            result[columns[i]] = v
-    return result
 
+@api_view(['GET'])
+def get_dataset_sample(request, id):
+    dataset = get_object_or_404(Dataset, id=id)
+    profile = get_profile(dataset)
+    if profile is not None:
+        sample_data = profile.sample_rows[:5]
+    else:
+        records = Record.objects.filter(dataset=dataset)[:5]
+        sample_data = [record.row_data for record in records]
+    return Response({
+        "dataset_id": dataset.id,
+        "dataset_name": dataset.name,
+        "sample": sample_data
+    })
 
-def enforce_row_limit(sql):
-    sql_stripped = sql.rstrip().rstrip(";").rstrip()
-    upper = sql_stripped.upper()
-    if "LIMIT" not in upper:
-        return f"{sql_stripped} LIMIT {ROW_LIMIT}"
-    return sql_stripped
 
+@api_view(['GET'])
+def get_dataset_profile(request, id):
+    dataset = get_object_or_404(Dataset, id=id)
+    profile = get_profile(dataset)
+    if profile is None:
+        return Response(
+            {"error": "The dataset hasn't been profiled yet; run `manage.py profile_dataset --stale`."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    if request.query_params.get("refresh"):
+        # Scanning is left to `profile_dataset --stale`; this only queues it.
+        DatasetProfile.objects.filter(pk=profile.pk).update(needs_rescan=True)
+        profile.needs_rescan = True
+    return Response({
+        "dataset_id": dataset.id,
+        "dataset_name": dataset.name,
+        "row_count": profile.row_count,
+        "data_version": profile.data_version,
+        "stale": profile_is_stale(profile, dataset),
+        "computed_at": profile.computed_at,
+        "fields": profile.fields,
+    })
 
-def execute_block_sql(raw_sql, dataset_id):
-    if not raw_sql.upper().startswith("SELECT"):
-        return None, None, "Query rejected: only SELECT statements are permitted."
 
-    secured_sql = enforce_row_limit(raw_sql)
+def _ingest_upload(request, dataset=None):
+    upload = request.FILES.get("file")
+    if upload is None:
+        return Response({"error": "A 'file' upload is required."}, status=status.HTTP_400_BAD_REQUEST)
 
+    metadata = request.data.get("metadata")
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(secured_sql, [dataset_id])
-            columns = [col[0] for col in cursor.description]
-            rows = cursor.fetchmany(ROW_LIMIT)
-            data = [serialize_row(columns, row) for row in rows]
-        return columns, data, None
-    except Exception as e:
-        return None, None, f"SQL execution error: {str(e)}"
+        max_errors = int(request.data.get("max_errors", 0))
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        fmt = detect_format(upload.name, request.data.get("format"))
+        stats = ingest_rows(
+            read_rows(upload, fmt, settings.INGEST_BATCH_SIZE),
+            dataset=dataset,
+            name=request.data.get("name") or upload.name,
+            description=request.data.get("description", ""),
+            owner=request.user if request.user.is_authenticated else User.objects.get_or_create(username="admin")[0],
+            metadata=metadata,
+            max_errors=max_errors,
+        )
+    except (IngestionError, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except (DataError, IntegrityError) as e:
+        # E.g. a name or description the dataset's columns don't take.
+        return Response({"error": str(e).strip().splitlines()[0]}, status=status.HTTP_400_BAD_REQUEST)
 
+    return Response(stats, status=status.HTTP_201_CREATED)
 
-@api_view(['GET'])
-def get_datasets(request):
-    datasets = Dataset.objects.all()
-    serializer = DatasetSerializer(datasets, many=True)
-    return Response(serializer.data)
 
+@api_view(['POST'])
+def ingest_new_dataset(request):
+    return _ingest_upload(request)
 
-@api_view(['GET'])
-def get_dataset_sample(request, id):
+
+@api_view(['POST'])
+def ingest_dataset(request, id):
     dataset = get_object_or_404(Dataset, id=id)
-    records = Record.objects.filter(dataset=dataset)[:5]
-    sample_data = [record.row_data for record in records]
-    return Response({
-        "dataset_id": dataset.id,
-        "dataset_name": dataset.name,
-        "sample": sample_data
-    })
+    return _ingest_upload(request, dataset=dataset)
+
+
+def _flag(value, default=False):
+    # JSON booleans, or "true"/"1"/"yes" from form data.
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "1", "yes", "on")
+
+
+def _approximation_flags(data):
+    approximate = _flag(data.get("approximate"))
+    return approximate, approximate and _flag(data.get("refine"), settings.APPROX_REFINE_IN_BACKGROUND)
 
 
 @api_view(['POST'])
+@renderer_classes(result_renderers())
 def ask_dataset(request):
     prompt = request.data.get("prompt")
     dataset_id = request.data.get("dataset_id")
@@ -82,28 +168,9 @@ def ask_dataset(request):
         )
 
     dataset = get_object_or_404(Dataset, id=dataset_id)
-    records = dataset.records.all()[:5]
-    sample_rows = [record.row_data for record in records]
 
     try:
-        raw_llm_output = analyze_prompt_with_llm(
-            prompt=prompt,
-            schema=dataset.metadata,
-            sample_rows=sample_rows
-        )
-
-        try:
-            parsed_blocks = json.loads(raw_llm_output)
-        except json.JSONDecodeError:
-            cleaned = re.sub(r"```json|```", "", raw_llm_output).strip()
-            parsed_blocks = json.loads(cleaned)
-
-        if not isinstance(parsed_blocks, list):
-            return Response(
-                {"error": "AI returned an unexpected format (expected a JSON array of blocks)."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
+        parsed_blocks, plan_cache_status = get_render_plan(prompt, dataset)
     except json.JSONDecodeError:
         return Response(
             {"error": "AI returned unparseable JSON."},
@@ -115,91 +182,230 @@ def ask_dataset(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-    assembled_blocks = []
-    warnings = []
-
-    for i, block in enumerate(parsed_blocks):
-        render_type = block.get("render")
-        title = block.get("title", f"Block {i + 1}")
-        raw_sql = (block.get("sql") or "").strip()
-
-        # --- KPI block ---
-        if render_type == "kpi":
-            columns, data, warning = execute_block_sql(raw_sql, dataset_id)
-            if warning:
-                warnings.append(f"Block '{title}': {warning}")
-                assembled_blocks.append({
-                    "render": "kpi",
-                    "title": title,
-                    "error": warning,
-                })
-            else:
-                # KPI: first column of first row is the value
-                value = data[0][columns[0]] if data else None
-                assembled_blocks.append({
-                    "render": "kpi",
-                    "title": title,
-                    "value": value,
-                    "value_label": columns[0] if columns else None,
-                })
-
-        # --- Chart block ---
-        elif render_type == "chart":
-            columns, data, warning = execute_block_sql(raw_sql, dataset_id)
-            if warning:
-                warnings.append(f"Block '{title}': {warning}")
-                assembled_blocks.append({
-                    "render": "chart",
-                    "title": title,
-                    "error": warning,
-                })
-            else:
-                assembled_blocks.append({
-                    "render": "chart",
-                    "title": title,
-                    "chart_type": block.get("chart_type"),
-                    "x_axis": block.get("x_axis"),
-                    "y_axis": block.get("y_axis"),
-                    "data": data,
-                    "columns": columns,
-                })
-
-        # --- Table block ---
-        elif render_type == "table":
-            columns, data, warning = execute_block_sql(raw_sql, dataset_id)
-            if warning:
-                warnings.append(f"Block '{title}': {warning}")
-                assembled_blocks.append({
-                    "render": "table",
-                    "title": title,
-                    "error": warning,
-                })
-            else:
-                assembled_blocks.append({
-                    "render": "table",
-                    "title": title,
-                    "data": data,
-                    "columns": columns,
-                })
-
-        # --- Unknown render type ---
-        else:
-            warning = f"Block '{title}': unknown render type '{render_type}' — skipped."
-            warnings.append(warning)
+    approximate, refine = _approximation_flags(request.data)
+    assembled_blocks, warnings = build_dashboard(parsed_blocks, dataset, approximate=approximate, refine=refine)
+    remember_render_plan(prompt, dataset, parsed_blocks, plan_cache_status, assembled_blocks)
+    approximated = any(block.get("approximate") for block in assembled_blocks)
 
     final_response = {
         "type": "dashboard_response",
+        "plan_cache": plan_cache_status,
         "warnings": warnings,
         "blocks": assembled_blocks,
+        "approximate": approximated,
+        "refining": refine and approximated,
     }
 
     return Response(final_response, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+def submit_ask_job(request):
+    # Queues the ask for the worker processes and returns the job at once;
+    # poll (or long-poll) GET /api/ask/jobs/<id>/ for its blocks.
+    prompt = request.data.get("prompt")
+    dataset_id = request.data.get("dataset_id")
+    if not prompt or not dataset_id:
+        return Response(
+            {"error": "Both 'prompt' and 'dataset_id' are required."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    dataset = get_object_or_404(Dataset, id=dataset_id)
+    approximate, refine = _approximation_flags(request.data)
+    try:
+        job = enqueue_job(dataset, prompt, approximate=approximate, refine=refine)
+    except QueueFull as e:
+        return Response(
+            {"error": str(e)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(settings.ASK_JOB_POLL_SECONDS)},
+        )
+    return Response(job_payload(job), status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+async def get_ask_job(request, id):
+    # With ?since=<revision>&wait=<seconds>, holds the request until the job
+    # has moved past that revision (or finished) or the wait is over.
+    try:
+        since = request.GET.get("since")
+        since = int(since) if since not in (None, "") else None
+        wait = min(max(float(request.GET.get("wait") or 0), 0), settings.ASK_JOB_LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        return JsonResponse({"error": "'since' must be an integer and 'wait' a number of seconds."}, status=400)
+
+    job = await wait_for_change(id, since, wait)
+    if job is None:
+        return JsonResponse({"error": "No AskJob matches the given query."}, status=404)
+    response = JsonResponse(job_payload(job))
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@api_view(['POST'])
+def cancel_ask_job(request, id):
+    job = get_object_or_404(AskJob, id=id)
+    cancelled = cancel_job(job.id)
+    job.refresh_from_db()
+    return Response(job_payload(job), status=status.HTTP_200_OK if cancelled else status.HTTP_409_CONFLICT)
+
+
+@csrf_exempt
+@require_POST
+async def ask_dataset_stream(request):
+    # Async counterpart of ask_dataset that streams each block as soon as its
+    # query finishes, as NDJSON or (with Accept: text/event-stream) SSE.
+    try:
+        body = json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Request body must be JSON."}, status=400)
+
+    prompt = body.get("prompt")
+    dataset_id = body.get("dataset_id")
+    if not prompt or not dataset_id:
+        return JsonResponse({"error": "Both 'prompt' and 'dataset_id' are required."}, status=400)
+
+    dataset = await Dataset.objects.filter(id=dataset_id).afirst()
+    if dataset is None:
+        return JsonResponse({"error": "No Dataset matches the given query."}, status=404)
+
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+    approximate, refine = _approximation_flags(body)
+
+    async def events():
+        async for event in stream_dashboard(prompt, dataset, approximate=approximate, refine=refine):
+            payload = dump_event(event)
+            yield f"event: {event['type']}\ndata: {payload}\n\n" if use_sse else f"{payload}\n"
+
+    response = StreamingHttpResponse(
+        events(),
+        content_type="text/event-stream" if use_sse else "application/x-ndjson",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@api_view(['GET'])
+@renderer_classes(result_renderers(tabular=True))
+def get_table_page(request):
+    # Next page of a table block, from the cursor returned with the block.
+    token = request.query_params.get("cursor")
+    if not token:
+        return Response({"error": "A 'cursor' is required."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        columns, data, warning, next_cursor = fetch_page(token)
+    except CursorConflict as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+    except CursorError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if warning:
+        return Response({"error": warning}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response({"columns": columns, "data": data, "next_cursor": next_cursor})
+
+
+@api_view(['GET'])
+def plan_cache_stats(request):
+    return Response(get_plan_cache().stats())
+
+
+@api_view(['GET'])
+def result_cache_stats(request):
+    return Response(get_result_cache().stats())
+
+
+@api_view(['GET'])
+def intent_match_stats(request):
+    return Response(intent_stats())
+
+
+@api_view(['GET'])
+def llm_stats(request):
+    return Response({**get_llm_client().stats(), "prompts": prompt_stats()})
+
+
+def _stat_gauges(prefix, stats):
+    return {
+        f"datasage_{prefix}_{key}": value for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+def metrics_view(request):
+    # Prometheus scrape endpoint: request/stage timing histograms and counters,
+    # plus the cache and LLM client stats as gauges.
+    gauges = {
+        **_stat_gauges("plan_cache", get_plan_cache().stats()),
+        **_stat_gauges("intent", intent_stats()),
+        **_stat_gauges("result_cache", get_result_cache().stats()),
+        **_stat_gauges("llm", get_llm_client().stats()),
+        **_stat_gauges("prompt", prompt_stats()),
+    }
+    return HttpResponse(metrics.render(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api_view(['GET'])
+def list_traces(request):
+    return Response([trace.as_dict(spans=False) for trace in get_trace_store().recent()])
+
+
+@api_view(['GET'])
+def get_trace(request, trace_id):
+    trace = get_trace_store().get(trace_id)
+    if trace is None:
+        return Response({"error": "Unknown or expired trace."}, status=status.HTTP_404_NOT_FOUND)
+    return Response(trace.as_dict())
+
+
 @api_view(['POST'])
 def save_visualization(request):
     serializer = SavedVisualizationSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        serializer.save(
+            user=request.user if request.user.is_authenticated else User.objects.get_or_create(username="admin")[0],
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _snapshot_response(visualization, snapshot, refreshed):
+    return Response({
+        "type": "dashboard_response",
+        "visualization_id": visualization.id,
+        "prompt": visualization.prompt,
+        "snapshot": {
+            "computed_at": snapshot.computed_at,
+            "data_version": snapshot.data_version,
+            "duration_ms": snapshot.duration_ms,
+            "refreshed": refreshed,
+        },
+        "warnings": snapshot.warnings,
+        "blocks": snapshot_blocks(snapshot, visualization.dataset_id),
+    })
+
+
+@api_view(['GET'])
+@renderer_classes(result_renderers())
+def get_saved_visualization(request, id):
+    # Serves the stored snapshot while the dataset is unchanged; otherwise
+    # replays the saved render plan (no LLM call) and stores the result.
+    visualization = get_object_or_404(
+        SavedVisualization.objects.select_related("dataset", "snapshot"), id=id,
+    )
+    try:
+        snapshot, refreshed = current_snapshot(visualization)
+    except ReplayError as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+    return _snapshot_response(visualization, snapshot, refreshed)
+
+
+@api_view(['POST'])
+@renderer_classes(result_renderers())
+def refresh_saved_visualization(request, id):
+    visualization = get_object_or_404(SavedVisualization.objects.select_related("dataset"), id=id)
+    try:
+        snapshot = refresh_snapshot(visualization)
+    except ReplayError as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+    return _snapshot_response(visualization, snapshot, True)
\ No newline at end of file
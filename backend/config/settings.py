@@ -29,6 +29,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'analytics.middleware.TimingMiddleware',
+    'analytics.middleware.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +77,152 @@ else:
         }
     }
 
+# Dashboard blocks run concurrently on a bounded pool; each pool thread holds
+# at most one database connection.
+BLOCK_EXECUTOR_MAX_WORKERS = int(os.getenv('BLOCK_EXECUTOR_MAX_WORKERS', '4'))
+BLOCK_STATEMENT_TIMEOUT_MS = int(os.getenv('BLOCK_STATEMENT_TIMEOUT_MS', '15000'))
+BLOCK_EXECUTOR_QUEUE_GRACE_SECONDS = float(os.getenv('BLOCK_EXECUTOR_QUEUE_GRACE_SECONDS', '5'))
+# Aggregate blocks over the same rows of a dataset run as one GROUPING SETS
+# query instead of a scan each.
+BLOCK_FUSION_ENABLED = os.getenv('BLOCK_FUSION_ENABLED', 'True') == 'True'
+
+# Admission control: before a block query runs, its EXPLAIN estimate is
+# checked and plans over these limits (or that read every dataset's records)
+# are rejected with the reason.
+QUERY_GUARD_ENABLED = os.getenv('QUERY_GUARD_ENABLED', 'True') == 'True'
+QUERY_GUARD_MAX_COST = float(os.getenv('QUERY_GUARD_MAX_COST', '10000000'))
+QUERY_GUARD_MAX_ROWS = int(os.getenv('QUERY_GUARD_MAX_ROWS', '100000000'))
+
+# Instrumentation: per-stage timings go out as Server-Timing headers and are
+# aggregated at /api/metrics/ (Prometheus text format). Requests sent with
+# "X-Trace: 1" (or all, with TRACE_ALL_REQUESTS) keep their trace for
+# /api/traces/. Block queries slower than SLOW_QUERY_MS are logged to the
+# "analytics.slow_query" logger.
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'True') == 'True'
+TRACE_ALL_REQUESTS = os.getenv('TRACE_ALL_REQUESTS', 'False') == 'True'
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '200'))
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '1000'))
+
+# Simple asks ("total revenue", "average salary by region") are answered by a
+# local intent matcher over the dataset's fields, without calling the LLM.
+INTENT_MATCHING_ENABLED = os.getenv('INTENT_MATCHING_ENABLED', 'True') == 'True'
+
+# LLM render plans are cached per (normalized prompt, dataset, schema, model).
+# Backends: 'locmem' (per process), 'django' (CACHES alias), 'database', 'none'.
+PLAN_CACHE_BACKEND = os.getenv('PLAN_CACHE_BACKEND', 'locmem')
+PLAN_CACHE_DJANGO_ALIAS = os.getenv('PLAN_CACHE_DJANGO_ALIAS', 'default')
+PLAN_CACHE_TTL_SECONDS = int(os.getenv('PLAN_CACHE_TTL_SECONDS', '86400'))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv('PLAN_CACHE_MAX_ENTRIES', '1000'))
+# Word-overlap threshold for near-duplicate prompt matching; 0 disables it.
+# Field names, numbers, negations and (once the dataset is profiled) its
+# categorical values must still match exactly.
+PLAN_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('PLAN_CACHE_SIMILARITY_THRESHOLD', '0.8'))
+
+# Block query results are cached per (normalized SQL, dataset, data_version),
+# bounded by entry count and total rows held.
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '512'))
+RESULT_CACHE_MAX_ROWS = int(os.getenv('RESULT_CACHE_MAX_ROWS', '200000'))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL_SECONDS', '0'))
+
+# Table blocks return pages of this many rows (capped at the executor's row
+# limit) with a signed cursor for the next page; cursors expire after a while.
+TABLE_PAGE_SIZE = int(os.getenv('TABLE_PAGE_SIZE', '500'))
+TABLE_CURSOR_MAX_AGE_SECONDS = int(os.getenv('TABLE_CURSOR_MAX_AGE_SECONDS', '3600'))
+
+# Ask jobs (POST /api/ask/jobs/): asks queued in the database and run by
+# `manage.py run_ask_workers` processes, which wake on NOTIFY or every
+# ASK_JOB_POLL_SECONDS. ASK_JOB_MAX_RUNNING caps jobs running at once across
+# all workers (0: one per worker process), which bounds concurrent LLM calls.
+# Jobs whose worker stops heartbeating for ASK_JOB_STALE_SECONDS are retried.
+ASK_JOB_WORKERS = int(os.getenv('ASK_JOB_WORKERS', '2'))
+ASK_JOB_MAX_RUNNING = int(os.getenv('ASK_JOB_MAX_RUNNING', '0'))
+ASK_JOB_MAX_QUEUED = int(os.getenv('ASK_JOB_MAX_QUEUED', '1000'))
+ASK_JOB_POLL_SECONDS = int(os.getenv('ASK_JOB_POLL_SECONDS', '5'))
+ASK_JOB_STALE_SECONDS = int(os.getenv('ASK_JOB_STALE_SECONDS', '120'))
+ASK_JOB_MAX_ATTEMPTS = int(os.getenv('ASK_JOB_MAX_ATTEMPTS', '2'))
+ASK_JOB_LONG_POLL_MAX_SECONDS = int(os.getenv('ASK_JOB_LONG_POLL_MAX_SECONDS', '30'))
+ASK_JOB_RETENTION_HOURS = int(os.getenv('ASK_JOB_RETENTION_HOURS', '24'))
+
+# The dataset catalog (GET /api/datasets/) is paged by cursor, this many
+# datasets per page by default (?limit= up to CATALOG_MAX_PAGE_SIZE).
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '100'))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', '1000'))
+
+# API responses at least this large are brotli/gzip compressed when the client
+# accepts it (see analytics.middleware.CompressionMiddleware).
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+
+# Typed per-dataset projections (see `manage.py build_projection`): refresh them
+# when records change, and rewrite block SQL to read them when up to date.
+PROJECTION_AUTO_REFRESH = os.getenv('PROJECTION_AUTO_REFRESH', 'True') == 'True'
+PROJECTION_QUERY_REWRITE = os.getenv('PROJECTION_QUERY_REWRITE', 'True') == 'True'
+
+# Rollup cubes (see `manage.py build_rollup`): keep them up to date as records
+# change and answer matching aggregate block SQL from them. Categorical fields
+# with more distinct values than this are not cube dimensions.
+ROLLUP_AUTO_REFRESH = os.getenv('ROLLUP_AUTO_REFRESH', 'True') == 'True'
+ROLLUP_QUERY_REWRITE = os.getenv('ROLLUP_QUERY_REWRITE', 'True') == 'True'
+ROLLUP_MAX_DIMENSION_VALUES = int(os.getenv('ROLLUP_MAX_DIMENSION_VALUES', '1000'))
+
+# Approximate answers (see `manage.py build_sample`): ask requests with
+# "approximate": true estimate KPI and chart blocks from a uniform sample of
+# about APPROX_SAMPLE_ROWS records, for datasets of at least APPROX_MIN_ROWS.
+# Datasets without a built sample are read through TABLESAMPLE meanwhile.
+APPROX_SAMPLE_ROWS = int(os.getenv('APPROX_SAMPLE_ROWS', '100000'))
+APPROX_MIN_ROWS = int(os.getenv('APPROX_MIN_ROWS', '500000'))
+APPROX_TABLESAMPLE_FALLBACK = os.getenv('APPROX_TABLESAMPLE_FALLBACK', 'True') == 'True'
+APPROX_AUTO_REFRESH = os.getenv('APPROX_AUTO_REFRESH', 'True') == 'True'
+APPROX_REFINE_IN_BACKGROUND = os.getenv('APPROX_REFINE_IN_BACKGROUND', 'False') == 'True'
+
+# Index advisor (see `manage.py advise_indexes`): track which fields block SQL
+# filters/groups/sorts on and recommend per-dataset indexes for them.
+INDEX_ADVISOR_TRACK_USAGE = os.getenv('INDEX_ADVISOR_TRACK_USAGE', 'True') == 'True'
+INDEX_ADVISOR_MIN_HITS = int(os.getenv('INDEX_ADVISOR_MIN_HITS', '5'))
+INDEX_ADVISOR_MIN_ROWS = int(os.getenv('INDEX_ADVISOR_MIN_ROWS', '10000'))
+INDEX_ADVISOR_UNUSED_DAYS = int(os.getenv('INDEX_ADVISOR_UNUSED_DAYS', '30'))
+
+# Bulk ingestion streams uploads into PostgreSQL COPY in batches of this size.
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '10000'))
+
+# LLM client: pooled keep-alive HTTP session, retries with jittered backoff on
+# 429/5xx, a circuit breaker, and coalescing of identical in-flight requests.
+# LLM_BACKEND=stub answers locally from the dataset schema (tests, benchmarks).
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'huggingface')
+LLM_API_URL = os.getenv('LLM_API_URL', 'https://router.huggingface.co/v1/chat/completions')
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))
+LLM_POOL_MAXSIZE = int(os.getenv('LLM_POOL_MAXSIZE', '10'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '0.5'))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', '8'))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', '30'))
+LLM_STUB_LATENCY_MS = int(os.getenv('LLM_STUB_LATENCY_MS', '0'))
+
+# Dataset profiles (see `manage.py profile_dataset`): per-field stats read by
+# prompts, the index advisor and the API. Appends of up to
+# PROFILE_INLINE_MAX_ROWS records are merged in as they commit; anything
+# bigger, and every update or delete, waits for `profile_dataset --stale`.
+PROFILE_AUTO_REFRESH = os.getenv('PROFILE_AUTO_REFRESH', 'True') == 'True'
+PROFILE_INLINE_MAX_ROWS = int(os.getenv('PROFILE_INLINE_MAX_ROWS', '100000'))
+PROFILE_TOP_K = int(os.getenv('PROFILE_TOP_K', '10'))
+PROFILE_TOP_K_CAPACITY = int(os.getenv('PROFILE_TOP_K_CAPACITY', '100'))
+PROFILE_HISTOGRAM_BINS = int(os.getenv('PROFILE_HISTOGRAM_BINS', '20'))
+PROFILE_RESERVOIR_SIZE = int(os.getenv('PROFILE_RESERVOIR_SIZE', '1024'))
+PROFILE_SAMPLE_ROWS = int(os.getenv('PROFILE_SAMPLE_ROWS', '5'))
+PROFILE_CHUNK_SIZE = int(os.getenv('PROFILE_CHUNK_SIZE', '5000'))
+
+# LLM prompts: compact per-field stats instead of raw rows, trimmed to fit an
+# estimated token budget (see `manage.py prompt_report`).
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1500'))
+PROMPT_SAMPLE_ROWS = int(os.getenv('PROMPT_SAMPLE_ROWS', '2'))
+PROMPT_MAX_CATEGORIES = int(os.getenv('PROMPT_MAX_CATEGORIES', '12'))
+
+# Chart blocks: line charts (and date axes) beyond CHART_MAX_POINTS are
+# downsampled/time-bucketed, pie and bar charts keep CHART_MAX_CATEGORIES
+# slices including "Other" (see analytics.charts).
+CHART_MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', '200'))
+CHART_MAX_CATEGORIES = int(os.getenv('CHART_MAX_CATEGORIES', '8'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -106,3 +254,4 @@ if FRONTEND_URL:
     ]
 else:
     CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ["Server-Timing", "X-Trace-Id"]
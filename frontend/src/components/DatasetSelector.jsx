@@ -52,8 +52,14 @@ function DatasetSelector({ onSelect }) {
   const [datasets, setDatasets] = useState([])
 
   useEffect(() => {
-    api.get('datasets/')
-      .then(res => setDatasets(res.data))
+    // The catalog is paged; only ids and names are needed here.
+    const loadPage = async (cursor, loaded) => {
+      const res = await api.get('datasets/', { params: { fields: 'id,name', limit: 1000, cursor } })
+      const all = loaded.concat(res.data.results)
+      return res.data.next_cursor ? loadPage(res.data.next_cursor, all) : all
+    }
+    loadPage(undefined, [])
+      .then(setDatasets)
       .catch(err => console.error('Failed to load datasets:', err))
   }, [])
 
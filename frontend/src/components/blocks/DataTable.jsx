@@ -1,4 +1,6 @@
+import { useState } from 'react'
 import styled, { keyframes } from 'styled-components'
+import api from '../../services/api'
 
 const fadeUp = keyframes`
   from { opacity: 0; transform: translateY(10px); }
@@ -59,6 +61,21 @@ const Tr = styled.tr`
   &:hover { background: rgba(100, 255, 218, 0.03); }
 `
 
+const LoadMore = styled.button`
+  margin-top: 16px;
+  background: transparent;
+  border: 1px solid #1e2a3a;
+  border-radius: 6px;
+  color: #64ffda;
+  font-family: 'Space Mono', monospace;
+  font-size: 11px;
+  letter-spacing: 0.08em;
+  padding: 8px 14px;
+  cursor: pointer;
+  &:hover { border-color: #64ffda; }
+  &:disabled { opacity: 0.5; cursor: default; }
+`
+
 function formatCell(value) {
   if (typeof value === 'number' && !Number.isInteger(value)) {
     return parseFloat(value.toFixed(2))
@@ -68,9 +85,24 @@ function formatCell(value) {
 
 function DataTable({ block }) {
   const columns = block.columns || []
-  const data = block.data || []
-  const truncated = data.slice(0, 500)
-  const isTruncated = data.length > 500
+  const [data, setData] = useState(block.data || [])
+  const [cursor, setCursor] = useState(block.next_cursor || null)
+  const [loading, setLoading] = useState(false)
+  const [pageError, setPageError] = useState(null)
+
+  const loadMore = async () => {
+    setLoading(true)
+    setPageError(null)
+    try {
+      const res = await api.get('blocks/page/', { params: { cursor } })
+      setData(rows => [...rows, ...res.data.data])
+      setCursor(res.data.next_cursor)
+    } catch (err) {
+      setPageError(err.response?.data?.error || 'Could not load more rows.')
+    } finally {
+      setLoading(false)
+    }
+  }
 
   if (!columns.length && !data.length) {
     return (
@@ -81,26 +113,32 @@ function DataTable({ block }) {
     )
   }
 
-  const cols = columns.length ? columns : Object.keys(truncated[0] || {})
+  const cols = columns.length ? columns : Object.keys(data[0] || {})
 
   return (
     <Wrapper>
       <Title>{block.title}</Title>
-      {isTruncated && (
-        <RowCount>⚠ Showing top 500 of {data.length} rows</RowCount>
+      {cursor && (
+        <RowCount>Showing first {data.length} rows</RowCount>
       )}
       <Table>
         <thead>
           <tr>{cols.map(col => <Th key={col}>{col}</Th>)}</tr>
         </thead>
         <tbody>
-          {truncated.map((row, i) => (
+          {data.map((row, i) => (
             <Tr key={i}>
               {cols.map(col => <Td key={col}>{formatCell(row[col])}</Td>)}
             </Tr>
           ))}
         </tbody>
       </Table>
+      {cursor && (
+        <LoadMore onClick={loadMore} disabled={loading}>
+          {loading ? 'Loading…' : 'Load more rows'}
+        </LoadMore>
+      )}
+      {pageError && <RowCount>⚠ {pageError}</RowCount>}
     </Wrapper>
   )
 }
@@ -149,12 +149,15 @@ function DynamicChart({ block }) {
   const data = Array.isArray(block.data) ? block.data : []
   const rawLength = data.length
 
+  // Data the server already downsampled is sized for the chart as is
+  const downsampling = block.downsampling
+
   // Task 4: enforce maximum of 8 series before any further slicing
-  const seriesLimited = data.slice(0, MAX_SERIES)
-  const isSeriesTruncated = rawLength > MAX_SERIES
+  const seriesLimited = downsampling ? data : data.slice(0, MAX_SERIES)
+  const isSeriesTruncated = !downsampling && rawLength > MAX_SERIES
 
-  const isTruncated = seriesLimited.length > 50
-  const chartData = seriesLimited.slice(0, 50)
+  const isTruncated = !downsampling && seriesLimited.length > 50
+  const chartData = downsampling ? data : seriesLimited.slice(0, 50)
 
   const x = block.x_axis
   const y = block.y_axis
@@ -267,6 +270,20 @@ function DynamicChart({ block }) {
         </StatsRow>
       )}
 
+      {downsampling && (
+        <TruncNote>
+          {downsampling.method === 'top_n'
+            ? `⚠ Top ${downsampling.rows - 1} of ${downsampling.original_rows} categories, rest grouped as "Other"`
+            : downsampling.method === 'time_bucket'
+              ? `⚠ ${downsampling.original_rows} rows grouped by ${downsampling.grain}`
+              : `⚠ Downsampled to ${downsampling.rows} of ${downsampling.original_rows} points`}
+        </TruncNote>
+      )}
+
+      {block.approximate && (
+        <TruncNote>≈ Estimated from a {(block.approximation.sample_fraction * 100).toFixed(1)}% sample</TruncNote>
+      )}
+
       {isSeriesTruncated && (
         <TruncNote>⚠ Showing top {MAX_SERIES} of {rawLength} series</TruncNote>
       )}
@@ -39,6 +39,13 @@ const Value = styled.div`
   line-height: 1;
 `
 
+const Margin = styled.div`
+  font-family: 'Space Mono', monospace;
+  font-size: 11px;
+  color: #ffb432;
+  letter-spacing: 0.05em;
+`
+
 const ErrorBadge = styled.div`
   font-family: 'Space Mono', monospace;
   font-size: 10px;
@@ -70,7 +77,10 @@ function KPICard({ block }) {
   return (
     <Card>
       <Title>{block.title}</Title>
-      <Value>{block.value ?? '—'}</Value>
+      <Value>{block.approximate && block.value != null ? '≈ ' : ''}{block.value ?? '—'}</Value>
+      {block.approximate && block.margin != null && (
+        <Margin>± {Math.round(block.margin).toLocaleString()} (95% confidence, sampled)</Margin>
+      )}
     </Card>
   )
 }